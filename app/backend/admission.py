@@ -0,0 +1,316 @@
+from collections import defaultdict, deque
+from typing import Any, Callable, Deque, Dict, Iterable, Optional
+from starlette.responses import JSONResponse
+from starlette.routing import BaseRoute, Match
+from starlette.types import ASGIApp, Receive, Scope, Send
+import asyncio
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+def route_key(routes: Iterable[BaseRoute], scope: Scope) -> str:
+    """
+    Method and route template of a request, e.g. "GET /tasks/{task_id}".
+    Stored in the scope, so every middleware matches the routes only once.
+    """
+    key = scope.get("route_key")
+    if key is None:
+        key = f"{scope['method']} {scope['path']}"
+        for route in routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                key = f"{scope['method']} {getattr(route, 'path', scope['path'])}"
+                break
+        scope["route_key"] = key
+    return key
+
+
+def parse_route_rules(rules: str, cast: Callable[[str], Any] = int) -> Dict[str, Any]:
+    """
+    Parse comma separated "METHOD /template=value" rules.
+
+    Args:
+        rules: The rules, e.g. "POST /tasks/=10,GET /rooms/{room_id}=30"
+        cast: Converts each value
+
+    Returns:
+        Values by route key; malformed rules are logged and skipped
+    """
+    parsed = {}
+    for rule in rules.split(","):
+        if not rule.strip():
+            continue
+        try:
+            route, value = rule.rsplit("=", 1)
+            method, path = route.split()
+            parsed[f"{method.upper()} {path}"] = cast(value)
+        except ValueError:
+            logger.warning(f"Ignoring malformed route rule: {rule}")
+    return parsed
+
+
+class AdaptiveLimit:
+    """
+    Concurrency limit that follows observed latency (gradient style).
+    A short-term and a long-term moving average of request latency are kept;
+    while the short-term one stays within `tolerance` of the long-term one the
+    limit grows by about sqrt(limit) per update, and once requests queue up and
+    latency rises the limit shrinks in proportion, by at most half. The limit
+    only grows while it is actually used, so an idle worker does not inflate it.
+    """
+
+    def __init__(
+        self,
+        initial: int = 20,
+        min_limit: int = 4,
+        max_limit: int = 200,
+        tolerance: float = 1.5,
+        smoothing: float = 0.2,
+        long_window: int = 600,
+    ):
+        """
+        Args:
+            initial: Limit before any request completed
+            min_limit: The limit never drops below this
+            max_limit: The limit never grows above this
+            tolerance: Ratio of short- to long-term latency taken as normal
+            smoothing: Weight of each update in the limit
+            long_window: Requests the long-term average spans
+        """
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.long_window = long_window
+        self.short_rtt = 0.0
+        self.long_rtt = 0.0
+
+    def update(self, rtt: float, inflight: int):
+        """
+        Adjust the limit after a request completed.
+
+        Args:
+            rtt: Seconds the request took
+            inflight: Requests in flight when it completed, itself included
+        """
+        if self.long_rtt == 0.0:
+            self.short_rtt = self.long_rtt = rtt
+        self.short_rtt += (rtt - self.short_rtt) * 0.1
+        self.long_rtt += (rtt - self.long_rtt) / self.long_window
+        # Latency came back down after an overload; let the baseline follow quickly
+        if self.long_rtt > 2 * self.short_rtt:
+            self.long_rtt *= 0.95
+
+        if inflight < self.limit / 2:
+            return
+        gradient = max(0.5, min(1.0, self.tolerance * self.long_rtt / max(self.short_rtt, 1e-6)))
+        target = self.limit * gradient + math.sqrt(self.limit)
+        limit = self.limit * (1 - self.smoothing) + target * self.smoothing
+        self.limit = max(float(self.min_limit), min(float(self.max_limit), limit))
+
+
+class AdmissionController:
+    """
+    Decides which requests a worker takes on, in priority order.
+    Exempt paths such as /health are always admitted. Reads may use the whole
+    adaptive limit and briefly queue for a slot when it is reached; writes are
+    only admitted while fewer than write_share of the limit is in flight and
+    are shed at once otherwise, so reads keep working when writes pile up.
+    Routes may also get a budget, a fixed number of slots or a share of the
+    limit, so one slow endpoint cannot take every slot.
+    Runs on the event loop, so no locking is needed.
+    """
+
+    def __init__(
+        self,
+        limit: AdaptiveLimit,
+        routes: Iterable[BaseRoute],
+        write_share: float = 0.75,
+        route_share: float = 1.0,
+        route_limits: Optional[str] = None,
+        exempt_paths: Iterable[str] = ("/health",),
+        queue_size: int = 50,
+        queue_timeout: float = 1.0,
+        retry_after: int = 1,
+    ):
+        """
+        Args:
+            limit: Adaptive limit on concurrent requests
+            routes: The app's routes, used to find a request's route template;
+                may still be filled in later
+            write_share: Share of the limit writes may use
+            route_share: Share of the limit a route may use unless configured,
+                1 for no default budget
+            route_limits: Comma separated "METHOD /template=limit" budgets, e.g.
+                "POST /tasks/=10,GET /rooms/{room_id}=30"
+            exempt_paths: Paths that are never limited
+            queue_size: Reads that may wait for a slot at once
+            queue_timeout: Seconds a read waits for a slot
+            retry_after: Seconds shed clients are asked to wait
+        """
+        self.limit = limit
+        self.routes = routes
+        self.write_share = write_share
+        self.route_share = route_share
+        self.route_limits = parse_route_rules(route_limits or "")
+        self.exempt_paths = set(exempt_paths)
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+        self.inflight = 0
+        self.route_inflight: Dict[str, int] = defaultdict(int)
+        self.queue: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.shed: Dict[str, int] = defaultdict(int)
+
+    def route_limit(self, key: str) -> Optional[int]:
+        if key in self.route_limits:
+            return self.route_limits[key]
+        if self.route_share >= 1:
+            return None
+        return max(1, math.floor(self.limit.limit * self.route_share))
+
+    async def acquire(self, key: str, read: bool) -> Optional[str]:
+        """
+        Admit a request or decide to shed it.
+
+        Args:
+            key: The request's route key
+            read: Whether the request only reads
+
+        Returns:
+            None if the request was admitted, otherwise the reason it was shed
+        """
+        route_limit = self.route_limit(key)
+        if route_limit is not None and self.route_inflight.get(key, 0) >= route_limit:
+            return "route"
+
+        limit = self.limit.limit
+        if not read:
+            if self.inflight >= limit * self.write_share:
+                return "write"
+        elif self.inflight >= limit or self.queue:
+            if len(self.queue) >= self.queue_size:
+                return "read"
+            if not await self.wait():
+                return "read"
+            self.route_inflight[key] += 1
+            self.admitted += 1
+            return None
+
+        self.inflight += 1
+        self.route_inflight[key] += 1
+        self.admitted += 1
+        return None
+
+    async def wait(self) -> bool:
+        """Queue for a slot; release() counts the slot in before waking the waiter."""
+        waiter = asyncio.get_running_loop().create_future()
+        self.queue.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            if waiter.done():
+                return True
+            self.queue.remove(waiter)
+            waiter.cancel()
+            return False
+        except asyncio.CancelledError:
+            # The client went away; hand on a slot it may have been given meanwhile
+            if waiter.done() and not waiter.cancelled():
+                self.inflight -= 1
+                self.wake()
+            else:
+                self.queue.remove(waiter)
+                waiter.cancel()
+            raise
+
+    def release(self, key: str, rtt: Optional[float]):
+        """
+        Free the slot of a finished request.
+
+        Args:
+            key: The request's route key
+            rtt: Seconds the request took, or None if it failed and says nothing about load
+        """
+        if rtt is not None:
+            self.limit.update(rtt, self.inflight)
+        self.inflight -= 1
+        self.route_inflight[key] -= 1
+        if not self.route_inflight[key]:
+            del self.route_inflight[key]
+        self.wake()
+
+    def wake(self):
+        while self.queue and self.inflight < self.limit.limit:
+            waiter = self.queue.popleft()
+            if not waiter.done():
+                self.inflight += 1
+                waiter.set_result(True)
+
+    def stats(self) -> Dict[str, Any]:
+        """Current limit, load and shed counts of this worker, for monitoring."""
+        return {
+            "limit": round(self.limit.limit, 1),
+            "inflight": self.inflight,
+            "queued": len(self.queue),
+            "admitted": self.admitted,
+            "shed": dict(self.shed),
+            "latency_ms_short": round(self.limit.short_rtt * 1000, 3),
+            "latency_ms_long": round(self.limit.long_rtt * 1000, 3),
+            "busiest_routes": sorted(self.route_inflight.items(), key=lambda item: -item[1])[:5],
+        }
+
+
+class AdmissionMiddleware:
+    """Shed requests the worker cannot take on with 503 and Retry-After."""
+
+    def __init__(self, app: ASGIApp, controller: AdmissionController):
+        """
+        Args:
+            app: The wrapped ASGI application
+            controller: Decides which requests are admitted
+        """
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        controller = self.controller
+        if scope["type"] != "http" or scope["path"] in controller.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+
+        key = route_key(controller.routes, scope)
+        reason = await controller.acquire(key, scope["method"] in READ_METHODS)
+        if reason is not None:
+            controller.shed[reason] += 1
+            response = JSONResponse(
+                {"detail": "Server is busy, retry later"},
+                status_code=503,
+                headers={"Retry-After": str(controller.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        rtt = None
+        try:
+            await self.app(scope, receive, send)
+            rtt = time.perf_counter() - start
+        except asyncio.CancelledError:
+            # Abandoned at its deadline: the time taken so far is a lower bound
+            # of its latency and must count, or an overload never shrinks the
+            # limit. A client that went away says nothing about load.
+            if scope.get("deadline_exceeded"):
+                rtt = time.perf_counter() - start
+            raise
+        finally:
+            controller.release(key, rtt)
@@ -1,14 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from jose import jwt, JWTError
 from datetime import datetime, timedelta, timezone
 import os
+import secrets
 from typing import Optional
 
-from app.backend.database import get_db, User, AuthToken
-from app.backend.models import MagicLinkRequest, MagicLinkResponse, TokenVerifyRequest, SessionResponse, CurrentUserResponse
-from app.backend.mailer import send_magic_link_email
+from config import settings
+from database import get_db, User, AuthToken
+from manager import redis_manager, rate_limiter, client_ip, request_email
+from models import MagicLinkRequest, MagicLinkResponse, TokenVerifyRequest, SessionResponse, CurrentUserResponse
+from mailer import send_magic_link_email
 
 # Configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-for-jwt")  # Change in production
@@ -44,7 +48,71 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def issue_login_token(db: Session, user_id: int) -> str:
+    """
+    Issue a single-use magic link token.
+    Tokens live in Redis with a TTL; the auth_tokens table is only used when
+    the database backend is configured or Redis is unavailable.
+    
+    Args:
+        db: Database session
+        user_id: ID of the user
+        
+    Returns:
+        The token string
+    """
+    if settings.AUTH_TOKEN_BACKEND == "redis":
+        token = secrets.token_urlsafe(32)
+        if redis_manager.store_auth_token(token, user_id, expire=settings.AUTH_TOKEN_EXPIRE_MINUTES * 60):
+            return token
+    
+    # Committed by the caller together with the rest of the login transaction
+    auth_token = AuthToken.create_token(
+        db, user_id, expires_in_minutes=settings.AUTH_TOKEN_EXPIRE_MINUTES, commit=False
+    )
+    return auth_token.token
+
+def redeem_login_token(db: Session, token: str) -> Optional[User]:
+    """
+    Consume a magic link token and record the login of its user.
+    
+    Args:
+        db: Database session
+        token: Token string to redeem
+        
+    Returns:
+        The logged in User if the token was valid, None otherwise
+    """
+    if settings.AUTH_TOKEN_BACKEND == "redis":
+        user_id = redis_manager.consume_auth_token(token)
+        if user_id is not None:
+            return User.record_login(db, user_id)
+    
+    # Tokens issued while Redis was unavailable live in the database
+    return AuthToken.redeem(db, token)
+
+def user_or_ip(request: Request) -> str:
+    """
+    Rate limit key: the authenticated user, or the client IP for anonymous callers.
+    The token is only decoded, not looked up, so limiting never touches the database.
+    
+    Args:
+        request: Incoming request
+        
+    Returns:
+        Rate limit key
+    """
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        try:
+            payload = jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM])
+            if payload.get("sub") is not None:
+                return f"user:{payload['sub']}"
+        except JWTError:
+            pass
+    return f"ip:{client_ip(request)}"
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     """
     Get the current user from the JWT token.
     
@@ -82,7 +150,29 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     
     return user
 
-@router.post("/login", response_model=MagicLinkResponse)
+async def require_operator(x_operator_token: Optional[str] = Header(None)):
+    """
+    Admit only operators, who send the OPERATOR_TOKEN in an X-Operator-Token header.
+    
+    Args:
+        x_operator_token: The token sent by the caller
+        
+    Raises:
+        HTTPException: If no operator token is configured or the token does not match
+    """
+    if not settings.OPERATOR_TOKEN or not x_operator_token or not secrets.compare_digest(
+        x_operator_token.encode(), settings.OPERATOR_TOKEN.encode()
+    ):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Operator token required")
+
+@router.post(
+    "/login",
+    response_model=MagicLinkResponse,
+    dependencies=[
+        Depends(rate_limiter.limit("login_ip", limit=20, window=60, key_func=client_ip)),
+        Depends(rate_limiter.limit("login_email", limit=5, window=900, key_func=request_email)),
+    ],
+)
 async def login(request: MagicLinkRequest, db: Session = Depends(get_db)):
     """
     Request a magic link for authentication.
@@ -94,22 +184,30 @@ async def login(request: MagicLinkRequest, db: Session = Depends(get_db)):
     Returns:
         Message confirming the magic link was sent
     """
-    # Get or create the user
-    user = User.get_or_create(db, request.email)
-    
-    # Create an auth token
-    auth_token = AuthToken.create_token(db, user.id)
+    # Get or create the user and issue a token in a single transaction,
+    # off the event loop since the session blocks
+    def start_login():
+        user = User.get_or_create(db, request.email, commit=False)
+        token = issue_login_token(db, user.id)
+        db.commit()
+        return user.email, token
+
+    email, token = await run_in_threadpool(start_login)
     
     # Send the magic link email
     await send_magic_link_email(
-        email=user.email,
-        token=auth_token.token
+        email=email,
+        token=token
     )
     
     return {"message": "Magic link sent to your email"}
 
-@router.post("/verify", response_model=SessionResponse)
-async def verify_token(request: TokenVerifyRequest, db: Session = Depends(get_db)):
+@router.post(
+    "/verify",
+    response_model=SessionResponse,
+    dependencies=[Depends(rate_limiter.limit("verify_ip", limit=30, window=60, key_func=client_ip))],
+)
+def verify_token(request: TokenVerifyRequest, db: Session = Depends(get_db)):
     """
     Verify a magic link token and return a JWT session token.
     
@@ -123,30 +221,18 @@ async def verify_token(request: TokenVerifyRequest, db: Session = Depends(get_db
     Raises:
         HTTPException: If token is invalid
     """
-    # Validate the token
-    user_id = AuthToken.validate_token(db, request.token)
+    # Consume the token and update the last login time
+    user = redeem_login_token(db, request.token)
     
-    if not user_id:
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid or expired token"
         )
     
-    # Get the user
-    user = db.query(User).filter(User.id == user_id).first()
-    
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
-    
-    # Update last login time
-    user.update_last_login(db)
-    
-    # Create access token
+    # Create access token (JWT requires the subject to be a string)
     access_token = create_access_token(
-        data={"sub": user.id}
+        data={"sub": str(user.id)}
     )
     
     return {
@@ -0,0 +1,62 @@
+"""
+Wire size and compression time of task list responses for each coding the
+CompressionMiddleware can negotiate, plus the cost of a compressed-body cache hit.
+
+Run from app/backend:
+
+    python benchmarks/bench_compression.py --sizes 100 1000 10000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_task_serialization import make_rows  # noqa: E402
+from compression import CompressionMiddleware  # noqa: E402
+from config import settings  # noqa: E402
+from serializers import render_json, task_rows_to_dicts  # noqa: E402
+
+
+def measure(func, *args, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    middleware = CompressionMiddleware(
+        app=None,
+        gzip_level=settings.COMPRESSION_GZIP_LEVEL,
+        brotli_quality=settings.COMPRESSION_BROTLI_QUALITY,
+        zstd_level=settings.COMPRESSION_ZSTD_LEVEL,
+    )
+    print(f"{'rows':>8} {'coding':>8} {'bytes':>10} {'ratio':>7} {'compress':>12} {'cache hit':>12}")
+    for size in args.sizes:
+        body = render_json(task_rows_to_dicts(make_rows(size)))
+        print(f"{size:>8} {'identity':>8} {len(body):>10} {1:>7.2f}")
+        for encoding in middleware.encodings:
+            compressor = middleware.compressors[encoding]
+            compressed = compressor(body)
+            elapsed = measure(compressor, body, repeat=args.repeat)
+            # Prime the cache, then time a lookup of the same body
+            asyncio.run(middleware.compress(encoding, body))
+            hit = measure(lambda: asyncio.run(middleware.compress(encoding, body)), repeat=args.repeat)
+            print(
+                f"{'':>8} {encoding:>8} {len(compressed):>10} {len(body) / len(compressed):>7.2f}"
+                f" {elapsed * 1e3:>9.2f} ms {hit * 1e3:>9.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Error window of Redis writes during a Sentinel failover, with the backend's
+failover handling (cached addresses, blocking pools, Sentinel event listener)
+and with plain redis-py Sentinel clients for comparison.
+
+Starts a throwaway master, replica and Sentinel from local redis-server and
+redis-sentinel binaries, writes continuously from one client, then fails the
+master over:
+
+    kill: the master process is killed; connections are refused
+    hang: the master stops answering (SIGSTOP); commands time out
+
+Run from app/backend:
+
+    python benchmarks/bench_redis_failover.py --mode kill hang
+"""
+import argparse
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from redis import Redis
+from redis.sentinel import Sentinel
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from failover import BlockingSentinelConnectionPool, CachingSentinel, SentinelFailoverListener  # noqa: E402
+
+SERVICE = "mymaster"
+SOCKET_TIMEOUT = 0.5
+
+
+def wait_until(check, timeout: float, interval: float = 0.1) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return True
+        except Exception:
+            pass
+        time.sleep(interval)
+    return False
+
+
+class Topology:
+    """A master, one replica and one Sentinel on local ports."""
+
+    def __init__(self, args, base_port: int):
+        self.args = args
+        self.master_port = base_port
+        self.replica_port = base_port + 1
+        self.sentinel_port = base_port + 2
+        self.dir = tempfile.mkdtemp(prefix="bench-failover-")
+        self.processes = {}
+
+    def start_server(self, name: str, port: int, *extra: str):
+        command = [self.args.redis_server, "--port", str(port), "--save", "", "--appendonly", "no", "--dir", self.dir, *extra]
+        self.processes[name] = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def start(self):
+        self.start_server("master", self.master_port)
+        self.start_server("replica", self.replica_port, "--replicaof", "127.0.0.1", str(self.master_port))
+
+        config = os.path.join(self.dir, "sentinel.conf")
+        with open(config, "w") as f:
+            f.write(
+                f"port {self.sentinel_port}\n"
+                f"dir {self.dir}\n"
+                f"sentinel monitor {SERVICE} 127.0.0.1 {self.master_port} 1\n"
+                f"sentinel down-after-milliseconds {SERVICE} {self.args.down_after_ms}\n"
+                f"sentinel failover-timeout {SERVICE} 10000\n"
+                f"sentinel parallel-syncs {SERVICE} 1\n"
+            )
+        self.processes["sentinel"] = subprocess.Popen(
+            [self.args.redis_sentinel, config], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+
+        sentinel = Redis(port=self.sentinel_port, socket_timeout=1)
+        if not wait_until(lambda: len(sentinel.sentinel_slaves(SERVICE)) == 1, timeout=30):
+            raise RuntimeError("Sentinel did not discover the replica")
+
+    def fail_master(self, mode: str):
+        process = self.processes["master"]
+        process.send_signal(signal.SIGKILL if mode == "kill" else signal.SIGSTOP)
+
+    def stop(self):
+        for process in self.processes.values():
+            process.send_signal(signal.SIGCONT)
+            process.kill()
+            process.wait()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def plain_client(topology: Topology):
+    sentinel = Sentinel([("127.0.0.1", topology.sentinel_port)], socket_timeout=1)
+    return sentinel.master_for(SERVICE, socket_timeout=SOCKET_TIMEOUT), None
+
+
+def backend_client(topology: Topology):
+    sentinel = CachingSentinel([("127.0.0.1", topology.sentinel_port)], socket_timeout=1)
+    clients = [
+        factory(
+            SERVICE,
+            connection_pool_class=BlockingSentinelConnectionPool,
+            socket_timeout=SOCKET_TIMEOUT,
+            max_connections=10,
+            timeout=5,
+        )
+        for factory in (sentinel.master_for, sentinel.slave_for)
+    ]
+    listener = SentinelFailoverListener(sentinel, SERVICE, clients[0].connection_pool, clients[1].connection_pool)
+    listener.start()
+    return clients[0], listener
+
+
+def run(args, mode: str, variant: str, base_port: int) -> dict:
+    topology = Topology(args, base_port)
+    topology.start()
+    client, listener = (backend_client if variant == "backend" else plain_client)(topology)
+    results = []
+    stop = threading.Event()
+
+    def write():
+        counter = 0
+        while not stop.is_set():
+            start = time.monotonic()
+            try:
+                client.set("bench:failover", counter)
+                ok = True
+            except Exception:
+                ok = False
+            results.append((start, time.monotonic() - start, ok))
+            counter += 1
+            time.sleep(args.interval)
+
+    writer = threading.Thread(target=write)
+    try:
+        writer.start()
+        time.sleep(1.0)
+        failed_at = time.monotonic()
+        topology.fail_master(mode)
+        time.sleep(args.duration)
+    finally:
+        stop.set()
+        writer.join()
+        if listener is not None:
+            listener.stop()
+        topology.stop()
+
+    failures = [start for start, _, ok in results if not ok]
+    recovered = [start for start, _, ok in results if ok and failures and start > failures[-1]]
+    return {
+        "ops": len(results),
+        "failed": len(failures),
+        "window": (failures[-1] - failed_at) if failures else 0.0,
+        "recovered": (recovered[0] - failed_at) if recovered else (None if failures else 0.0),
+        "max_latency": max(latency for _, latency, _ in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", nargs="+", choices=["kill", "hang"], default=["kill", "hang"])
+    parser.add_argument("--redis-server", default=shutil.which("redis-server") or "redis-server")
+    parser.add_argument("--redis-sentinel", default=shutil.which("redis-sentinel") or "redis-sentinel")
+    parser.add_argument("--base-port", type=int, default=26400)
+    parser.add_argument("--down-after-ms", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to keep writing after the failure")
+    parser.add_argument("--interval", type=float, default=0.005, help="seconds between writes")
+    args = parser.parse_args()
+
+    print(f"{'mode':>6} {'client':>8} {'ops':>7} {'failed':>7} {'errors until':>13} {'recovered at':>13} {'max op':>9}")
+    port = args.base_port
+    for mode in args.mode:
+        for variant in ("plain", "backend"):
+            result = run(args, mode, variant, port)
+            port += 10
+            recovered = f"{result['recovered']:>11.2f} s" if result["recovered"] is not None else f"{'never':>13}"
+            print(
+                f"{mode:>6} {variant:>8} {result['ops']:>7} {result['failed']:>7}"
+                f" {result['window']:>11.2f} s {recovered} {result['max_latency'] * 1e3:>6.0f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
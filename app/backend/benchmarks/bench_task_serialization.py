@@ -0,0 +1,92 @@
+"""
+Per-row cost of serializing task lists: the response_model path versus the
+orjson fast path used by the task endpoints.
+
+The slow path mirrors what FastAPI does with ORM objects returned from an
+endpoint: validate every object into TaskResponse (from_attributes), dump it
+to JSON-compatible Python, then encode with json.dumps. The fast path takes
+row tuples as returned by select(*Task.response_columns()) and encodes them
+with orjson directly.
+
+Run from app/backend:
+
+    python benchmarks/bench_task_serialization.py --sizes 1000 100000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pydantic import TypeAdapter  # noqa: E402
+
+from models import TaskResponse  # noqa: E402
+from serializers import TASK_FIELDS, render_json, task_rows_to_dicts  # noqa: E402
+
+
+def make_rows(count: int) -> List[tuple]:
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return [
+        (
+            i,
+            f"Task {i}",
+            f"Description for task {i}" if i % 3 else None,
+            bool(i % 2),
+            now + timedelta(days=i % 30) if i % 4 else None,
+            i % 50 or None,
+            None,
+            now - timedelta(minutes=i),
+            now,
+            i % 7 + 1,
+        )
+        for i in range(1, count + 1)
+    ]
+
+
+def slow_path(objects: list, adapter: TypeAdapter) -> bytes:
+    validated = adapter.validate_python(objects, from_attributes=True)
+    content = adapter.dump_python(validated, mode="json")
+    # Starlette's JSONResponse.render
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def fast_path(rows: List[tuple]) -> bytes:
+    return render_json(task_rows_to_dicts(rows))
+
+
+def measure(func, *args, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    adapter = TypeAdapter(List[TaskResponse])
+    print(f"{'rows':>8} {'response_model':>16} {'orjson':>12} {'speedup':>8}")
+    for size in args.sizes:
+        rows = make_rows(size)
+        # ORM objects expose the same values as attributes
+        objects = [SimpleNamespace(**dict(zip(TASK_FIELDS, row))) for row in rows]
+
+        slow = measure(slow_path, objects, adapter, repeat=args.repeat)
+        fast = measure(fast_path, rows, repeat=args.repeat)
+        print(
+            f"{size:>8} {slow / size * 1e6:>13.2f} us {fast / size * 1e6:>9.2f} us {slow / fast:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Local SMTP sink for exercising the mail outbox without a real mail server.
+
+Accepts every message, optionally waits before answering to simulate a slow
+server, and reports how many messages and connections it has seen. Point the
+backend at it with:
+
+    MAIL_SERVER=localhost MAIL_PORT=1025 MAIL_STARTTLS=false python benchmarks/smtp_sink.py
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger("smtp_sink")
+
+
+class SMTPSink:
+    """
+    A minimal SMTP server that discards messages after counting them.
+    """
+
+    def __init__(self, latency: float = 0.0, verbose: bool = False):
+        self.latency = latency
+        self.verbose = verbose
+        self.connections = 0
+        self.messages = 0
+        self.started_at = time.monotonic()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Serve one SMTP session.
+        """
+        self.connections += 1
+        writer.write(b"220 smtp-sink ESMTP ready\r\n")
+        await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode(errors="replace").strip().upper()
+
+                if command.startswith("EHLO"):
+                    writer.write(b"250-smtp-sink\r\n250-PIPELINING\r\n250-8BITMIME\r\n250 AUTH PLAIN\r\n")
+                elif command.startswith("HELO"):
+                    writer.write(b"250 smtp-sink\r\n")
+                elif command.startswith("AUTH"):
+                    writer.write(b"235 2.7.0 Authentication successful\r\n")
+                elif command.startswith(("MAIL", "RCPT", "RSET", "NOOP")):
+                    writer.write(b"250 OK\r\n")
+                elif command == "DATA":
+                    writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                    await writer.drain()
+                    await self._read_message(reader)
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    self.messages += 1
+                    writer.write(b"250 OK: queued\r\n")
+                elif command == "QUIT":
+                    writer.write(b"221 Bye\r\n")
+                    await writer.drain()
+                    break
+                else:
+                    writer.write(b"502 Command not implemented\r\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _read_message(self, reader: asyncio.StreamReader):
+        """
+        Consume a message body up to the terminating dot line.
+        """
+        lines = []
+        while True:
+            line = await reader.readline()
+            if not line or line == b".\r\n":
+                break
+            lines.append(line)
+        if self.verbose:
+            logger.info(b"".join(lines).decode(errors="replace"))
+
+    async def report(self, interval: float):
+        """
+        Periodically log throughput.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            elapsed = time.monotonic() - self.started_at
+            logger.info(
+                f"{self.messages} messages over {self.connections} connections "
+                f"({self.messages / elapsed:.1f} msg/s)"
+            )
+
+
+async def serve(host: str, port: int, latency: float, verbose: bool, report_interval: float):
+    sink = SMTPSink(latency=latency, verbose=verbose)
+    server = await asyncio.start_server(sink.handle, host, port)
+    logger.info(f"SMTP sink listening on {host}:{port} (latency {latency * 1000:.0f}ms)")
+    asyncio.create_task(sink.report(report_interval))
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1025)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before accepting each message")
+    parser.add_argument("--verbose", action="store_true", help="log every message body")
+    parser.add_argument("--report-interval", type=float, default=10.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(args.host, args.port, args.latency, args.verbose, args.report_interval))
@@ -0,0 +1,126 @@
+from typing import Callable, Iterable, List, Optional
+import hashlib
+import logging
+import math
+
+from manager import RedisManager
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Add an item: set its bits in the live filter (only once it has been built,
+# otherwise a filter holding a single item would reject everything else) and
+# in the filter of items added since the last rebuild started.
+# KEYS: filter, recent filter
+# ARGV: bit offsets...
+ADD_SCRIPT = """
+local live = redis.call('EXISTS', KEYS[1]) == 1
+for i = 1, #ARGV do
+    if live then
+        redis.call('SETBIT', KEYS[1], ARGV[i], 1)
+    end
+    redis.call('SETBIT', KEYS[2], ARGV[i], 1)
+end
+return 1
+"""
+
+# Swap in a rebuilt filter, keeping items added while it was being built.
+# KEYS: rebuilt filter, recent filter, filter
+SWAP_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    redis.call('BITOP', 'OR', KEYS[1], KEYS[1], KEYS[2])
+end
+redis.call('RENAME', KEYS[1], KEYS[3])
+return 1
+"""
+
+
+class RedisBloomFilter:
+    """
+    Bloom filter kept as a Redis bitmap and shared by all workers.
+    It answers "definitely absent" without a database query; deleted items
+    cannot be removed, so the filter is rebuilt periodically from the source.
+    A filter that has not been built yet never rejects anything.
+    """
+
+    def __init__(self, redis_manager: RedisManager, key: str, capacity: int, error_rate: float = 0.01):
+        """
+        Args:
+            redis_manager: Redis manager whose master holds the bitmap
+            key: Redis key of the bitmap
+            capacity: Expected number of items; more raise the false positive rate
+            error_rate: False positive rate at capacity
+        """
+        self.redis_manager = redis_manager
+        self.key = key
+        self.recent_key = f"{key}:recent"
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.scripts = {
+            "add": redis_manager.master.register_script(ADD_SCRIPT),
+            "swap": redis_manager.master.register_script(SWAP_SCRIPT),
+        }
+
+    def offsets(self, item: int) -> List[int]:
+        """Bit offsets of an item, by double hashing one 128-bit digest."""
+        digest = hashlib.blake2b(str(item).encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    @tracer.traced("redis.bloom.add", "client")
+    def add(self, item: int) -> bool:
+        """
+        Add an item, e.g. right after it was created.
+        If the add fails, the filter is dropped rather than left rejecting
+        the item; lookups fall through to the source until the next rebuild.
+
+        Args:
+            item: The item to add
+
+        Returns:
+            bool: Success status
+        """
+        try:
+            self.scripts["add"](keys=[self.key, self.recent_key], args=self.offsets(item))
+            return True
+        except Exception as e:
+            logger.error(f"Bloom filter add error for key {self.key}, dropping the filter: {e}")
+            if not self.redis_manager.delete(self.key):
+                logger.error(f"Bloom filter {self.key} may reject item {item} until it is rebuilt")
+            return False
+
+    @tracer.traced("redis.bloom.rebuild", "client")
+    def rebuild(self, load_items: Callable[[], Iterable[int]], lock_for: int = 0) -> Optional[int]:
+        """
+        Rebuild the filter from the source of truth.
+        Items added after the rebuild starts are merged in when the new bitmap
+        is swapped in, so concurrent adds are never lost.
+
+        Args:
+            load_items: Returns every item that currently exists
+            lock_for: Seconds to hold a lock so only one worker rebuilds per period
+
+        Returns:
+            Number of items in the new filter, or None if another worker holds the lock
+        """
+        master = self.redis_manager.master
+        if lock_for and not master.set(f"{self.key}:lock", "1", nx=True, ex=lock_for):
+            return None
+
+        # Adds from now on land in the recent filter as well as the live one
+        master.delete(self.recent_key)
+
+        bits = bytearray(self.size // 8 + 1)
+        count = 0
+        for item in load_items():
+            for offset in self.offsets(item):
+                # Redis bitmaps number bits from the most significant bit of each byte
+                bits[offset >> 3] |= 0x80 >> (offset & 7)
+            count += 1
+
+        rebuilt_key = f"{self.key}:rebuild"
+        master.set(rebuilt_key, bytes(bits))
+        self.scripts["swap"](keys=[rebuilt_key, self.recent_key, self.key])
+        logger.info(f"Rebuilt bloom filter {self.key} with {count} items")
+        return count
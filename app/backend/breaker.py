@@ -0,0 +1,228 @@
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit breaker is open."""
+
+    def __init__(self, breaker: "CircuitBreaker"):
+        self.breaker = breaker
+        self.retry_after = breaker.retry_after()
+        super().__init__(f"Circuit breaker {breaker.name} is open; retry in {self.retry_after:.1f}s")
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker over a rolling window of call outcomes.
+
+    closed: calls pass; outcomes are counted in per-second buckets. Once the
+        window holds min_calls calls and the share of failed or slow calls
+        reaches its threshold, the breaker opens.
+    open: calls are refused at once for open_duration seconds, so a degraded
+        dependency costs nothing instead of a timeout per request.
+    half_open: one probe call is let through; its outcome closes the breaker
+        or opens it again. A probe that never reports back is replaced after
+        open_duration seconds. Each probe gets a token from allow(); outcomes
+        recorded without the current token, e.g. of calls that were already
+        in flight when the breaker opened, are ignored until it closes.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        window: float = 10.0,
+        min_calls: int = 20,
+        failure_rate: float = 0.5,
+        slow_call_duration: float = 1.0,
+        slow_call_rate: float = 0.8,
+        open_duration: float = 5.0,
+    ):
+        """
+        Args:
+            name: Name of the guarded dependency, used in logs and state exports
+            window: Seconds of recent calls the rates are computed over
+            min_calls: Calls the window must hold before the breaker may open
+            failure_rate: Share of failed calls that opens the breaker
+            slow_call_duration: Seconds after which a successful call counts as slow
+            slow_call_rate: Share of slow calls that opens the breaker
+            open_duration: Seconds the breaker stays open before probing
+        """
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate = slow_call_rate
+        self.open_duration = open_duration
+
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probe_started_at = 0.0
+        # Token of the current probe; tokens are never reused
+        self.probe = 0
+        self.times_opened = 0
+        # [second, calls, failures, slow calls], oldest first
+        self.buckets: Deque[List[int]] = deque()
+        breakers[name] = self
+
+    def allow(self) -> Optional[int]:
+        """
+        Decide whether a call may go to the dependency now.
+
+        Returns:
+            None if the call must not be made, the probe's token if it is the
+            half-open probe, or 0 for an ordinary call
+        """
+        if self.state == self.CLOSED:
+            return 0
+
+        now = time.monotonic()
+        with self.lock:
+            if self.state == self.OPEN:
+                if now - self.opened_at < self.open_duration:
+                    return None
+                self.transition(self.HALF_OPEN)
+                return self.start_probe(now)
+            if self.state == self.HALF_OPEN and now - self.probe_started_at >= self.open_duration:
+                return self.start_probe(now)
+            return 0 if self.state == self.CLOSED else None
+
+    def check(self) -> int:
+        """
+        Refuse a call while the breaker is open.
+
+        Returns:
+            The token to pass to record(), see allow()
+
+        Raises:
+            CircuitOpenError: If the call must not go to the dependency
+        """
+        probe = self.allow()
+        if probe is None:
+            raise CircuitOpenError(self)
+        return probe
+
+    def record(self, success: bool, duration: float = 0.0, probe: int = 0):
+        """
+        Record the outcome of a call.
+
+        Args:
+            success: Whether the dependency answered
+            duration: Seconds the call took
+            probe: Token check() or allow() returned for the call
+        """
+        slow = success and duration >= self.slow_call_duration
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                if not probe or probe != self.probe:
+                    return
+                if success and not slow:
+                    self.buckets.clear()
+                    self.transition(self.CLOSED)
+                else:
+                    self.open()
+                return
+            if self.state == self.OPEN:
+                return
+
+            second = int(time.monotonic())
+            self.expire(second)
+            if not self.buckets or self.buckets[-1][0] != second:
+                self.buckets.append([second, 0, 0, 0])
+            bucket = self.buckets[-1]
+            bucket[1] += 1
+            bucket[2] += not success
+            bucket[3] += slow
+
+            calls, failures, slow_calls = self.totals()
+            if calls >= self.min_calls and (
+                failures >= calls * self.failure_rate or slow_calls >= calls * self.slow_call_rate
+            ):
+                self.open()
+
+    def reset(self):
+        """Close the breaker, e.g. once the dependency is known to have been replaced."""
+        with self.lock:
+            self.buckets.clear()
+            if self.state != self.CLOSED:
+                self.transition(self.CLOSED)
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker lets a probe through."""
+        if self.state == self.CLOSED:
+            return 0.0
+        started = self.opened_at if self.state == self.OPEN else self.probe_started_at
+        return max(0.0, started + self.open_duration - time.monotonic())
+
+    def snapshot(self) -> Dict[str, Any]:
+        """State and window counts, for monitoring."""
+        with self.lock:
+            self.expire(int(time.monotonic()))
+            calls, failures, slow_calls = self.totals()
+            state = self.state
+        return {
+            "state": state,
+            "calls": calls,
+            "failures": failures,
+            "slow_calls": slow_calls,
+            "failure_rate": round(failures / calls, 3) if calls else 0.0,
+            "slow_call_rate": round(slow_calls / calls, 3) if calls else 0.0,
+            "times_opened": self.times_opened,
+            "retry_after": round(self.retry_after(), 3),
+        }
+
+    # The helpers below expect self.lock to be held
+
+    def start_probe(self, now: float) -> int:
+        self.probe_started_at = now
+        self.probe += 1
+        return self.probe
+
+    def open(self):
+        self.opened_at = time.monotonic()
+        self.times_opened += 1
+        self.buckets.clear()
+        self.transition(self.OPEN)
+
+    def transition(self, state: str):
+        if state == self.state:
+            return
+        log = logger.warning if state == self.OPEN else logger.info
+        log(f"Circuit breaker {self.name}: {self.state} -> {state}")
+        self.state = state
+
+    def expire(self, second: int):
+        while self.buckets and self.buckets[0][0] <= second - self.window:
+            self.buckets.popleft()
+
+    def totals(self):
+        calls = failures = slow_calls = 0
+        for _, bucket_calls, bucket_failures, bucket_slow in self.buckets:
+            calls += bucket_calls
+            failures += bucket_failures
+            slow_calls += bucket_slow
+        return calls, failures, slow_calls
+
+
+# Every breaker by name, for monitoring
+breakers: Dict[str, CircuitBreaker] = {}
+
+
+def breaker_states() -> Dict[str, Dict[str, Any]]:
+    """Snapshots of every circuit breaker of this worker."""
+    return {name: breaker.snapshot() for name, breaker in breakers.items()}
+
+
+def create_breaker(name: str, options: Optional[Dict[str, Any]]) -> Optional[CircuitBreaker]:
+    """Create a breaker from settings, or None when breakers are disabled."""
+    return CircuitBreaker(name, **options) if options is not None else None
@@ -0,0 +1,337 @@
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import anyio
+import hashlib
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional; gzip is always available
+    zstandard = None
+
+# Server preference when the client weighs several codings equally
+PREFERRED_ENCODINGS = ("br", "zstd", "gzip")
+
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+}
+
+
+def is_compressible(content_type: str) -> bool:
+    """Check whether a media type is worth compressing."""
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    return (
+        media_type.startswith("text/")
+        or media_type in COMPRESSIBLE_TYPES
+        or media_type.endswith("+json")
+        or media_type.endswith("+xml")
+    )
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """
+    Parse an Accept-Encoding header into codings and their q-values.
+
+    Args:
+        header: The raw header value, e.g. "gzip;q=0.8, br"
+
+    Returns:
+        Mapping of lower-cased coding to q-value
+    """
+    codings = {}
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[coding] = q
+    return codings
+
+
+class GzipStream:
+    def __init__(self, level: int):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        # Sync flush so every chunk reaches the client as soon as it is produced
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes) -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush()
+
+
+class BrotliStream:
+    def __init__(self, quality: int):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self, data: bytes) -> bytes:
+        return self.compressor.process(data) + self.compressor.finish()
+
+
+class ZstdStream:
+    def __init__(self, level: int):
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self, data: bytes) -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush()
+
+
+class CompressedBodyCache:
+    """
+    LRU cache of compressed bodies keyed by coding and the identity of the body.
+    Cached responses such as the task list produce identical bodies until the
+    next write, so their compressed form is reused instead of recompressed.
+    A strong ETag together with the request path identifies the body for free;
+    otherwise it is hashed with SHA-1, which is several times cheaper than
+    brotli or gzip on large lists.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        # A single huge body must not evict everything else
+        self.max_entry_bytes = max_bytes // 8
+        self.size = 0
+        self.entries: "OrderedDict[Tuple[str, bytes], bytes]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(encoding: str, body: bytes, etag: Optional[str] = None, path: str = "") -> Tuple[str, bytes]:
+        # ETags are only unique per resource, so they are scoped by path
+        if etag and not etag.startswith("W/"):
+            return encoding, f"{path} {etag}".encode("latin-1")
+        return encoding, hashlib.sha1(body, usedforsecurity=False).digest()
+
+    def get(self, key: Tuple[str, bytes]) -> Optional[bytes]:
+        compressed = self.entries.get(key)
+        if compressed is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return compressed
+
+    def put(self, key: Tuple[str, bytes], compressed: bytes) -> None:
+        if len(compressed) > self.max_entry_bytes or key in self.entries:
+            return
+        self.entries[key] = compressed
+        self.size += len(compressed)
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+
+class CompressionMiddleware:
+    """
+    Compress responses with brotli, zstd or gzip depending on Accept-Encoding.
+    Bodies below minimum_size are sent as-is since the framing overhead outweighs
+    the savings. Streaming responses are compressed chunk by chunk.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 5,
+        zstd_level: int = 3,
+        cache_size: int = 32 * 1024 * 1024,
+        offload_size: int = 256 * 1024,
+    ):
+        """
+        Args:
+            app: The wrapped ASGI application
+            minimum_size: Smallest body in bytes that gets compressed
+            gzip_level: zlib compression level
+            brotli_quality: Brotli quality; mid-range values suit dynamic content
+            zstd_level: Zstandard compression level
+            cache_size: Bytes of compressed bodies to keep; 0 disables the cache
+            offload_size: Bodies larger than this are compressed in a worker thread
+        """
+        self.app = app
+        self.minimum_size = minimum_size
+        self.offload_size = offload_size
+        self.cache = CompressedBodyCache(cache_size) if cache_size > 0 else None
+
+        self.compressors: Dict[str, Callable[[bytes], bytes]] = {
+            "gzip": lambda body: GzipStream(gzip_level).finish(body),
+        }
+        self.streams: Dict[str, Callable[[], object]] = {
+            "gzip": lambda: GzipStream(gzip_level),
+        }
+        if brotli is not None:
+            self.compressors["br"] = lambda body: brotli.compress(body, quality=brotli_quality)
+            self.streams["br"] = lambda: BrotliStream(brotli_quality)
+        if zstandard is not None:
+            # ZstdCompressor is not thread-safe, so each call gets its own
+            self.compressors["zstd"] = lambda body: zstandard.ZstdCompressor(level=zstd_level).compress(body)
+            self.streams["zstd"] = lambda: ZstdStream(zstd_level)
+
+    @property
+    def encodings(self) -> List[str]:
+        return [encoding for encoding in PREFERRED_ENCODINGS if encoding in self.compressors]
+
+    def negotiate(self, accept_encoding: str) -> Optional[str]:
+        """
+        Pick the coding to use for a request.
+
+        Args:
+            accept_encoding: The Accept-Encoding header
+
+        Returns:
+            The coding with the highest q-value, or None to send the body as-is
+        """
+        if not accept_encoding:
+            return None
+        accepted = parse_accept_encoding(accept_encoding)
+        wildcard = accepted.get("*", 0.0)
+
+        best, best_q = None, 0.0
+        for encoding in self.encodings:
+            q = accepted.get(encoding, wildcard)
+            if q > best_q:
+                best, best_q = encoding, q
+        return best
+
+    async def compress(self, encoding: str, body: bytes, etag: Optional[str] = None, path: str = "") -> bytes:
+        """
+        Compress a complete body, reusing a cached result when possible.
+
+        Args:
+            encoding: The negotiated coding
+            body: The uncompressed body
+            etag: The response ETag, if any
+            path: The request path the ETag belongs to
+
+        Returns:
+            The compressed body
+        """
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(encoding, body, etag, path)
+            compressed = self.cache.get(key)
+            if compressed is not None:
+                return compressed
+
+        compressor = self.compressors[encoding]
+        if len(body) > self.offload_size:
+            # Keep the event loop responsive while large lists are compressed
+            compressed = await anyio.to_thread.run_sync(compressor, body)
+        else:
+            compressed = compressor(body)
+
+        if key is not None:
+            self.cache.put(key, compressed)
+        return compressed
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = self.negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = CompressionResponder(self, encoding, send, scope.get("path", ""))
+        await self.app(scope, receive, responder.send)
+
+
+class CompressionResponder:
+    """Per-request send wrapper that decides whether and how to compress."""
+
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send: Send, path: str = ""):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.path = path
+        self.downstream = send
+        self.start_message: Optional[Message] = None
+        self.stream = None
+        self.passthrough = False
+
+    def should_compress(self, headers: MutableHeaders) -> bool:
+        status_code = self.start_message["status"]
+        if status_code < 200 or status_code in (204, 304):
+            return False
+        if "content-encoding" in headers:
+            return False
+        if "no-transform" in headers.get("cache-control", "").lower():
+            return False
+        return is_compressible(headers.get("content-type", ""))
+
+    def mark_encoded(self, headers: MutableHeaders) -> None:
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+
+    async def send(self, message: Message) -> None:
+        message_type = message["type"]
+
+        if message_type == "http.response.start":
+            # Hold the headers back until the first body chunk shows the response size
+            self.start_message = message
+            return
+
+        if message_type != "http.response.body" or self.passthrough:
+            await self.downstream(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.stream is not None:
+            if more_body:
+                chunk = self.stream.compress(body)
+            else:
+                chunk = self.stream.finish(body)
+            await self.downstream({"type": "http.response.body", "body": chunk, "more_body": more_body})
+            return
+
+        headers = MutableHeaders(raw=self.start_message["headers"])
+
+        if not self.should_compress(headers) or (not more_body and len(body) < self.middleware.minimum_size):
+            self.passthrough = True
+            await self.downstream(self.start_message)
+            await self.downstream(message)
+            return
+
+        self.mark_encoded(headers)
+
+        if not more_body:
+            compressed = await self.middleware.compress(self.encoding, body, headers.get("etag"), self.path)
+            headers["Content-Length"] = str(len(compressed))
+            await self.downstream(self.start_message)
+            await self.downstream({"type": "http.response.body", "body": compressed})
+            return
+
+        # Streaming response: the final length is unknown, so send it chunked
+        del headers["Content-Length"]
+        self.stream = self.middleware.streams[self.encoding]()
+        await self.downstream(self.start_message)
+        await self.downstream(
+            {"type": "http.response.body", "body": self.stream.compress(body), "more_body": True}
+        )
@@ -1,4 +1,5 @@
 from pydantic_settings import BaseSettings
+from typing import Optional
 import os
 from dotenv import load_dotenv
 
@@ -17,6 +18,10 @@ class Setting(BaseSettings):
     DB_PASSWORD: str = os.getenv("DB_PASSWORD", "mypassword")
     DB_NAME: str = os.getenv("DB_NAME", "mydb")
     
+    # Connection budgets for the whole instance, shared by its worker processes
+    DB_MAX_CONNECTIONS: int = int(os.getenv("DB_MAX_CONNECTIONS", "20"))
+    REDIS_MAX_CONNECTIONS: int = int(os.getenv("REDIS_MAX_CONNECTIONS", "100"))
+    
     # Database URL
     DATABASE_URL: str = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
     
@@ -27,6 +32,123 @@ class Setting(BaseSettings):
     REDIS_PASSWORD: str = os.getenv("REDIS_PASSWORD", "redis_password")
     REDIS_SENTINEL: bool = os.getenv("REDIS_SENTINEL", "True").lower() == "true"
     REDIS_SENTINEL_MASTER: str = os.getenv("REDIS_SENTINEL_MASTER", "mymaster")
+    REDIS_SENTINEL_HOSTS: str = os.getenv("REDIS_SENTINEL_HOSTS", "redis-sentinel")
+    REDIS_SENTINEL_PORT: int = int(os.getenv("REDIS_SENTINEL_PORT", "26379"))
+    REDIS_SERVICE_NAME: str = os.getenv("REDIS_SERVICE_NAME", "mymaster")
+    REDIS_CONNECTION_POOL_SIZE: int = int(os.getenv("REDIS_CONNECTION_POOL_SIZE", "0"))  # per-worker cap of each pool, 0 for no cap
+    REDIS_CONNECTION_POOL_TIMEOUT: float = float(os.getenv("REDIS_CONNECTION_POOL_TIMEOUT", "5"))  # seconds to wait for a pooled connection
+    REDIS_SOCKET_TIMEOUT: float = float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.5"))  # seconds
+    REDIS_SOCKET_CONNECT_TIMEOUT: float = float(os.getenv("REDIS_SOCKET_CONNECT_TIMEOUT", "1.0"))  # seconds
+    REDIS_RETRY_ON_TIMEOUT: bool = os.getenv("REDIS_RETRY_ON_TIMEOUT", "True").lower() == "true"
+    REDIS_SENTINEL_ADDRESS_TTL: float = float(os.getenv("REDIS_SENTINEL_ADDRESS_TTL", "60"))  # seconds master/replica addresses are cached
+    REDIS_FAILOVER_LISTENER: bool = os.getenv("REDIS_FAILOVER_LISTENER", "True").lower() == "true"  # follow Sentinel failover events
+    
+    # Room deletion settings
+    ROOM_DELETE_BATCH_SIZE: int = int(os.getenv("ROOM_DELETE_BATCH_SIZE", "500"))
+    ROOM_DELETE_BATCH_PAUSE: float = float(os.getenv("ROOM_DELETE_BATCH_PAUSE", "0.05"))  # seconds
+    ROOM_DELETE_SCAN_INTERVAL: int = int(os.getenv("ROOM_DELETE_SCAN_INTERVAL", "60"))  # seconds
+    ROOM_DELETE_LOCK_TTL: int = int(os.getenv("ROOM_DELETE_LOCK_TTL", "60"))  # seconds a purge may stall before another worker takes over
+    
+    # Rate limit settings
+    RATE_LIMIT_ENABLED: bool = os.getenv("RATE_LIMIT_ENABLED", "True").lower() == "true"
+    RATE_LIMITS: str = os.getenv("RATE_LIMITS", "")  # overrides, e.g. "login_ip=50/60,task_write=200/60"
+    TRUST_PROXY_HEADERS: bool = os.getenv("TRUST_PROXY_HEADERS", "True").lower() == "true"  # key clients by the X-Real-IP nginx sets; turn off if clients can reach the backend directly
+    
+    # Circuit breaker settings, shared by the Redis and database breakers
+    CIRCUIT_BREAKER_ENABLED: bool = os.getenv("CIRCUIT_BREAKER_ENABLED", "True").lower() == "true"
+    CIRCUIT_BREAKER_WINDOW: float = float(os.getenv("CIRCUIT_BREAKER_WINDOW", "10"))  # seconds of calls the rates cover
+    CIRCUIT_BREAKER_MIN_CALLS: int = int(os.getenv("CIRCUIT_BREAKER_MIN_CALLS", "20"))  # calls needed before opening
+    CIRCUIT_BREAKER_FAILURE_RATE: float = float(os.getenv("CIRCUIT_BREAKER_FAILURE_RATE", "0.5"))
+    CIRCUIT_BREAKER_SLOW_CALL_RATE: float = float(os.getenv("CIRCUIT_BREAKER_SLOW_CALL_RATE", "0.8"))
+    CIRCUIT_BREAKER_OPEN_SECONDS: float = float(os.getenv("CIRCUIT_BREAKER_OPEN_SECONDS", "5"))  # seconds before probing
+    REDIS_SLOW_CALL_SECONDS: float = float(os.getenv("REDIS_SLOW_CALL_SECONDS", "0.25"))
+    DB_SLOW_CALL_SECONDS: float = float(os.getenv("DB_SLOW_CALL_SECONDS", "2"))
+    
+    # DatabaseManager connection pool settings
+    DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "5"))  # seconds to wait for a pooled connection
+    DB_POOL_MAX_WAITING: int = int(os.getenv("DB_POOL_MAX_WAITING", "50"))  # callers queued per worker, 0 for no bound
+    DB_POOL_MAX_LIFETIME: float = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))  # seconds before a connection is replaced, 0 to keep
+    DB_POOL_MAX_IDLE: float = float(os.getenv("DB_POOL_MAX_IDLE", "300"))  # seconds an idle connection above the minimum is kept, 0 to keep
+    DB_POOL_LEAK_SECONDS: float = float(os.getenv("DB_POOL_LEAK_SECONDS", "30"))  # log checkouts held longer, 0 to turn off
+    
+    # Admission control settings, per worker: requests beyond an adaptive
+    # concurrency limit are shed with 503, writes first
+    ADMISSION_CONTROL_ENABLED: bool = os.getenv("ADMISSION_CONTROL_ENABLED", "True").lower() == "true"
+    ADMISSION_INITIAL_LIMIT: int = int(os.getenv("ADMISSION_INITIAL_LIMIT", "20"))  # concurrent requests
+    ADMISSION_MIN_LIMIT: int = int(os.getenv("ADMISSION_MIN_LIMIT", "4"))
+    ADMISSION_MAX_LIMIT: int = int(os.getenv("ADMISSION_MAX_LIMIT", "40"))  # Starlette runs 40 sync handlers at once; more would queue unseen
+    ADMISSION_LATENCY_TOLERANCE: float = float(os.getenv("ADMISSION_LATENCY_TOLERANCE", "1.5"))  # latency rise taken as normal
+    ADMISSION_WRITE_SHARE: float = float(os.getenv("ADMISSION_WRITE_SHARE", "0.75"))  # share of the limit writes may use
+    ADMISSION_ROUTE_SHARE: float = float(os.getenv("ADMISSION_ROUTE_SHARE", "1"))  # share of the limit one route may use, 1 for no cap
+    ADMISSION_ROUTE_LIMITS: str = os.getenv("ADMISSION_ROUTE_LIMITS", "")  # budgets, e.g. "POST /tasks/=10,GET /rooms/{room_id}=30"
+    ADMISSION_EXEMPT_PATHS: str = os.getenv("ADMISSION_EXEMPT_PATHS", "/health")  # comma separated, never shed
+    ADMISSION_QUEUE_SIZE: int = int(os.getenv("ADMISSION_QUEUE_SIZE", "50"))  # reads waiting for a slot
+    ADMISSION_QUEUE_TIMEOUT: float = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "1"))  # seconds a read waits
+    ADMISSION_RETRY_AFTER: int = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))  # seconds, sent with 503s
+    
+    # Request deadline settings: SQL statements and Redis replies are bounded
+    # by the time a request has left; clients may shorten it with X-Request-Timeout
+    REQUEST_TIMEOUT: float = float(os.getenv("REQUEST_TIMEOUT", "10"))  # seconds, 0 for no deadline
+    REQUEST_TIMEOUTS: str = os.getenv("REQUEST_TIMEOUTS", "")  # per-route budgets, e.g. "DELETE /rooms/{room_id}=60"
+    HEALTH_DB_TIMEOUT: float = float(os.getenv("HEALTH_DB_TIMEOUT", "1"))  # seconds /health waits for a pooled connection
+    
+    # Tracing settings: a span per request with children for SQL, Redis and SMTP
+    TRACING_EXPORTER: str = os.getenv("TRACING_EXPORTER", "")  # "otlp", "jsonl", or empty to turn tracing off
+    TRACING_SAMPLE_RATE: float = float(os.getenv("TRACING_SAMPLE_RATE", "0.01"))  # share of traces recorded without a sampled traceparent
+    TRACING_PARENT_SAMPLE_LIMIT: float = float(os.getenv("TRACING_PARENT_SAMPLE_LIMIT", "10"))  # traces per second and worker recorded because a caller's traceparent asked to; 0 to ignore the flag
+    TRACING_OTLP_ENDPOINT: str = os.getenv("TRACING_OTLP_ENDPOINT", "http://otel-collector:4318/v1/traces")
+    TRACING_JSONL_PATH: str = os.getenv("TRACING_JSONL_PATH", "/tmp/traces.jsonl")
+    TRACING_SERVICE_NAME: str = os.getenv("TRACING_SERVICE_NAME", "todo-backend")
+    
+    # Slow query log settings: statements over the threshold are grouped by
+    # fingerprint and reported at /debug/slow-queries
+    SLOW_QUERY_THRESHOLD_MS: float = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "200"))  # 0 turns the log off
+    SLOW_QUERY_MAX_ENTRIES: int = int(os.getenv("SLOW_QUERY_MAX_ENTRIES", "500"))  # fingerprints kept per worker
+    SLOW_QUERY_EXPLAIN_SAMPLE_RATE: float = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE_RATE", "0"))  # share of slow SELECTs re-run with EXPLAIN ANALYZE
+    SLOW_QUERY_EXPLAIN_HOST: str = os.getenv("SLOW_QUERY_EXPLAIN_HOST", os.getenv("DB_REPLICA_HOSTS", "").split(",")[0].strip() or DB_HOST)  # a replica by default
+    SLOW_QUERY_EXPLAIN_TIMEOUT: float = float(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT", "5"))  # seconds
+    SLOW_QUERY_EXPLAIN_INTERVAL: float = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", "300"))  # seconds before a query is explained again
+    SLOW_QUERY_REPORT_ENABLED: bool = os.getenv("SLOW_QUERY_REPORT_ENABLED", "False").lower() == "true"  # serve /debug/slow-queries to operators
+    OPERATOR_TOKEN: str = os.getenv("OPERATOR_TOKEN", "")  # shared secret operators send as X-Operator-Token; empty refuses every caller
+    
+    # Server settings
+    WEB_CONCURRENCY: int = int(os.getenv("WEB_CONCURRENCY", "1"))  # worker processes, set by server.py
+    
+    # Cache expiry settings: entries are refreshed in the background after the
+    # soft TTL and served stale until the hard TTL
+    TASK_CACHE_TTL: int = int(os.getenv("TASK_CACHE_TTL", "600"))  # seconds the task list lives without writes
+    TASK_CACHE_SOFT_TTL: int = int(os.getenv("TASK_CACHE_SOFT_TTL", "300"))  # seconds
+    ROOM_CACHE_TTL: int = int(os.getenv("ROOM_CACHE_TTL", "300"))  # seconds
+    ROOM_CACHE_SOFT_TTL: int = int(os.getenv("ROOM_CACHE_SOFT_TTL", "120"))  # seconds
+    CACHE_TTL_JITTER: float = float(os.getenv("CACHE_TTL_JITTER", "0.1"))  # fraction TTLs are randomly spread by
+    CACHE_XFETCH_BETA: float = float(os.getenv("CACHE_XFETCH_BETA", "1.0"))  # eagerness of early refreshes, 0 disables
+    CACHE_REFRESH_LOCK_TTL: int = int(os.getenv("CACHE_REFRESH_LOCK_TTL", "30"))  # seconds
+    CACHE_REFRESH_WORKERS: int = int(os.getenv("CACHE_REFRESH_WORKERS", "1"))  # background refresh threads per worker
+    
+    # Task lookup settings
+    TASK_MISSING_TTL: int = int(os.getenv("TASK_MISSING_TTL", "30"))  # seconds a missing task ID is remembered
+    TASK_BLOOM_FILTER: bool = os.getenv("TASK_BLOOM_FILTER", "False").lower() == "true"
+    TASK_BLOOM_CAPACITY: int = int(os.getenv("TASK_BLOOM_CAPACITY", "1000000"))
+    TASK_BLOOM_ERROR_RATE: float = float(os.getenv("TASK_BLOOM_ERROR_RATE", "0.01"))
+    TASK_BLOOM_REBUILD_INTERVAL: int = int(os.getenv("TASK_BLOOM_REBUILD_INTERVAL", "600"))  # seconds
+    
+    TASK_BATCH_MAX_IDS: int = int(os.getenv("TASK_BATCH_MAX_IDS", "500"))  # IDs accepted by GET /tasks?ids=
+    
+    # Task write-behind settings
+    TASK_WRITE_BEHIND: bool = os.getenv("TASK_WRITE_BEHIND", "False").lower() == "true"
+    TASK_WRITE_BEHIND_INTERVAL: float = float(os.getenv("TASK_WRITE_BEHIND_INTERVAL", "1.0"))  # seconds an edit may stay unwritten
+    TASK_WRITE_BEHIND_BATCH_SIZE: int = int(os.getenv("TASK_WRITE_BEHIND_BATCH_SIZE", "500"))
+    
+    # Response compression settings
+    COMPRESSION_ENABLED: bool = os.getenv("COMPRESSION_ENABLED", "True").lower() == "true"
+    COMPRESSION_MINIMUM_SIZE: int = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))  # bytes
+    COMPRESSION_GZIP_LEVEL: int = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+    COMPRESSION_BROTLI_QUALITY: int = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "5"))
+    COMPRESSION_ZSTD_LEVEL: int = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))
+    COMPRESSION_CACHE_SIZE: int = int(os.getenv("COMPRESSION_CACHE_SIZE", str(32 * 1024 * 1024)))  # bytes, 0 disables
+    
+    # Mail settings
+    MAIL_OUTBOX_WORKER: bool = os.getenv("MAIL_OUTBOX_WORKER", "True").lower() == "true"  # run the outbox worker in-process
     
     # CORS settings
     CORS_ORIGINS: list = os.getenv("CORS_ORIGINS", "*").split(",")
@@ -35,10 +157,67 @@ class Setting(BaseSettings):
     JWT_SECRET_KEY: str = os.getenv("JWT_SECRET_KEY", "your-jwt-secret-key")
     JWT_ALGORITHM: str = os.getenv("JWT_ALGORITHM", "HS256")
     JWT_ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("JWT_ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+
+    # Magic link token settings
+    AUTH_TOKEN_BACKEND: str = os.getenv("AUTH_TOKEN_BACKEND", "redis")  # 'redis' or 'database'
+    AUTH_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("AUTH_TOKEN_EXPIRE_MINUTES", "15"))
+    AUTH_TOKEN_PURGE_INTERVAL: int = int(os.getenv("AUTH_TOKEN_PURGE_INTERVAL", "300"))  # seconds
+    AUTH_TOKEN_PURGE_BATCH_SIZE: int = int(os.getenv("AUTH_TOKEN_PURGE_BATCH_SIZE", "1000"))
     
     class Config:
         env_file = ".env"
         case_sensitive = True
 
+    def worker_share(self, budget: int) -> int:
+        """
+        Split an instance-wide connection budget evenly across worker processes.
+
+        Args:
+            budget: Connections allowed for the whole instance
+
+        Returns:
+            int: Connections allowed for this worker, at least one
+        """
+        return max(1, budget // max(1, self.WEB_CONCURRENCY))
+
+    def circuit_breaker_options(self, slow_call_duration: float) -> Optional[dict]:
+        """
+        Options of a circuit breaker, or None when breakers are disabled.
+
+        Args:
+            slow_call_duration: Seconds after which a call to the dependency counts as slow
+        """
+        if not self.CIRCUIT_BREAKER_ENABLED:
+            return None
+        return {
+            "window": self.CIRCUIT_BREAKER_WINDOW,
+            "min_calls": self.CIRCUIT_BREAKER_MIN_CALLS,
+            "failure_rate": self.CIRCUIT_BREAKER_FAILURE_RATE,
+            "slow_call_duration": slow_call_duration,
+            "slow_call_rate": self.CIRCUIT_BREAKER_SLOW_CALL_RATE,
+            "open_duration": self.CIRCUIT_BREAKER_OPEN_SECONDS,
+        }
+
+    @property
+    def DB_MANAGER_CONNECTIONS(self) -> int:
+        """Connections of this worker's DB budget reserved for the psycopg2 pool."""
+        return max(1, self.worker_share(self.DB_MAX_CONNECTIONS) // 4)
+
+    @property
+    def DB_ENGINE_CONNECTIONS(self) -> int:
+        """Connections of this worker's DB budget left for the SQLAlchemy engine."""
+        return max(1, self.worker_share(self.DB_MAX_CONNECTIONS) - self.DB_MANAGER_CONNECTIONS)
+
+    @property
+    def REDIS_WORKER_CONNECTIONS(self) -> int:
+        """
+        Size of this worker's master and replica pools: its share of
+        REDIS_MAX_CONNECTIONS, capped by REDIS_CONNECTION_POOL_SIZE.
+        """
+        share = self.worker_share(self.REDIS_MAX_CONNECTIONS)
+        if self.REDIS_CONNECTION_POOL_SIZE > 0:
+            return min(share, self.REDIS_CONNECTION_POOL_SIZE)
+        return share
+
 # Create settings instance
 settings = Setting()
@@ -1,14 +1,21 @@
-from sqlalchemy import Boolean, create_engine, Column, Integer, String, DateTime, ForeignKey, inspect
+from sqlalchemy import Boolean, create_engine, Column, Integer, String, DateTime, ForeignKey, Index, any_, bindparam, event, func, inspect, null, or_, select, delete, update, text
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import sessionmaker, Session, relationship
 from datetime import datetime, timezone, timedelta
 import os
 import secrets
-from typing import Generator, Optional
-from sqlalchemy.exc import SQLAlchemyError
+from typing import Callable, Generator, List, Optional, Tuple
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
 import time
 import logging
+from breaker import create_breaker
 from config import settings
+from deadline import DeadlineExceeded, current_scope, cut_short
+from tracing import tracer
+from slow_queries import slow_query_log
+from serializers import TASK_FIELDS
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -45,8 +52,9 @@ def get_engine(max_retries=5, retry_interval=5):
             engine = create_engine(
                 settings.DATABASE_URL,
                 pool_pre_ping=True,
-                pool_size=5,
-                max_overflow=10
+                # Overflow would let workers exceed the DB_MAX_CONNECTIONS budget
+                pool_size=settings.DB_ENGINE_CONNECTIONS,
+                max_overflow=0
             )
             # Test the connection
             with engine.connect() as conn:
@@ -72,8 +80,152 @@ except SQLAlchemyError as e:
     logger.error(f"Error connecting to the database: {e}")
     raise
 
-# Create sessionmaker
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Create sessionmaker; objects keep their loaded state after commit, so
+# reading e.g. a redeemed token's user does not cost another SELECT
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+# Bound every statement run for a request by the time the request has left:
+# SET LOCAL statement_timeout once per transaction, and register the
+# connection so it can be cancelled if the client goes away. Registered
+# before the breaker, tracing and slow-query listeners: SQLAlchemy runs no
+# handle_error or after_cursor_execute hooks when a before_cursor_execute
+# listener raises, so a request past its deadline must be refused before
+# they push a timer or span onto the connection
+@event.listens_for(engine, "before_cursor_execute")
+def apply_request_deadline(conn, cursor, statement, parameters, context, executemany):
+    scope = current_scope.get()
+    if scope is None:
+        return
+    timeout_ms = scope.statement_timeout_ms()
+    if timeout_ms is not None and "statement_timeout" not in conn.info:
+        cursor.execute(f"SET LOCAL statement_timeout = {timeout_ms}")
+        conn.info["statement_timeout"] = timeout_ms
+    scope.attach(conn.connection.dbapi_connection)
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def release_request_deadline(conn, cursor, statement, parameters, context, executemany):
+    scope = current_scope.get()
+    if scope is not None:
+        scope.detach(conn.connection.dbapi_connection)
+
+
+@event.listens_for(engine, "handle_error")
+def translate_request_deadline(context):
+    scope = current_scope.get()
+    if scope is None or context.connection is None:
+        return None
+    scope.detach(context.connection.connection.dbapi_connection)
+    if scope.caused(context.original_exception):
+        return scope.exceeded()
+    return None
+
+
+@event.listens_for(engine, "commit")
+@event.listens_for(engine, "rollback")
+def forget_statement_timeout(conn):
+    # SET LOCAL ends with the transaction
+    conn.info.pop("statement_timeout", None)
+
+
+@event.listens_for(engine, "checkin")
+def forget_statement_timeout_on_checkin(dbapi_connection, connection_record):
+    # The pool rolls back returned connections without going through the Connection
+    connection_record.info.pop("statement_timeout", None)
+
+
+# Shared by the engine and DatabaseManager, which both reach the database through pgpool
+database_breaker = create_breaker("database", settings.circuit_breaker_options(settings.DB_SLOW_CALL_SECONDS))
+
+if database_breaker is not None:
+    # Sessions ask the breaker when they first need the database, before a
+    # connection is checked out, rather than when they are created: requests
+    # served from Redis keep working while it is open, and a probe token is
+    # only handed to a session that queries. The session passes its token to
+    # each connection it uses, so only the probe's queries decide whether
+    # the breaker closes
+    @event.listens_for(SessionLocal, "after_transaction_create")
+    def check_breaker(session, transaction):
+        if transaction.parent is None and "breaker_probe" not in session.info:
+            session.info["breaker_probe"] = database_breaker.check()
+
+    @event.listens_for(SessionLocal, "after_begin")
+    def pass_breaker_probe(session, transaction, connection):
+        connection.info["breaker_probe"] = session.info.get("breaker_probe", 0)
+
+    @event.listens_for(engine, "checkin")
+    def clear_breaker_probe(dbapi_connection, connection_record):
+        connection_record.info.pop("breaker_probe", None)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_breaker_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("breaker_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def record_breaker_success(conn, cursor, statement, parameters, context, executemany):
+        database_breaker.record(
+            True, time.perf_counter() - conn.info["breaker_start"].pop(), conn.info.get("breaker_probe", 0)
+        )
+
+    @event.listens_for(engine, "handle_error")
+    def record_breaker_failure(context):
+        info = context.connection.info if context.connection is not None else {}
+        started = info.get("breaker_start")
+        duration = time.perf_counter() - started.pop() if started else 0.0
+        # Only unavailability counts; constraint violations, bad SQL and
+        # statements cut short by the request's deadline are the caller's
+        if cut_short(context.original_exception):
+            return
+        if context.is_disconnect or isinstance(context.sqlalchemy_exception, OperationalError):
+            database_breaker.record(False, duration, info.get("breaker_probe", 0))
+
+
+if tracer.enabled:
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_query_span(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("trace_spans", []).append(
+            tracer.start_span("db.query", "client", {"db.system": "postgresql", "db.statement": statement})
+        )
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def end_query_span(conn, cursor, statement, parameters, context, executemany):
+        span = conn.info["trace_spans"].pop()
+        span.set_attribute("db.rowcount", cursor.rowcount)
+        span.end()
+
+    @event.listens_for(engine, "handle_error")
+    def fail_query_span(context):
+        spans = context.connection.info.get("trace_spans") if context.connection is not None else None
+        if spans:
+            span = spans.pop()
+            span.record_exception(context.original_exception)
+            span.end()
+
+
+# Registered last, so the deadline's SET LOCAL is not timed with the statement
+if slow_query_log.enabled:
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_slow_query_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slow_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def record_slow_query(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info["slow_query_start"].pop()
+        slow_query_log.record(statement, parameters, duration, executemany)
+
+    @event.listens_for(engine, "handle_error")
+    def record_failed_slow_query(context):
+        started = context.connection.info.get("slow_query_start") if context.connection is not None else None
+        if started:
+            # Statements cut short by statement_timeout are the slowest of all
+            executemany = context.execution_context is not None and context.execution_context.executemany
+            slow_query_log.record(
+                context.statement,
+                context.parameters,
+                time.perf_counter() - started.pop(),
+                executemany,
+                context.original_exception,
+            )
 
 # User model for authentication
 class User(Base):
@@ -94,23 +246,51 @@ class User(Base):
     rooms = relationship("Room", secondary="room_participants", back_populates="participants")
     
     @classmethod
-    def get_or_create(cls, db: Session, email: str) -> "User":
+    def get_or_create(cls, db: Session, email: str, commit: bool = True) -> "User":
         """
         Get an existing user or create a new one if not found.
+        Uses a single INSERT ... ON CONFLICT ... RETURNING, so concurrent
+        signups with the same email resolve to the same row.
         
         Args:
             db: Database session
             email: User's email address
+            commit: Whether to commit immediately or leave it to the caller
             
         Returns:
             User object
         """
-        user = db.query(cls).filter(cls.email == email).first()
-        if not user:
-            user = cls(email=email)
-            db.add(user)
+        stmt = pg_insert(cls).values(email=email)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[cls.email],
+            # A no-op update so RETURNING also yields existing rows
+            set_={"email": stmt.excluded.email},
+        ).returning(cls)
+        user = db.scalars(stmt).one()
+        if commit:
             db.commit()
-            db.refresh(user)
+        return user
+    
+    @classmethod
+    def record_login(cls, db: Session, user_id: int) -> Optional["User"]:
+        """
+        Update the last login timestamp of an active user and return it.
+        
+        Args:
+            db: Database session
+            user_id: ID of the user
+            
+        Returns:
+            User object, or None if no active user has that ID
+        """
+        stmt = (
+            update(cls)
+            .where(cls.id == user_id, cls.is_active == True)
+            .values(last_login=datetime.now(timezone.utc))
+            .returning(cls)
+        )
+        user = db.scalars(stmt).one_or_none()
+        db.commit()
         return user
     
     def update_last_login(self, db: Session) -> None:
@@ -141,8 +321,13 @@ class AuthToken(Base):
     # Relationships
     user = relationship("User", back_populates="auth_tokens")
     
+    __table_args__ = (
+        # Lookups only ever target unused tokens, so keep the index small
+        Index('ix_auth_tokens_unused', 'token', 'expires_at', postgresql_where=text('is_used = false')),
+    )
+    
     @classmethod
-    def create_token(cls, db: Session, user_id: int, expires_in_minutes: int = 15) -> "AuthToken":
+    def create_token(cls, db: Session, user_id: int, expires_in_minutes: int = 15, commit: bool = True) -> "AuthToken":
         """
         Create a new authentication token for magic link.
         
@@ -150,6 +335,7 @@ class AuthToken(Base):
             db: Database session
             user_id: ID of the user
             expires_in_minutes: Token expiration time in minutes
+            commit: Whether to commit immediately or leave it to the caller
             
         Returns:
             AuthToken object
@@ -167,9 +353,10 @@ class AuthToken(Base):
             expires_at=expires_at
         )
         
+        # The token is generated here, so there is nothing to refresh
         db.add(auth_token)
-        db.commit()
-        db.refresh(auth_token)
+        if commit:
+            db.commit()
         
         return auth_token
     
@@ -177,6 +364,8 @@ class AuthToken(Base):
     def validate_token(cls, db: Session, token: str) -> Optional[int]:
         """
         Validate a token and return the associated user ID if valid.
+        The token is checked and marked as used in a single UPDATE ... RETURNING,
+        so two concurrent verifications can never both succeed.
         
         Args:
             db: Database session
@@ -185,21 +374,85 @@ class AuthToken(Base):
         Returns:
             User ID if token is valid, None otherwise
         """
-        auth_token = db.query(cls).filter(
-            cls.token == token,
-            cls.is_used == False,
-            cls.expires_at > datetime.now(timezone.utc)
-        ).first()
+        stmt = (
+            update(cls)
+            .where(
+                cls.token == token,
+                cls.is_used == False,
+                cls.expires_at > datetime.now(timezone.utc)
+            )
+            .values(is_used=True)
+            .returning(cls.user_id)
+        )
+        user_id = db.execute(stmt).scalar_one_or_none()
+        db.commit()
+        
+        return user_id
+    
+    @classmethod
+    def redeem(cls, db: Session, token: str) -> Optional["User"]:
+        """
+        Consume a token and record the login of its user in one statement.
         
-        if auth_token:
-            # Mark token as used
-            auth_token.is_used = True
-            db.add(auth_token)
-            db.commit()
+        Args:
+            db: Database session
+            token: Token string to redeem
             
-            return auth_token.user_id
+        Returns:
+            The logged in User, or None if the token or user is not valid
+        """
+        consumed = (
+            update(cls)
+            .where(
+                cls.token == token,
+                cls.is_used == False,
+                cls.expires_at > datetime.now(timezone.utc)
+            )
+            .values(is_used=True)
+            .returning(cls.user_id)
+            .cte("consumed")
+        )
+        stmt = (
+            update(User)
+            .where(User.id == consumed.c.user_id, User.is_active == True)
+            .values(last_login=datetime.now(timezone.utc))
+            .returning(User)
+        )
+        user = db.scalars(stmt).one_or_none()
+        db.commit()
         
-        return None
+        return user
+    
+    @classmethod
+    def purge_expired(cls, db: Session, batch_size: int = 1000) -> int:
+        """
+        Delete used and expired tokens in small batches.
+        Each batch runs in its own short transaction to avoid long-held locks.
+        
+        Args:
+            db: Database session
+            batch_size: Maximum number of rows deleted per transaction
+            
+        Returns:
+            Total number of deleted rows
+        """
+        total = 0
+        while True:
+            batch = (
+                select(cls.id)
+                .where(or_(cls.is_used == True, cls.expires_at <= datetime.now(timezone.utc)))
+                .limit(batch_size)
+                .scalar_subquery()
+            )
+            result = db.execute(delete(cls).where(cls.id.in_(batch)))
+            db.commit()
+            total += result.rowcount
+            if result.rowcount < batch_size:
+                break
+        
+        if total:
+            logger.info(f"Purged {total} expired auth tokens")
+        return total
 
 class Room(Base):
     """
@@ -212,41 +465,125 @@ class Room(Base):
     invite_code = Column(String, index=True, unique=True)
     creator_id = Column(Integer, ForeignKey('users.id'))  # Changed from creator_email to creator_id
     participant_count = Column(Integer, default=0)
+    status = Column(String, default='active', nullable=True)  # 'active', 'deleting'
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))  # Using UTC timezone
     participants = relationship("User", secondary="room_participants", back_populates="rooms")
     # tasks = relationship("Task", back_populates="room")
     creator = relationship("User", foreign_keys=[creator_id])
 
-    def remove_participant(self, participant_email: str, db: Session):
+    @classmethod
+    def add_participants(cls, db: Session, room_id: int, user_ids: List[int], role: str = 'member', commit: bool = True) -> Tuple[List[int], int]:
         """
-        Remove a participant from the room.
+        Add many users to a room in a single statement.
+        Existing members are skipped by ON CONFLICT DO NOTHING and the
+        participant count is incremented in the database, so concurrent
+        joins never lose updates.
         
         Args:
-            participant_email: The email of the participant to remove
             db: SQLAlchemy database session
+            room_id: The ID of the room
+            user_ids: IDs of the users to add
+            role: Role given to the new participants
+            commit: Whether to commit immediately or leave it to the caller
+            
+        Returns:
+            Tuple of (IDs of the users actually added, new participant count)
         """
-        participant = db.query(RoomParticipant).filter_by(room_id=self.id, email=participant_email).first()
-        if participant:
-            db.delete(participant)
-            self.participant_count -= 1
-            db.add(self)
+        if not user_ids:
+            return [], db.scalar(select(cls.participant_count).where(cls.id == room_id)) or 0
+        
+        now = datetime.now(timezone.utc)
+        inserted = (
+            pg_insert(RoomParticipant)
+            .values([
+                {"room_id": room_id, "user_id": user_id, "role": role, "joined_at": now}
+                for user_id in set(user_ids)
+            ])
+            .on_conflict_do_nothing(index_elements=[RoomParticipant.room_id, RoomParticipant.user_id])
+            .returning(RoomParticipant.user_id)
+            .cte("inserted")
+        )
+        stmt = (
+            update(cls)
+            .where(cls.id == room_id)
+            .values(participant_count=func.coalesce(cls.participant_count, 0) + select(func.count()).select_from(inserted).scalar_subquery())
+            .returning(cls.participant_count, select(func.array_agg(inserted.c.user_id)).scalar_subquery())
+        )
+        row = db.execute(stmt).one_or_none()
+        if commit:
             db.commit()
+        
+        if row is None:
+            return [], 0
+        participant_count, added = row
+        return list(added or []), participant_count
+    
+    @classmethod
+    def remove_participants(cls, db: Session, room_id: int, user_ids: List[int], commit: bool = True) -> Tuple[List[int], int]:
+        """
+        Remove many users from a room in a single statement.
+        
+        Args:
+            db: SQLAlchemy database session
+            room_id: The ID of the room
+            user_ids: IDs of the users to remove
+            commit: Whether to commit immediately or leave it to the caller
+            
+        Returns:
+            Tuple of (IDs of the users actually removed, new participant count)
+        """
+        if not user_ids:
+            return [], db.scalar(select(cls.participant_count).where(cls.id == room_id)) or 0
+        
+        removed = (
+            delete(RoomParticipant)
+            .where(RoomParticipant.room_id == room_id, RoomParticipant.user_id.in_(set(user_ids)))
+            .returning(RoomParticipant.user_id)
+            .cte("removed")
+        )
+        stmt = (
+            update(cls)
+            .where(cls.id == room_id)
+            .values(participant_count=func.greatest(func.coalesce(cls.participant_count, 0) - select(func.count()).select_from(removed).scalar_subquery(), 0))
+            .returning(cls.participant_count, select(func.array_agg(removed.c.user_id)).scalar_subquery())
+        )
+        row = db.execute(stmt).one_or_none()
+        if commit:
+            db.commit()
+        
+        if row is None:
+            return [], 0
+        participant_count, removed_ids = row
+        return list(removed_ids or []), participant_count
+
+    def remove_participant(self, user_id: int, db: Session) -> bool:
+        """
+        Remove a participant from the room.
+        
+        Args:
+            user_id: The ID of the user to remove
+            db: SQLAlchemy database session
+            
+        Returns:
+            bool: True if the user was a participant
+        """
+        removed, _ = Room.remove_participants(db, self.id, [user_id])
+        return bool(removed)
 
-    def add_participant(self, participant_email: str, db: Session):
+    def add_participant(self, user_id: int, db: Session, role: str = 'member') -> bool:
         """
         Add a participant to the room.
         
         Args:
-            participant_email: The email of the participant to add
+            user_id: The ID of the user to add
             db: SQLAlchemy database session
+            role: Role of the new participant
+            
+        Returns:
+            bool: True if the user was not already a participant
         """
-        participant = db.query(RoomParticipant).filter_by(room_id=self.id, email=participant_email).first()
-        if not participant:
-            new_participant = RoomParticipant(room_id=self.id, email=participant_email)
-            db.add(new_participant)
-            self.participant_count += 1
-            db.add(self)
-            db.commit()
+        added, _ = Room.add_participants(db, self.id, [user_id], role=role)
+        return bool(added)
 
     def create_invite_code(self, db: Session):
         """
@@ -259,6 +596,107 @@ class Room(Base):
         db.add(self)
         db.commit()
         return self.invite_code
+
+    @classmethod
+    def _summary_query(cls):
+        """
+        Select room columns together with the creator's email, so serializing
+        a room never touches the lazy creator relationship.
+        """
+        return (
+            select(
+                cls.id,
+                cls.name,
+                cls.description,
+                cls.invite_code,
+                cls.creator_id,
+                User.email.label("creator_email"),
+                func.coalesce(cls.participant_count, 0).label("participant_count"),
+                cls.created_at,
+            )
+            .outerjoin(User, User.id == cls.creator_id)
+            .where(cls.is_active())
+        )
+
+    @classmethod
+    def is_active(cls):
+        """SQL condition excluding rooms that are being deleted."""
+        return or_(cls.status.is_(None), cls.status != 'deleting')
+
+    @classmethod
+    def list_for_user(cls, db: Session, user_id: int, limit: int = 50, offset: int = 0) -> List[dict]:
+        """
+        List the rooms a user created or participates in, in one query.
+        
+        Args:
+            db: SQLAlchemy database session
+            user_id: The ID of the user
+            limit: Maximum number of rooms to return
+            offset: Number of rooms to skip
+            
+        Returns:
+            List of room dictionaries including creator_email
+        """
+        memberships = select(RoomParticipant.room_id).where(RoomParticipant.user_id == user_id)
+        stmt = (
+            cls._summary_query()
+            .where(or_(cls.creator_id == user_id, cls.id.in_(memberships)))
+            .order_by(cls.created_at.desc(), cls.id.desc())
+            .limit(limit)
+            .offset(offset)
+        )
+        return [dict(row) for row in db.execute(stmt).mappings()]
+
+    @classmethod
+    def get_detail(cls, db: Session, room_id: int, participants_limit: int = 50, participants_offset: int = 0) -> Optional[dict]:
+        """
+        Load a room and one page of its participants in two queries.
+        
+        Args:
+            db: SQLAlchemy database session
+            room_id: The ID of the room
+            participants_limit: Maximum number of participants to return
+            participants_offset: Number of participants to skip
+            
+        Returns:
+            Room dictionary with a participants list, or None if not found
+        """
+        room = db.execute(cls._summary_query().where(cls.id == room_id)).mappings().first()
+        if room is None:
+            return None
+        
+        participants = db.execute(
+            select(User.id, User.email, User.display_name)
+            .join(RoomParticipant, RoomParticipant.user_id == User.id)
+            .where(RoomParticipant.room_id == room_id)
+            .order_by(RoomParticipant.joined_at, RoomParticipant.id)
+            .limit(participants_limit)
+            .offset(participants_offset)
+        ).mappings()
+        
+        detail = dict(room)
+        detail["participants"] = [dict(participant) for participant in participants]
+        return detail
+
+    @classmethod
+    def is_member(cls, db: Session, room_id: int, user_id: int) -> bool:
+        """
+        Check whether a user participates in a room, using the membership index.
+        
+        Args:
+            db: SQLAlchemy database session
+            room_id: The ID of the room
+            user_id: The ID of the user
+            
+        Returns:
+            bool: True if the user is a participant
+        """
+        stmt = select(RoomParticipant.id).where(
+            RoomParticipant.room_id == room_id,
+            RoomParticipant.user_id == user_id,
+        ).limit(1)
+        return db.scalar(stmt) is not None
+
     @classmethod
     def remove_room(cls, room_id: int, db: Session):
         """
@@ -284,7 +722,130 @@ class Room(Base):
             db.commit()
             return True
         return False
+
+    @classmethod
+    def mark_deleting(cls, db: Session, room_id: int) -> bool:
+        """
+        Flag a room for background deletion. The room disappears from listings
+        immediately while its tasks and participants are removed in batches.
+        
+        Args:
+            db: SQLAlchemy database session
+            room_id: The ID of the room to delete
+            
+        Returns:
+            bool: True if the room existed and was not already being deleted
+        """
+        stmt = (
+            update(cls)
+            .where(cls.id == room_id, cls.is_active())
+            .values(status='deleting')
+            .returning(cls.id)
+        )
+        marked = db.execute(stmt).scalar_one_or_none()
+        db.commit()
+        return marked is not None
+
+    @classmethod
+    def lock_for_new_task(cls, db: Session, room_id: int) -> Optional[str]:
+        """
+        Share-lock a room until the end of the transaction, so it cannot be
+        marked as deleting while a task is added to it.
+        
+        Args:
+            db: SQLAlchemy database session
+            room_id: The ID of the room
+            
+        Returns:
+            The room's status, 'active' or 'deleting', or None if it does not exist
+        """
+        row = db.execute(select(cls.status).where(cls.id == room_id).with_for_update(read=True)).first()
+        if row is None:
+            return None
+        return row.status or 'active'
+
+    @classmethod
+    def deleting_ids(cls, db: Session) -> List[int]:
+        """
+        List rooms waiting for background deletion.
+        
+        Args:
+            db: SQLAlchemy database session
+            
+        Returns:
+            List of room IDs
+        """
+        return list(db.scalars(select(cls.id).where(cls.status == 'deleting')))
+
+    @classmethod
+    def purge(
+        cls,
+        db: Session,
+        room_id: int,
+        batch_size: int = 500,
+        batch_pause: float = 0.0,
+        on_progress: Optional[Callable[[dict], None]] = None,
+    ) -> dict:
+        """
+        Delete a room marked as deleting, its tasks and its participants in batches.
+        Every batch is its own short transaction and skips rows locked by other
+        transactions, so concurrent task traffic is never blocked. Callers make
+        sure only one worker purges a room at a time. Rows that were skipped keep
+        the room, which stays marked as deleting for the next purge.
+        
+        Args:
+            db: SQLAlchemy database session
+            room_id: The ID of the room to purge
+            batch_size: Maximum number of rows deleted per transaction
+            batch_pause: Seconds to sleep between batches to limit replication lag
+            on_progress: Called with the progress dictionary after every batch
+            
+        Returns:
+            dict: Number of deleted tasks and participants and the final status
+        """
+        progress = {"room_id": room_id, "status": "deleting", "tasks_deleted": 0, "participants_deleted": 0}
+        
+        for model, counter in ((Task, "tasks_deleted"), (RoomParticipant, "participants_deleted")):
+            while True:
+                batch = (
+                    select(model.id)
+                    .where(model.room_id == room_id)
+                    .limit(batch_size)
+                    .with_for_update(skip_locked=True)
+                    .scalar_subquery()
+                )
+                deleted = db.execute(delete(model).where(model.id.in_(batch))).rowcount
+                db.commit()
+                
+                progress[counter] += deleted
+                if on_progress:
+                    on_progress(progress)
+                if deleted < batch_size:
+                    break
+                if batch_pause:
+                    time.sleep(batch_pause)
+        
+        # Only once nothing references the room any more; rows skipped above
+        # would otherwise fail the foreign keys
+        room_deleted = db.execute(
+            delete(cls).where(
+                cls.id == room_id,
+                cls.status == 'deleting',
+                ~select(Task.id).where(Task.room_id == room_id).exists(),
+                ~select(RoomParticipant.id).where(RoomParticipant.room_id == room_id).exists(),
+            )
+        ).rowcount
+        db.commit()
         
+        if not room_deleted:
+            logger.info(f"Room {room_id} still has locked rows, its purge resumes on the next scan")
+            return progress
+        progress["status"] = "deleted"
+        if on_progress:
+            on_progress(progress)
+        logger.info(f"Purged room {room_id}: {progress['tasks_deleted']} tasks, {progress['participants_deleted']} participants")
+        return progress
+
 
 class RoomParticipant(Base):
     __tablename__ = 'room_participants'
@@ -294,6 +855,12 @@ class RoomParticipant(Base):
     joined_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     role = Column(String, default='member')  # 'owner', 'admin', 'member'
     
+    __table_args__ = (
+        # Enforces single membership and backs ON CONFLICT in Room.add_participants
+        Index('uq_room_participants_room_user', 'room_id', 'user_id', unique=True),
+        Index('ix_room_participants_user_id', 'user_id'),
+    )
+    
     
 class Task(Base):
     """
@@ -306,13 +873,159 @@ class Task(Base):
     description = Column(String)
     completed = Column(Boolean, default=False)
     due_date = Column(DateTime, nullable=True)
-    # room_id = Column(Integer, ForeignKey('rooms.id'), nullable=True)
+    room_id = Column(Integer, ForeignKey('rooms.id'), nullable=True, index=True)
     # user_id = Column(Integer, ForeignKey('users.id'), nullable=True)  # Added user_id for task ownership
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))  # Using UTC timezone
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    # Incremented by every update; doubles as the ETag for optimistic concurrency control
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))
     # room = relationship("Room", back_populates="tasks")
     # user = relationship("User")  # Task owner
 
+    @classmethod
+    def response_columns(cls) -> list:
+        """
+        Columns selected for task responses, in TASK_FIELDS order.
+        Fields without a column (such as user_id) are returned as NULL.
+        """
+        return [getattr(cls, name, null().label(name)) for name in TASK_FIELDS]
+
+    @classmethod
+    def get_many(cls, db: Session, task_ids: List[int]) -> List[Row]:
+        """
+        Get the response rows of several tasks in one query.
+        The IDs are bound as a single array, so every batch size shares one statement.
+        
+        Args:
+            db: Database session
+            task_ids: IDs of the tasks
+            
+        Returns:
+            Rows ordered like TASK_FIELDS, for the tasks that exist
+        """
+        ids = bindparam("ids", task_ids, type_=ARRAY(Integer))
+        return db.execute(select(*cls.response_columns()).where(cls.id == any_(ids))).all()
+
+    @classmethod
+    def create(cls, db: Session, values: dict, commit: bool = True) -> Row:
+        """
+        Insert a task and return its response row in the same statement.
+        
+        Args:
+            db: Database session
+            values: Column values of the new task
+            commit: Whether to commit the transaction
+            
+        Returns:
+            Row ordered like TASK_FIELDS
+        """
+        row = db.execute(pg_insert(cls).values(**values).returning(*cls.response_columns())).one()
+        if commit:
+            db.commit()
+        return row
+
+    @classmethod
+    def update_fields(cls, db: Session, task_id: int, values: dict, expected_version: Optional[int] = None, commit: bool = True) -> Optional[Row]:
+        """
+        Update fields of a task and return its fresh response row in the same statement.
+        The version is incremented; with expected_version the update only applies
+        if nobody else changed the task since that version was read.
+        
+        Args:
+            db: Database session
+            task_id: The ID of the task
+            values: Changed column values; updated_at is always set
+            expected_version: Version the caller based its changes on
+            commit: Whether to commit the transaction
+            
+        Returns:
+            Row ordered like TASK_FIELDS, or None if no task has that ID and version
+        """
+        stmt = (
+            update(cls)
+            .where(cls.id == task_id)
+            .values(**values, updated_at=datetime.now(timezone.utc), version=cls.version + 1)
+            .returning(*cls.response_columns())
+        )
+        if expected_version is not None:
+            stmt = stmt.where(cls.version == expected_version)
+        result = db.execute(stmt)
+        row = result.one() if result.rowcount else None
+        if commit:
+            db.commit()
+        return row
+
+    @classmethod
+    def delete_by_id(cls, db: Session, task_id: int, expected_version: Optional[int] = None, commit: bool = True) -> bool:
+        """
+        Delete a task in a single statement.
+        
+        Args:
+            db: Database session
+            task_id: The ID of the task
+            expected_version: Only delete the task if it is still at this version
+            commit: Whether to commit the transaction
+            
+        Returns:
+            bool: True if the task existed (at the expected version)
+        """
+        stmt = delete(cls).where(cls.id == task_id).returning(cls.id)
+        if expected_version is not None:
+            stmt = stmt.where(cls.version == expected_version)
+        deleted = db.execute(stmt).rowcount
+        if commit:
+            db.commit()
+        return bool(deleted)
+
+    @classmethod
+    def current_version(cls, db: Session, task_id: int) -> Optional[int]:
+        """
+        Get the version of a task, e.g. to tell a version conflict from a missing task.
+        
+        Args:
+            db: Database session
+            task_id: The ID of the task
+            
+        Returns:
+            The version, or None if no task has that ID
+        """
+        return db.scalar(select(cls.version).where(cls.id == task_id))
+
+def ensure_columns():
+    """
+    Add nullable or server-defaulted columns declared on the models that are
+    missing from existing tables. create_all never alters a table that already exists.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not (column.nullable or column.server_default is not None):
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN IF NOT EXISTS {column.name} {column.type.compile(dialect=engine.dialect)}"
+                if column.server_default is not None:
+                    # Existing rows take the default; on PostgreSQL 11+ this does not rewrite the table
+                    ddl += f" DEFAULT {column.server_default.arg.text}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+                for foreign_key in column.foreign_keys:
+                    ddl += f" REFERENCES {foreign_key.column.table.name} ({foreign_key.column.name})"
+                logger.info(f"Adding missing column {table.name}.{column.name}")
+                conn.execute(text(ddl))
+
+def ensure_indexes():
+    """
+    Create indexes declared on the models that are missing from existing tables.
+    create_all only adds indexes when it creates the table itself.
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except SQLAlchemyError as e:
+                logger.error(f"Failed to create index {index.name}: {e}")
+
 # Function to check if tables exist before creating them
 def initialize_database():
     """
@@ -329,6 +1042,8 @@ def initialize_database():
         
         if set(model_tables).issubset(set(existing_tables)):
             logger.info("All tables already exist, skipping table creation")
+            ensure_columns()
+            ensure_indexes()
             return
         
         # Create tables that don't exist
@@ -350,6 +1065,9 @@ def get_db() -> Generator[Session, None, None]:
     """
     Dependency function to get a database session.
     
+    The session raises CircuitOpenError on its first statement while the
+    database circuit breaker is open, so requests that never query are served.
+    
     Yields:
         Session: SQLAlchemy database session
     """
@@ -0,0 +1,373 @@
+from bisect import bisect_left
+from collections import deque
+from typing import Any, Deque, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+import logging
+import psycopg2
+import sys
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the wait-time histogram buckets, in milliseconds
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class PoolTimeout(PoolError):
+    """Raised when no connection was released within the checkout timeout."""
+
+
+class PoolExhausted(PoolError):
+    """Raised when every connection is in use and the wait queue is full."""
+
+
+class Histogram:
+    """Counts of observed values by upper bucket bound, Prometheus style."""
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Cumulative bucket counts keyed by their upper bound, plus count and sum."""
+        buckets = {}
+        total = 0
+        for bound, count in zip(self.bounds + ("+Inf",), self.counts):
+            total += count
+            buckets[str(bound)] = total
+        return {"buckets": buckets, "count": self.count, "sum": round(self.sum, 3)}
+
+
+class Checkout(NamedTuple):
+    """Who holds a connection, since when, and where it was checked out."""
+    thread: str
+    since: float
+    stack: Optional[traceback.StackSummary]
+
+
+class Waiter:
+    """A caller queued for a connection; granted a connection, or None for a free slot."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+        self.connection = None
+
+    def grant(self, connection):
+        self.connection = connection
+        self.granted = True
+        self.event.set()
+
+
+class BlockingThreadedConnectionPool:
+    """
+    Thread-safe psycopg2 connection pool that queues callers instead of
+    failing when every connection is in use.
+    Callers wait in FIFO order, at most max_waiting of them, for up to
+    timeout seconds; a released connection is handed straight to the caller
+    that has waited longest. Connections are closed once they are older than
+    max_lifetime or were idle longer than max_idle, so server-side memory and
+    pgpool backends are recycled. Connections held longer than leak_threshold
+    are logged with the stack that checked them out.
+    Drop-in for ThreadedConnectionPool: getconn, putconn, closeall, closed.
+    """
+
+    def __init__(
+        self,
+        minconn: int,
+        maxconn: int,
+        *args,
+        timeout: float = 5.0,
+        max_waiting: int = 50,
+        max_lifetime: float = 1800.0,
+        max_idle: float = 300.0,
+        leak_threshold: float = 30.0,
+        **kwargs,
+    ):
+        """
+        Args:
+            minconn: Connections opened up front and kept open while idle
+            maxconn: Most connections open at once
+            timeout: Seconds a checkout waits for a connection
+            max_waiting: Most callers waiting at once, 0 for no bound
+            max_lifetime: Seconds after which a connection is replaced, 0 to keep it
+            max_idle: Seconds an idle connection above minconn is kept, 0 to keep it
+            leak_threshold: Seconds a connection may be held before it is reported,
+                0 to turn off leak detection
+            *args, **kwargs: Passed to psycopg2.connect
+        """
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_waiting = max_waiting
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.leak_threshold = leak_threshold
+        self.closed = False
+        self._args = args
+        self._kwargs = kwargs
+
+        self.lock = threading.Lock()
+        self.opened = 0  # open connections plus connections being opened
+        self.created: Dict[int, float] = {}
+        # Idle connections and when they were released, most recent last
+        self.idle: List[Tuple[Any, float]] = []
+        self.checked_out: Dict[int, Checkout] = {}
+        self.reported: Set[int] = set()  # checkouts already logged as held too long
+        self.waiters: Deque[Waiter] = deque()
+
+        self.checkouts = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.recycled = 0
+        self.leaks_reported = 0
+        self.max_in_use = 0
+        self.max_waiters = 0
+        self.wait_ms = Histogram(WAIT_BUCKETS_MS)
+
+        for _ in range(minconn):
+            with self.lock:
+                self.opened += 1
+            self.idle.append((self.connect(), time.monotonic()))
+
+    def connect(self):
+        try:
+            connection = psycopg2.connect(*self._args, **self._kwargs)
+        except Exception:
+            with self.lock:
+                self.opened -= 1
+            raise
+        self.created[id(connection)] = time.monotonic()
+        return connection
+
+    def expired(self, connection, now: float) -> bool:
+        """Whether a connection is closed or past max_lifetime; idle ones are pruned separately."""
+        if connection.closed:
+            return True
+        return bool(self.max_lifetime and now - self.created.get(id(connection), now) >= self.max_lifetime)
+
+    def getconn(self, key=None, timeout: Optional[float] = None):
+        """
+        Check a connection out, waiting for one if all are in use.
+
+        Args:
+            key: Unused, for compatibility with psycopg2 pools
+            timeout: Seconds to wait instead of the pool's timeout
+
+        Returns:
+            An open connection
+
+        Raises:
+            PoolExhausted: If the wait queue is full
+            PoolTimeout: If no connection was released in time
+            PoolError: If the pool is closed
+        """
+        timeout = self.timeout if timeout is None else timeout
+        start = time.perf_counter()
+        stale = []
+        connection = None
+        waiter = None
+        with self.lock:
+            if self.closed:
+                raise PoolError("connection pool is closed")
+            now = time.monotonic()
+            while self.idle and not self.waiters:
+                candidate, _ = self.idle.pop()
+                if self.expired(candidate, now):
+                    stale.append(candidate)
+                    continue
+                connection = candidate
+                break
+            self.opened -= len(stale)
+            if connection is None:
+                if self.opened < self.maxconn and not self.waiters:
+                    self.opened += 1
+                elif self.max_waiting and len(self.waiters) >= self.max_waiting:
+                    self.rejected += 1
+                    raise PoolExhausted(f"connection pool exhausted, {len(self.waiters)} callers waiting")
+                else:
+                    waiter = Waiter()
+                    self.waiters.append(waiter)
+                    self.max_waiters = max(self.max_waiters, len(self.waiters))
+        self.discard(stale)
+
+        if waiter is not None:
+            self.report_leaks()
+            waiter.event.wait(timeout)
+            with self.lock:
+                if not waiter.granted:
+                    if self.closed:
+                        raise PoolError("connection pool is closed")
+                    self.waiters.remove(waiter)
+                    self.timeouts += 1
+                    self.wait_ms.observe((time.perf_counter() - start) * 1000)
+                    raise PoolTimeout(f"no database connection released within {timeout}s")
+            connection = waiter.connection
+
+        if connection is None:
+            try:
+                connection = self.connect()
+            except Exception:
+                self.grant_slot()
+                raise
+
+        stack = None
+        if self.leak_threshold:
+            # Unresolved frames are cheap; source lines are only looked up when reported
+            stack = traceback.StackSummary.extract(traceback.walk_stack(sys._getframe(1)), limit=24, lookup_lines=False)
+            stack.reverse()
+        with self.lock:
+            self.checked_out[id(connection)] = Checkout(threading.current_thread().name, time.monotonic(), stack)
+            self.checkouts += 1
+            self.max_in_use = max(self.max_in_use, len(self.checked_out))
+            self.wait_ms.observe((time.perf_counter() - start) * 1000)
+        return connection
+
+    def putconn(self, connection, key=None, close: bool = False):
+        """
+        Return a connection, handing it to the longest waiting caller if any.
+        Open transactions are rolled back; broken and expired connections are
+        closed and their slot is handed on instead.
+
+        Args:
+            connection: A connection checked out from this pool
+            key: Unused, for compatibility with psycopg2 pools
+            close: Whether to close the connection instead of reusing it
+        """
+        with self.lock:
+            checkout = self.checked_out.pop(id(connection), None)
+            reported = id(connection) in self.reported
+            self.reported.discard(id(connection))
+        if checkout is None:
+            raise PoolError("trying to put unkeyed connection")
+
+        held = time.monotonic() - checkout.since
+        if self.leak_threshold and held >= self.leak_threshold:
+            if reported:
+                logger.warning(f"Database connection held by {checkout.thread} returned after {held:.1f}s")
+            else:
+                self.log_checkout(checkout, held, "returned after")
+
+        if not close and not connection.closed and not self.closed:
+            try:
+                status = connection.info.transaction_status
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    close = True
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+            except Exception as e:
+                logger.warning(f"Discarding database connection that failed to reset: {e}")
+                close = True
+
+        now = time.monotonic()
+        if close or self.closed or self.expired(connection, now):
+            with self.lock:
+                self.opened -= 1
+            self.discard([connection])
+            self.grant_slot()
+            return
+
+        stale = []
+        with self.lock:
+            if self.waiters:
+                self.waiters.popleft().grant(connection)
+                return
+            self.idle.append((connection, now))
+            # The least recently used connections sit at the bottom of the stack
+            while (
+                self.max_idle
+                and self.opened > self.minconn
+                and self.idle
+                and now - self.idle[0][1] >= self.max_idle
+            ):
+                stale.append(self.idle.pop(0)[0])
+                self.opened -= 1
+        self.discard(stale)
+
+    def grant_slot(self):
+        """Let the longest waiting caller open a connection in place of a closed one."""
+        with self.lock:
+            if self.waiters and self.opened < self.maxconn and not self.closed:
+                self.opened += 1
+                self.waiters.popleft().grant(None)
+
+    def discard(self, connections: List[Any]):
+        for connection in connections:
+            self.created.pop(id(connection), None)
+            self.recycled += 1
+            try:
+                connection.close()
+            except Exception as e:
+                logger.warning(f"Error closing database connection: {e}")
+
+    def closeall(self):
+        """Close every connection; checked-out ones are closed as they are returned."""
+        with self.lock:
+            self.closed = True
+            idle = [connection for connection, _ in self.idle]
+            self.idle.clear()
+            self.opened -= len(idle)
+            waiters = list(self.waiters)
+            self.waiters.clear()
+        self.discard(idle)
+        for waiter in waiters:
+            waiter.event.set()
+
+    def log_checkout(self, checkout: Checkout, held: float, verb: str):
+        self.leaks_reported += 1
+        trace = "".join(checkout.stack.format()) if checkout.stack is not None else "  (not recorded)\n"
+        logger.warning(
+            f"Database connection held by {checkout.thread} {verb} {held:.1f}s, checked out at:\n{trace.rstrip()}"
+        )
+
+    def report_leaks(self):
+        """Log the checkout stack of connections held longer than leak_threshold, once each."""
+        if not self.leak_threshold:
+            return
+        now = time.monotonic()
+        with self.lock:
+            leaks = [
+                (key, checkout) for key, checkout in self.checked_out.items()
+                if now - checkout.since >= self.leak_threshold and key not in self.reported
+            ]
+            self.reported.update(key for key, _ in leaks)
+        for _, checkout in leaks:
+            self.log_checkout(checkout, now - checkout.since, "for")
+
+    def stats(self) -> Dict[str, Any]:
+        """Usage of the pool since it was created, with a histogram of checkout wait times."""
+        self.report_leaks()
+        now = time.monotonic()
+        with self.lock:
+            return {
+                "max_connections": self.maxconn,
+                "open": self.opened,
+                "in_use": len(self.checked_out),
+                "idle": len(self.idle),
+                "max_in_use": self.max_in_use,
+                "waiting": len(self.waiters),
+                "max_waiting": self.max_waiters,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "rejected": self.rejected,
+                "recycled": self.recycled,
+                "held_too_long": sum(
+                    1 for checkout in self.checked_out.values()
+                    if self.leak_threshold and now - checkout.since >= self.leak_threshold
+                ),
+                "leaks_reported": self.leaks_reported,
+                "wait_ms_max": round(self.wait_ms.max, 3),
+                "wait_ms": self.wait_ms.snapshot(),
+            }
@@ -0,0 +1,260 @@
+from contextvars import ContextVar
+from typing import Any, Iterable, Optional, Set
+from starlette.responses import JSONResponse
+from starlette.routing import BaseRoute
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from psycopg2.errors import QueryCanceled
+import asyncio
+import logging
+import math
+import threading
+import time
+
+from admission import parse_route_rules, route_key
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(Exception):
+    """Raised instead of starting work the request no longer has time for."""
+
+
+class RequestScope:
+    """
+    Deadline of one request, and the database connections running a
+    statement for it, so they can be cancelled if the client goes away.
+    Shared with the worker threads serving the request through a contextvar.
+    """
+
+    def __init__(self, deadline: Optional[float] = None, route: Optional[str] = None):
+        """
+        Args:
+            deadline: time.monotonic() by which the request must be answered
+            route: The request's route key, e.g. "GET /tasks/{task_id}"
+        """
+        self.deadline = deadline
+        self.route = route
+        self.cancelled = False
+        self.responded = False
+        self.connections: Set[Any] = set()
+        self.lock = threading.Lock()
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left, None without a deadline; negative once it passed."""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def check(self) -> Optional[float]:
+        """
+        Make sure the request is still worth working on.
+
+        Returns:
+            Seconds left, or None without a deadline
+
+        Raises:
+            DeadlineExceeded: If the deadline passed or the client went away
+        """
+        remaining = self.remaining()
+        if self.cancelled or (remaining is not None and remaining <= 0):
+            raise self.exceeded()
+        return remaining
+
+    def exceeded(self) -> DeadlineExceeded:
+        """The error reporting why the request was given up on."""
+        return DeadlineExceeded("Client disconnected" if self.cancelled else "Request deadline exceeded")
+
+    def statement_timeout_ms(self) -> Optional[int]:
+        """
+        Remaining time as a statement_timeout value.
+
+        Raises:
+            DeadlineExceeded: If the deadline passed or the client went away
+        """
+        remaining = self.check()
+        return None if remaining is None else max(1, math.ceil(remaining * 1000))
+
+    def attach(self, connection):
+        """Register a DBAPI connection that is running a statement for this request."""
+        with self.lock:
+            self.connections.add(connection)
+        if self.cancelled:
+            # Cancelled between check() and attach(); cancel() did not see this one
+            self.cancel_statement(connection)
+
+    def detach(self, connection):
+        with self.lock:
+            self.connections.discard(connection)
+
+    def respond(self):
+        """
+        Note that the response was sent. Background tasks that run afterwards
+        are neither bounded by the deadline nor cancelled with the request.
+        """
+        self.responded = True
+        self.deadline = None
+
+    def cancel(self):
+        """Give up on the request and cancel the statements running for it."""
+        with self.lock:
+            self.cancelled = True
+            connections = list(self.connections)
+        for connection in connections:
+            self.cancel_statement(connection)
+
+    @staticmethod
+    def cancel_statement(connection):
+        try:
+            connection.cancel()
+        except Exception as e:
+            logger.warning(f"Could not cancel database statement: {e}")
+
+    def caused(self, exc: BaseException) -> bool:
+        """Whether a database error is a statement this scope cut short."""
+        remaining = self.remaining()
+        return isinstance(exc, QueryCanceled) and (self.cancelled or (remaining is not None and remaining <= 0))
+
+
+# Scope of the request being served, if any; background jobs run without one
+current_scope: ContextVar[Optional[RequestScope]] = ContextVar("request_scope", default=None)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left for the current request, None outside requests or without a deadline."""
+    scope = current_scope.get()
+    return scope.remaining() if scope is not None else None
+
+
+def cut_short(exc: BaseException) -> bool:
+    """Whether a database error was caused by the current request's deadline or disconnect."""
+    scope = current_scope.get()
+    return scope is not None and scope.caused(exc)
+
+
+class DeadlineMiddleware:
+    """
+    Give every request a deadline and stop working on it once it is gone.
+    The deadline is the route's budget, shortened by a client's
+    X-Request-Timeout header (seconds). It is carried in `current_scope`,
+    so SQL statement timeouts and Redis reads are bounded by the time left.
+    When the client disconnects, the handler is cancelled and its running
+    statements are cancelled on the server; a handler still running after
+    the deadline is abandoned with 504, and marked with `deadline_exceeded`
+    in the ASGI scope so inner middlewares can tell it from a disconnect.
+    """
+
+    HEADER = b"x-request-timeout"
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        routes: Iterable[BaseRoute],
+        timeout: float = 10.0,
+        route_timeouts: Optional[str] = None,
+        grace: float = 0.5,
+    ):
+        """
+        Args:
+            app: The wrapped ASGI application
+            routes: The app's routes, used to find a request's route template
+            timeout: Default budget in seconds, 0 for none
+            route_timeouts: Comma separated "METHOD /template=seconds" budgets,
+                e.g. "DELETE /rooms/{room_id}=60"
+            grace: Seconds past the deadline before the handler is abandoned,
+                so statement timeouts can answer first
+        """
+        self.app = app
+        self.routes = routes
+        self.timeout = timeout
+        self.route_timeouts = parse_route_rules(route_timeouts or "", float)
+        self.grace = grace
+
+    def budget(self, scope: Scope) -> Optional[float]:
+        """Seconds the request may take, or None without a limit."""
+        timeout = self.route_timeouts.get(route_key(self.routes, scope), self.timeout) or None
+        for name, value in scope["headers"]:
+            if name == self.HEADER:
+                try:
+                    requested = float(value)
+                except ValueError:
+                    break
+                # Clients may only shorten the budget
+                if requested > 0 and (timeout is None or requested < timeout):
+                    timeout = requested
+                break
+        return timeout
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        budget = self.budget(scope)
+        request_scope = RequestScope(
+            time.monotonic() + budget if budget is not None else None,
+            route_key(self.routes, scope),
+        )
+        token = current_scope.set(request_scope)
+        try:
+            await self.run(request_scope, budget, scope, receive, send)
+        finally:
+            current_scope.reset(token)
+
+    async def run(self, request_scope: RequestScope, budget: Optional[float], scope: Scope, receive: Receive, send: Send):
+        # Read the client's messages here so a disconnect is noticed while the
+        # handler runs, even if it never reads the body; it gets them from a queue
+        messages: asyncio.Queue = asyncio.Queue()
+        responded = asyncio.Event()
+        started = False
+
+        async def send_wrapper(message: Message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                request_scope.respond()
+                responded.set()
+
+        handler = asyncio.ensure_future(self.app(scope, messages.get, send_wrapper))
+
+        async def listen():
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    if not handler.done() and not request_scope.responded:
+                        request_scope.cancel()
+                        handler.cancel()
+                    return
+
+        listener = asyncio.ensure_future(listen())
+        response_sent = asyncio.ensure_future(responded.wait())
+        try:
+            done, _ = await asyncio.wait(
+                {handler, response_sent},
+                timeout=budget + self.grace if budget is not None else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                logger.warning(f"{route_key(self.routes, scope)} abandoned after its {budget:.1f}s deadline")
+                request_scope.cancel()
+                scope["deadline_exceeded"] = True
+                handler.cancel()
+                if not started:
+                    response = JSONResponse({"detail": "Request deadline exceeded"}, status_code=504)
+                    await response(scope, receive, send)
+                return
+            # Background tasks may still run once the response was sent
+            await asyncio.wait({handler})
+            if handler.cancelled():
+                # The client went away; nobody is left to answer
+                return
+            handler.result()
+        except asyncio.CancelledError:
+            request_scope.cancel()
+            handler.cancel()
+            raise
+        finally:
+            listener.cancel()
+            response_sent.cancel()
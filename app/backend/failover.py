@@ -0,0 +1,400 @@
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+from redis import BlockingConnectionPool
+from redis.exceptions import ConnectionError, TimeoutError
+from redis.sentinel import Sentinel, SentinelConnectionPool, SentinelManagedConnection
+import logging
+import threading
+import time
+
+from breaker import CircuitBreaker
+from deadline import remaining
+
+logger = logging.getLogger(__name__)
+
+# Breaker token of the checkout in progress, for connections opened during it
+checkout_probe: ContextVar[int] = ContextVar("checkout_probe", default=0)
+
+
+class GuardedConnection(SentinelManagedConnection):
+    """
+    Sentinel-managed connection bounded by the current request's deadline.
+    Commands are not sent once the deadline passed, and replies are awaited
+    no longer than the request has left. With a circuit breaker, every
+    reply, failure and its latency are reported to it, with the breaker
+    token of the checkout that handed the connection out; timeouts caused by
+    the deadline are not, since they say nothing about Redis. Pipelines and
+    scripts go through the connection too, so every command is covered.
+    A connection that cannot reach its server, or finds the master demoted
+    to a replica, makes a CachingSentinel forget the cached address, so the
+    next connection asks Sentinel instead of retrying a stale one.
+    """
+
+    def __init__(self, **kwargs):
+        self.breaker: Optional[CircuitBreaker] = kwargs.pop("breaker", None)
+        self.probe = 0
+        super().__init__(**kwargs)
+
+    def connect(self):
+        try:
+            return super().connect()
+        except (ConnectionError, TimeoutError):
+            if self.breaker is not None:
+                self.breaker.record(False, probe=checkout_probe.get() or self.probe)
+            self.forget_address()
+            raise
+
+    def send_packed_command(self, command, check_health=True):
+        left = remaining()
+        if left is not None and left <= 0:
+            raise TimeoutError("Request deadline exceeded")
+        return super().send_packed_command(command, check_health)
+
+    def read_response(self, *args, **kwargs):
+        start = time.perf_counter()
+        left = remaining()
+        shortened = left is not None and self._sock is not None and (
+            self.socket_timeout is None or left < self.socket_timeout
+        )
+        if shortened:
+            self._sock.settimeout(max(left, 0.001))
+        try:
+            response = super().read_response(*args, **kwargs)
+        except (ConnectionError, TimeoutError):
+            # A read-only reply from the master surfaces as a ConnectionError too
+            if not shortened:
+                if self.breaker is not None:
+                    self.breaker.record(False, time.perf_counter() - start, self.probe)
+                self.forget_address()
+            raise
+        finally:
+            # A timed-out connection was disconnected and has no socket left
+            if shortened and self._sock is not None:
+                self._sock.settimeout(self.socket_timeout)
+        if self.breaker is not None:
+            self.breaker.record(True, time.perf_counter() - start, self.probe)
+        return response
+
+    def forget_address(self):
+        """Drop the address this connection was opened from the Sentinel cache."""
+        pool = self.connection_pool
+        forget = getattr(pool.sentinel_manager, "forget", None)
+        if forget is not None:
+            forget(pool.service_name, master=pool.is_master, slaves=not pool.is_master)
+
+
+class BlockingSentinelConnectionPool(SentinelConnectionPool, BlockingConnectionPool):
+    """
+    Sentinel-managed connection pool with a fixed number of connections.
+    When every connection is checked out, callers wait up to `timeout` seconds
+    for one to be released instead of opening another socket, and give up
+    with a ConnectionError after that. Checkouts are counted for monitoring.
+    Connections are bounded by request deadlines (see GuardedConnection).
+    With a circuit breaker, checkouts fail at once with CircuitOpenError while
+    it is open.
+    """
+
+    def __init__(self, service_name, sentinel_manager, breaker: Optional[CircuitBreaker] = None, **kwargs):
+        self.breaker = breaker
+        kwargs.setdefault("connection_class", GuardedConnection)
+        super().__init__(service_name, sentinel_manager, **kwargs)
+        if breaker is not None:
+            self.connection_kwargs["breaker"] = breaker
+
+    def reset(self):
+        # Also runs in a forked child on first use, so its counters start from zero
+        self.stats_lock = threading.Lock()
+        self.in_use = 0
+        self.waiting = 0
+        self.max_in_use = 0
+        self.checkouts = 0
+        self.failed_checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        super().reset()
+
+    def get_connection(self, command_name=None, *keys, **options):
+        probe = self.breaker.check() if self.breaker is not None else 0
+        start = time.perf_counter()
+        with self.stats_lock:
+            self.waiting += 1
+        token = checkout_probe.set(probe)
+        try:
+            connection = super().get_connection(command_name, *keys, **options)
+        except Exception:
+            with self.stats_lock:
+                self.waiting -= 1
+                self.failed_checkouts += 1
+            raise
+        finally:
+            checkout_probe.reset(token)
+        connection.probe = probe
+
+        waited = time.perf_counter() - start
+        with self.stats_lock:
+            self.waiting -= 1
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        return connection
+
+    def release(self, connection):
+        with self.stats_lock:
+            self.in_use = max(0, self.in_use - 1)
+        connection.probe = 0
+        super().release(connection)
+
+    def stats(self) -> Dict[str, Any]:
+        """Usage of the pool since it was created or last reset."""
+        with self.stats_lock:
+            return {
+                "max_connections": self.max_connections,
+                "in_use": self.in_use,
+                "max_in_use": self.max_in_use,
+                "waiting": self.waiting,
+                "checkouts": self.checkouts,
+                "failed_checkouts": self.failed_checkouts,
+                "wait_ms_avg": round(self.wait_seconds_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "wait_ms_max": round(self.wait_seconds_max * 1000, 3),
+            }
+
+    def disconnect(self, inuse_connections: bool = True):
+        """
+        Close pooled connections; they reconnect on next use.
+        BlockingConnectionPool.disconnect takes no arguments, but Sentinel's
+        pool proxy asks for idle connections only when the master changes.
+
+        Args:
+            inuse_connections: Whether to close checked-out connections too
+        """
+        if inuse_connections:
+            super().disconnect()
+            return
+        self._checkpid()
+        with self.pool.mutex:
+            idle = [connection for connection in self.pool.queue if connection is not None]
+        for connection in idle:
+            connection.disconnect()
+
+    def switch_master(self, address: Tuple[str, int]):
+        """
+        Point a master pool at a new master right away.
+        Idle and in-use connections to the old master are closed: commands in
+        flight fail now instead of waiting out the socket timeout, and every
+        connection reconnects to the new address on next use.
+
+        Args:
+            address: Host and port of the new master
+        """
+        self.proxy.master_address = address
+        self.disconnect(inuse_connections=True)
+        if self.breaker is not None:
+            # Failures of the old master say nothing about the new one
+            self.breaker.reset()
+
+    def disconnect_address(self, host: str, port: int) -> int:
+        """
+        Close the connections to an instance that went down, idle or in use.
+
+        Args:
+            host: Host of the instance
+            port: Port of the instance
+
+        Returns:
+            int: Number of connections closed
+        """
+        closed = 0
+        for connection in list(self._connections):
+            if (connection.host, connection.port) == (host, port):
+                connection.disconnect()
+                closed += 1
+        return closed
+
+
+class CachingSentinel(Sentinel):
+    """
+    Sentinel client that remembers the master and replica addresses it has
+    discovered, so opening a connection does not query Sentinel every time.
+    Addresses are forgotten after address_ttl seconds, or as soon as a
+    SentinelFailoverListener sees the topology change.
+    """
+
+    def __init__(self, sentinels: List[Tuple[str, int]], address_ttl: float = 60.0, **kwargs):
+        """
+        Args:
+            sentinels: Host and port of every Sentinel
+            address_ttl: Seconds a discovered address is trusted without an event
+            **kwargs: Passed to redis.sentinel.Sentinel
+        """
+        super().__init__(sentinels, **kwargs)
+        self.address_ttl = address_ttl
+        self.address_lock = threading.Lock()
+        self.masters: Dict[str, Tuple[Tuple[str, int], float]] = {}
+        self.slaves: Dict[str, Tuple[List[Tuple[str, int]], float]] = {}
+
+    def discover_master(self, service_name: str) -> Tuple[str, int]:
+        with self.address_lock:
+            cached = self.masters.get(service_name)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+
+        address = super().discover_master(service_name)
+        self.set_master(service_name, address)
+        return address
+
+    def discover_slaves(self, service_name: str) -> List[Tuple[str, int]]:
+        with self.address_lock:
+            cached = self.slaves.get(service_name)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+
+        slaves = super().discover_slaves(service_name)
+        if slaves:
+            # An empty list is asked again next time; the master serves reads meanwhile
+            with self.address_lock:
+                self.slaves[service_name] = (slaves, time.monotonic() + self.address_ttl)
+        return slaves
+
+    def set_master(self, service_name: str, address: Tuple[str, int]):
+        with self.address_lock:
+            self.masters[service_name] = (address, time.monotonic() + self.address_ttl)
+
+    def forget(self, service_name: str, master: bool = True, slaves: bool = True):
+        """Drop cached addresses so the next connection asks Sentinel again."""
+        with self.address_lock:
+            if master:
+                self.masters.pop(service_name, None)
+            if slaves:
+                self.slaves.pop(service_name, None)
+
+
+class SentinelFailoverListener:
+    """
+    Background thread that follows Sentinel's event channels and updates the
+    connection pools as soon as the topology changes, rather than when
+    commands to a dead or demoted instance time out:
+
+        +switch-master: the cached master address is replaced and every
+            master connection is closed, so the next command reaches the new master.
+        +sdown: connections to an instance Sentinel considers down are closed
+            and its cached address is dropped.
+        -sdown: the replica list is rediscovered to include the instance again.
+
+    One subscription is enough since every Sentinel publishes the events;
+    if it drops, the next Sentinel is tried.
+    """
+
+    EVENTS = ("+switch-master", "+sdown", "-sdown")
+
+    def __init__(
+        self,
+        sentinel: CachingSentinel,
+        service_name: str,
+        master_pool: BlockingSentinelConnectionPool,
+        replica_pool: BlockingSentinelConnectionPool,
+        reconnect_delay: float = 1.0,
+    ):
+        """
+        Args:
+            sentinel: Sentinel client whose address cache is kept current
+            service_name: Redis service name in Sentinel
+            master_pool: Connection pool of the master client
+            replica_pool: Connection pool of the replica client
+            reconnect_delay: Seconds to wait after every Sentinel was unreachable
+        """
+        self.sentinel = sentinel
+        self.service_name = service_name
+        self.master_pool = master_pool
+        self.replica_pool = replica_pool
+        self.reconnect_delay = reconnect_delay
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.events = 0
+
+    def start(self):
+        """Start listening in a daemon thread of the current process."""
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="sentinel-events", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: float = 2.0):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def run(self):
+        while not self.stopped.is_set():
+            for client in list(self.sentinel.sentinels):
+                if self.stopped.is_set():
+                    return
+                self.listen(client)
+            self.stopped.wait(self.reconnect_delay)
+
+    def listen(self, client):
+        """Follow the events of one Sentinel until it fails or the listener stops."""
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(*self.EVENTS)
+            # Events published while no Sentinel was followed are lost
+            self.sentinel.forget(self.service_name)
+            logger.info(f"Following Sentinel events of {self.service_name} on {client}")
+            while not self.stopped.is_set():
+                message = pubsub.get_message(timeout=1.0)
+                if message is not None and message["type"] == "message":
+                    self.handle(self.decode(message["channel"]), self.decode(message["data"]))
+        except Exception as e:
+            logger.warning(f"Lost Sentinel event subscription on {client}: {e}")
+        finally:
+            try:
+                pubsub.close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def decode(value: Any) -> str:
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    def handle(self, channel: str, data: str):
+        """
+        Apply one Sentinel event.
+
+        Args:
+            channel: Event name, e.g. "+switch-master"
+            data: Event payload, e.g. "mymaster 10.0.0.1 6379 10.0.0.2 6379"
+        """
+        parts = data.split()
+        if channel == "+switch-master":
+            # <master name> <old ip> <old port> <new ip> <new port>
+            if len(parts) < 5 or parts[0] != self.service_name:
+                return
+            address = (parts[3], int(parts[4]))
+            self.events += 1
+            logger.warning(f"Redis master of {self.service_name} switched to {address[0]}:{address[1]}")
+            self.sentinel.set_master(self.service_name, address)
+            # The new master has left the replica set
+            self.sentinel.forget(self.service_name, master=False)
+            self.master_pool.switch_master(address)
+            return
+
+        # <instance type> <name> <ip> <port> [@ <master name> <master ip> <master port>]
+        if len(parts) < 4:
+            return
+        role, name, host, port = parts[0], parts[1], parts[2], int(parts[3])
+        master_name = parts[5] if len(parts) > 5 and parts[4] == "@" else name
+        if master_name != self.service_name or role not in ("master", "slave"):
+            return
+
+        self.events += 1
+        if channel == "-sdown":
+            logger.info(f"Redis {role} {host}:{port} of {self.service_name} is back up")
+            self.sentinel.forget(self.service_name, master=False)
+            return
+
+        logger.warning(f"Redis {role} {host}:{port} of {self.service_name} is down")
+        self.sentinel.forget(self.service_name, master=role == "master", slaves=True)
+        closed = self.replica_pool.disconnect_address(host, port)
+        if role == "master":
+            closed += self.master_pool.disconnect_address(host, port)
+        logger.info(f"Closed {closed} connections to {host}:{port}")
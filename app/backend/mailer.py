@@ -1,69 +1,393 @@
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
+from email.message import EmailMessage
+from typing import Any, Dict, Optional
+import aiosmtplib
+import asyncio
+import json
+import logging
 import os
+import random
+import socket
+import time
 
+from manager import redis_manager
+from tracing import traceparent, tracer
 
-mail_config = ConnectionConfig(
-    MAIL_USERNAME = os.getenv("MAIL_USERNAME", "your-email@example.com"),
-    MAIL_PASSWORD = os.getenv("MAIL_PASSWORD", "your-password"),
-    MAIL_FROM = os.getenv("MAIL_FROM", "your-email@example.com"),
-    MAIL_PORT = int(os.getenv("MAIL_PORT", 587)),
-    MAIL_SERVER = os.getenv("MAIL_SERVER", "smtp.gmail.com"),
-    MAIL_TLS = True,
-    MAIL_SSL = False
-)
+logger = logging.getLogger(__name__)
+
+# SMTP settings
+MAIL_USERNAME = os.getenv("MAIL_USERNAME", "your-email@example.com")
+MAIL_PASSWORD = os.getenv("MAIL_PASSWORD", "your-password")
+MAIL_FROM = os.getenv("MAIL_FROM", "your-email@example.com")
+MAIL_PORT = int(os.getenv("MAIL_PORT", 587))
+MAIL_SERVER = os.getenv("MAIL_SERVER", "smtp.gmail.com")
+MAIL_STARTTLS = os.getenv("MAIL_STARTTLS", "True").lower() == "true"
+MAIL_SSL_TLS = os.getenv("MAIL_SSL_TLS", "False").lower() == "true"
+MAIL_TIMEOUT = float(os.getenv("MAIL_TIMEOUT", "10"))
+
+# Outbox settings
+OUTBOX_STREAM = os.getenv("MAIL_OUTBOX_STREAM", "mail:outbox")
+OUTBOX_GROUP = "mail-workers"
+OUTBOX_RETRY_KEY = f"{OUTBOX_STREAM}:retry"
+OUTBOX_DEAD_LETTER_STREAM = f"{OUTBOX_STREAM}:dead"
+OUTBOX_MAX_LENGTH = int(os.getenv("MAIL_OUTBOX_MAX_LENGTH", "100000"))
+OUTBOX_BATCH_SIZE = int(os.getenv("MAIL_OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("MAIL_OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_RETRY_BASE_DELAY = float(os.getenv("MAIL_OUTBOX_RETRY_BASE_DELAY", "2"))  # seconds
+OUTBOX_RETRY_MAX_DELAY = float(os.getenv("MAIL_OUTBOX_RETRY_MAX_DELAY", "300"))  # seconds
+OUTBOX_POLL_INTERVAL = float(os.getenv("MAIL_OUTBOX_POLL_INTERVAL", "0.5"))  # seconds
+OUTBOX_CLAIM_IDLE_MS = int(os.getenv("MAIL_OUTBOX_CLAIM_IDLE_MS", "60000"))
+
+# SMTP connection pool settings
+SMTP_POOL_SIZE = int(os.getenv("MAIL_SMTP_POOL_SIZE", "2"))
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv("MAIL_SMTP_MAX_MESSAGES_PER_CONNECTION", "100"))
 
 # Frontend URL for links
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
 
 
+class PooledSMTPConnection:
+    """
+    A reusable SMTP connection that tracks how many messages it has sent.
+    """
+
+    def __init__(self):
+        self.client: Optional[aiosmtplib.SMTP] = None
+        self.sent = 0
+
+    @property
+    def is_usable(self) -> bool:
+        return (
+            self.client is not None
+            and self.client.is_connected
+            and self.sent < SMTP_MAX_MESSAGES_PER_CONNECTION
+        )
+
+    async def connect(self):
+        """
+        Open the connection, negotiating TLS and authenticating once.
+        """
+        await self.close()
+        self.client = aiosmtplib.SMTP(
+            hostname=MAIL_SERVER,
+            port=MAIL_PORT,
+            username=MAIL_USERNAME or None,
+            password=MAIL_PASSWORD or None,
+            use_tls=MAIL_SSL_TLS,
+            start_tls=MAIL_STARTTLS,
+            timeout=MAIL_TIMEOUT,
+        )
+        await self.client.connect()
+        self.sent = 0
+
+    async def close(self):
+        """
+        Close the connection, ignoring errors from an already broken socket.
+        """
+        if self.client is not None and self.client.is_connected:
+            try:
+                await self.client.quit()
+            except Exception:
+                self.client.close()
+        self.client = None
+
+
+class SMTPConnectionPool:
+    """
+    A fixed-size pool of persistent SMTP connections.
+    Connections are opened lazily and recycled after a number of messages,
+    so the TCP and TLS handshakes are paid once per connection instead of per message.
+    """
+
+    def __init__(self, size: int = SMTP_POOL_SIZE):
+        self.size = size
+        self._connections: asyncio.Queue = asyncio.Queue()
+        for _ in range(size):
+            self._connections.put_nowait(PooledSMTPConnection())
+
+    @tracer.traced("smtp.send", "client")
+    async def send(self, message: EmailMessage):
+        """
+        Send a message over a pooled connection.
+
+        Args:
+            message: Message to send
+
+        Raises:
+            aiosmtplib.SMTPException: If the message could not be sent
+        """
+        connection = await self._connections.get()
+        try:
+            if not connection.is_usable:
+                await connection.connect()
+            await connection.client.send_message(message)
+            connection.sent += 1
+        except Exception:
+            # Never hand a connection in an unknown state to the next sender
+            await connection.close()
+            raise
+        finally:
+            self._connections.put_nowait(connection)
+
+    async def close(self):
+        """
+        Close all pooled connections.
+        """
+        for _ in range(self.size):
+            connection = await self._connections.get()
+            await connection.close()
+            self._connections.put_nowait(connection)
+
+
+def build_message(recipient: str, subject: str, body: str) -> EmailMessage:
+    """
+    Build a plain text email message.
+
+    Args:
+        recipient: Recipient email address
+        subject: Message subject
+        body: Message body
+
+    Returns:
+        EmailMessage ready to be sent
+    """
+    message = EmailMessage()
+    message["From"] = MAIL_FROM
+    message["To"] = recipient
+    message["Subject"] = subject
+    message.set_content(body)
+    return message
+
+
+async def enqueue_email(recipient: str, subject: str, body: str):
+    """
+    Put an email into the outbox for the worker to deliver.
+    Falls back to sending inline if the outbox is unavailable, so mail is not lost.
+    The request's traceparent travels with the entry, so its delivery shows
+    up in the same trace.
+
+    Args:
+        recipient: Recipient email address
+        subject: Message subject
+        body: Message body
+    """
+    payload = {"recipient": recipient, "subject": subject, "body": body, "attempts": 0}
+    parent = traceparent()
+    if parent is not None:
+        payload["traceparent"] = parent
+    payload = json.dumps(payload)
+    entry_id = await asyncio.to_thread(
+        redis_manager.stream_add, OUTBOX_STREAM, {"payload": payload}, OUTBOX_MAX_LENGTH
+    )
+    if entry_id is None:
+        logger.warning("Mail outbox unavailable, sending email inline")
+        with tracer.span("smtp.send", "client", {"smtp.inline": True}):
+            await aiosmtplib.send(
+                build_message(recipient, subject, body),
+                hostname=MAIL_SERVER,
+                port=MAIL_PORT,
+                username=MAIL_USERNAME or None,
+                password=MAIL_PASSWORD or None,
+                use_tls=MAIL_SSL_TLS,
+                start_tls=MAIL_STARTTLS,
+                timeout=MAIL_TIMEOUT,
+            )
+
+
+class OutboxWorker:
+    """
+    Drains the mail outbox stream over pooled SMTP connections.
+    Entries are read in batches through a consumer group, sent concurrently,
+    and acknowledged only after delivery. Failed sends are retried with
+    exponential backoff and moved to a dead letter stream after the last attempt;
+    an entry whose retry could not be stored stays pending and is claimed again.
+    """
+
+    def __init__(self, pool: Optional[SMTPConnectionPool] = None, consumer: Optional[str] = None):
+        self.pool = pool or SMTPConnectionPool()
+        self.consumer = consumer
+        self._stopped = asyncio.Event()
+
+    async def run(self):
+        """
+        Process the outbox until stop() is called.
+        """
+        if self.consumer is None:
+            # Named on start so every forked server worker is a separate consumer
+            self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        await asyncio.to_thread(redis_manager.stream_ensure_group, OUTBOX_STREAM, OUTBOX_GROUP)
+        logger.info(f"Mail outbox worker {self.consumer} started")
+
+        while not self._stopped.is_set():
+            try:
+                processed = await self.process_batch()
+            except Exception as e:
+                logger.error(f"Mail outbox worker error: {e}")
+                processed = 0
+
+            if not processed:
+                try:
+                    await asyncio.wait_for(self._stopped.wait(), timeout=OUTBOX_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+
+        await self.pool.close()
+        logger.info(f"Mail outbox worker {self.consumer} stopped")
+
+    def stop(self):
+        """
+        Ask the worker to finish its current batch and exit.
+        """
+        self._stopped.set()
+
+    async def process_batch(self) -> int:
+        """
+        Deliver one batch of outbox entries.
+
+        Returns:
+            int: Number of entries processed
+        """
+        await self._requeue_due_retries()
+
+        entries = await asyncio.to_thread(
+            redis_manager.stream_read_group, OUTBOX_STREAM, OUTBOX_GROUP, self.consumer, OUTBOX_BATCH_SIZE
+        )
+        if not entries:
+            # Recover entries from workers that died mid-batch
+            entries = await asyncio.to_thread(
+                redis_manager.stream_claim_stale,
+                OUTBOX_STREAM, OUTBOX_GROUP, self.consumer, OUTBOX_CLAIM_IDLE_MS, OUTBOX_BATCH_SIZE
+            )
+        if not entries:
+            return 0
+
+        results = await asyncio.gather(*(self._deliver(fields) for _, fields in entries))
+        # Entries whose retry could not be stored stay pending, to be claimed again
+        settled = [entry_id for (entry_id, _), result in zip(entries, results) if result is not None]
+        await asyncio.to_thread(redis_manager.stream_ack, OUTBOX_STREAM, OUTBOX_GROUP, settled)
+
+        sent = sum(1 for result in results if result)
+        logger.info(f"Mail outbox batch processed: {sent}/{len(entries)} sent, {len(entries) - len(settled)} left pending")
+        return len(entries)
+
+    async def _deliver(self, fields: Dict[str, Any]) -> Optional[bool]:
+        """
+        Send a single outbox entry, scheduling a retry on failure.
+        Retries live in a separate sorted set, so the entry can be acknowledged
+        once it was sent or its retry was stored.
+
+        Args:
+            fields: Stream entry fields
+
+        Returns:
+            bool: True if the message was sent, False if it was retried, dead-lettered
+                or dropped, None if its retry could not be stored and it must stay pending
+        """
+        try:
+            payload = json.loads(fields["payload"])
+        except (KeyError, json.JSONDecodeError) as e:
+            logger.error(f"Dropping malformed outbox entry: {e}")
+            return False
+
+        try:
+            # Continues the trace of the request that queued the email, if it was sampled
+            with tracer.trace("mail.deliver", payload.get("traceparent"), "consumer", {"mail.attempts": payload["attempts"]}):
+                await self.pool.send(build_message(payload["recipient"], payload["subject"], payload["body"]))
+            return True
+        except Exception as e:
+            payload["attempts"] += 1
+            payload["last_error"] = str(e)
+            if not await self._schedule_retry(payload):
+                return None
+            return False
+
+    async def _schedule_retry(self, payload: Dict[str, Any]) -> bool:
+        """
+        Schedule a failed message for another attempt, or dead-letter it.
+
+        Args:
+            payload: Message payload including the attempt count
+
+        Returns:
+            bool: True if the retry or dead letter was stored
+        """
+        if payload["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+            logger.error(f"Giving up on email to {payload['recipient']} after {payload['attempts']} attempts: {payload['last_error']}")
+            entry_id = await asyncio.to_thread(
+                redis_manager.stream_add, OUTBOX_DEAD_LETTER_STREAM, {"payload": json.dumps(payload)}, OUTBOX_MAX_LENGTH
+            )
+            return entry_id is not None
+
+        # Exponential backoff with full jitter
+        delay = random.uniform(0, min(OUTBOX_RETRY_BASE_DELAY * (2 ** payload["attempts"]), OUTBOX_RETRY_MAX_DELAY))
+        logger.warning(f"Email to {payload['recipient']} failed (attempt {payload['attempts']}), retrying in {delay:.1f}s: {payload['last_error']}")
+        return await asyncio.to_thread(redis_manager.schedule, OUTBOX_RETRY_KEY, json.dumps(payload), time.time() + delay)
+
+    async def _requeue_due_retries(self):
+        """
+        Move retries whose backoff has elapsed back into the outbox stream.
+        pop_due already removed them from the retry set, so any that cannot be
+        added to the stream are put back, due at once.
+        """
+        due = await asyncio.to_thread(redis_manager.pop_due, OUTBOX_RETRY_KEY, time.time(), OUTBOX_BATCH_SIZE)
+        for index, payload in enumerate(due):
+            entry_id = await asyncio.to_thread(redis_manager.stream_add, OUTBOX_STREAM, {"payload": payload}, OUTBOX_MAX_LENGTH)
+            if entry_id is None:
+                lost = 0
+                for pending in due[index:]:
+                    if not await asyncio.to_thread(redis_manager.schedule, OUTBOX_RETRY_KEY, pending, time.time()):
+                        lost += 1
+                if lost:
+                    logger.error(f"Lost {lost} email retries that could neither be requeued nor put back")
+                return
+
+
 async def send_invite_email(email: str, room_name: str, invite_code: str):
     """
-    Send an invitation email to join a task room.
-    
+    Queue an invitation email to join a task room.
+
     Args:
         email: Recipient email address
         room_name: Name of the room
         invite_code: Invite code for the room
     """
-    message = MessageSchema(
+    await enqueue_email(
+        recipient=email,
         subject=f"Invitation to join task room: {room_name}",
-        recipients=[email],
         body=f"""
         You've been invited to join the task room "{room_name}"!
-        
+
         Click the link below to join:
         {FRONTEND_URL}/join-room?invite_code={invite_code}
-        
+
         This link will take you to the login page if you're not already logged in.
         """
     )
 
-    fm = FastMail(mail_config)
-    await fm.send_message(message)
-
 
 async def send_magic_link_email(email: str, token: str):
     """
-    Send a magic link email for authentication.
-    
+    Queue a magic link email for authentication.
+
     Args:
         email: Recipient email address
         token: Authentication token
     """
-    message = MessageSchema(
+    await enqueue_email(
+        recipient=email,
         subject="Your login link for Task Manager",
-        recipients=[email],
         body=f"""
         Hello!
-        
+
         Click the link below to log in to your Task Manager account:
         {FRONTEND_URL}/auth/verify?token={token}
-        
+
         This link will expire in 15 minutes and can only be used once.
-        
+
         If you didn't request this link, you can safely ignore this email.
         """
     )
 
-    fm = FastMail(mail_config)
-    await fm.send_message(message)
+
+if __name__ == "__main__":
+    # Run the outbox worker as a standalone process
+    asyncio.run(OutboxWorker().run())
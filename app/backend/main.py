@@ -1,25 +1,50 @@
+import asyncio
 from collections import defaultdict
 from datetime import datetime
-from fastapi import FastAPI, HTTPException, Depends, Query, status
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Depends, Header, Query, Request, Response, status
+from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi_socketio import SocketManager
-from typing import List
+from typing import List, Optional
 from pydantic import EmailStr
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, select, text
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
 # from mailer import send_invite_email
 from config import settings
-from models import RoomCreate, RoomResponse, TaskCreate, TaskUpdate, TaskResponse, RoomInviteRequest, RoomJoinRequest
-from manager import RedisManager, db_manager
+from models import RoomCreate, RoomResponse, TaskCreate, TaskUpdate, TaskResponse, RoomInviteRequest, RoomJoinRequest, RoomParticipantsRequest, RoomParticipantsResponse, RoomDetailResponse, RoomDeletionResponse
+from manager import redis_manager, db_manager, rate_limiter
 from database import (
     Task,
     get_db,
     Room,
     RoomParticipant,
+    User,
+    AuthToken,
+    SessionLocal,
 )  # Assuming TaskBase is renamed to Task for clarity
+from auth import router as auth_router, user_or_ip, get_current_user, require_operator
+from mailer import OutboxWorker
+from serializers import FastJSONResponse
+from task_cache import task_bloom, task_cache
+from revalidate import Freshness, StaleWhileRevalidate
+from write_behind import task_write_behind
+from compression import CompressionMiddleware
+from breaker import CircuitOpenError, breaker_states
+from admission import AdaptiveLimit, AdmissionController, AdmissionMiddleware
+from deadline import DeadlineExceeded, DeadlineMiddleware
+from tracing import TracingMiddleware, tracer
+from slow_queries import REPORT_ORDERS, slow_query_log
+from dbpool import PoolExhausted, PoolTimeout
 from fastapi.middleware.cors import CORSMiddleware
+import logging
+import math
+import orjson
 import os
 import socketio
+import time
+
+logger = logging.getLogger(__name__)
 
 # REDIS_SENTINEL_HOSTS = os.getenv("REDIS_SENTINEL_HOSTS", "localhost")
 # REDIS_SENTINEL_PORT = os.getenv("REDIS_SENTINEL_PORT", 26379)
@@ -34,24 +59,316 @@ app = FastAPI(
 # sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
 # socket_app = socketio.ASGIApp(sio, app)
 
+admission = AdmissionController(
+    AdaptiveLimit(
+        initial=settings.ADMISSION_INITIAL_LIMIT,
+        min_limit=settings.ADMISSION_MIN_LIMIT,
+        max_limit=settings.ADMISSION_MAX_LIMIT,
+        tolerance=settings.ADMISSION_LATENCY_TOLERANCE,
+    ),
+    routes=app.routes,
+    write_share=settings.ADMISSION_WRITE_SHARE,
+    route_share=settings.ADMISSION_ROUTE_SHARE,
+    route_limits=settings.ADMISSION_ROUTE_LIMITS,
+    exempt_paths=[path.strip() for path in settings.ADMISSION_EXEMPT_PATHS.split(",") if path.strip()],
+    queue_size=settings.ADMISSION_QUEUE_SIZE,
+    queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT,
+    retry_after=settings.ADMISSION_RETRY_AFTER,
+) if settings.ADMISSION_CONTROL_ENABLED else None
+
+# Added before CORS so shed responses still carry the CORS headers
+if admission is not None:
+    app.add_middleware(AdmissionMiddleware, controller=admission)
+
+# Outside admission control, so time spent queued counts against the deadline
+app.add_middleware(
+    DeadlineMiddleware,
+    routes=app.routes,
+    timeout=settings.REQUEST_TIMEOUT,
+    route_timeouts=settings.REQUEST_TIMEOUTS,
+)
+
+# Outermost of the three, so queueing and deadlines are part of the request span
+if tracer.enabled:
+    app.add_middleware(TracingMiddleware, tracer=tracer, routes=app.routes)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Allows all origins
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["ETag", "traceparent"],  # ETag lets browser clients send it back in If-Match
 )
 
-redis_manager = RedisManager(
-    sentinel_hosts=settings.REDIS_SENTINEL_HOSTS.split(","),
-    sentinel_port=(settings.REDIS_SENTINEL_PORT if isinstance(settings.REDIS_SENTINEL_PORT, int) else int(settings.REDIS_SENTINEL_PORT)),
-    service_name=settings.REDIS_SERVICE_NAME,
-    password=settings.REDIS_PASSWORD,
-    socket_timeout=0.5,
-    socket_connect_timeout=1.0,
+if settings.COMPRESSION_ENABLED:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=settings.COMPRESSION_MINIMUM_SIZE,
+        gzip_level=settings.COMPRESSION_GZIP_LEVEL,
+        brotli_quality=settings.COMPRESSION_BROTLI_QUALITY,
+        zstd_level=settings.COMPRESSION_ZSTD_LEVEL,
+        cache_size=settings.COMPRESSION_CACHE_SIZE,
+    )
+
+app.include_router(auth_router)
+
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_handler(request: Request, exc: CircuitOpenError):
+    """Fail fast with 503 while a required dependency's circuit breaker is open."""
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": f"{exc.breaker.name} is unavailable, retry later"},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+    )
+
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    """Answer 504 when a request ran out of time before its work was done."""
+    return JSONResponse(status_code=status.HTTP_504_GATEWAY_TIMEOUT, content={"detail": str(exc)})
+
+
+# Task writes share a per-user token bucket that allows short bursts
+task_write_limit = Depends(
+    rate_limiter.limit("task_write", limit=60, window=60, key_func=user_or_ip, algorithm="token_bucket")
 )
 
 
+def task_etag(task_id: int, version: int) -> str:
+    """Strong ETag of one version of a task."""
+    return f'"task-{task_id}-v{version}"'
+
+
+def task_response(fragment: str, status_code: int = status.HTTP_200_OK) -> FastJSONResponse:
+    """Response serving a task fragment with its version as the ETag."""
+    task = orjson.loads(fragment)
+    return FastJSONResponse(
+        fragment, status_code=status_code, headers={"ETag": task_etag(task["id"], task["version"])}
+    )
+
+
+def if_match_version(if_match: Optional[str], task_id: int) -> Optional[int]:
+    """
+    Get the task version an If-Match header requires.
+
+    Args:
+        if_match: The If-Match header, if any
+        task_id: The ID of the addressed task
+
+    Raises:
+        HTTPException: If the header can never match a version of this task
+
+    Returns:
+        The required version, or None if any version is acceptable
+    """
+    if if_match is None or if_match.strip() == "*":
+        return None
+    tag = if_match.strip()
+    prefix = f'"task-{task_id}-v'
+    if tag.startswith(prefix) and tag.endswith('"') and tag[len(prefix):-1].isdigit():
+        return int(tag[len(prefix):-1])
+    raise HTTPException(
+        status_code=status.HTTP_412_PRECONDITION_FAILED,
+        detail=f"If-Match does not match any version of task {task_id}",
+    )
+
+
+def flush_task_writes():
+    """
+    Write buffered task edits before writing a task directly, so the database
+    holds the versions clients were given and the buffered edits are not lost.
+
+    Raises:
+        HTTPException: If the buffer could not be flushed
+    """
+    try:
+        task_write_behind.flush()
+    except Exception as e:
+        logger.error(f"Task write-behind flush before a direct write failed: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Task updates are temporarily unavailable, retry later",
+        )
+
+
+def precondition_failed_or_not_found(db: Session, task_id: int, expected_version: Optional[int]):
+    """Raise 412 if a conditional write missed because the task changed, otherwise 404."""
+    if expected_version is not None and Task.current_version(db, task_id) is not None:
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail=f"Task with ID {task_id} was modified since version {expected_version}",
+        )
+    raise HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail=f"Task with ID {task_id} not found",
+    )
+
+
+def purge_auth_tokens() -> int:
+    """Delete used and expired magic link tokens left in the database."""
+    db = SessionLocal()
+    try:
+        return AuthToken.purge_expired(db, batch_size=settings.AUTH_TOKEN_PURGE_BATCH_SIZE)
+    finally:
+        db.close()
+
+
+async def purge_auth_tokens_periodically():
+    """Background job that keeps the auth_tokens table from growing."""
+    while True:
+        try:
+            await run_in_threadpool(purge_auth_tokens)
+        except Exception as e:
+            logger.error(f"Auth token purge failed: {e}")
+        await asyncio.sleep(settings.AUTH_TOKEN_PURGE_INTERVAL)
+
+
+def purge_room(room_id: int) -> Optional[dict]:
+    """
+    Delete a room marked as deleting in batches, publishing progress to Redis.
+    Every worker scans for pending deletions, so a Redis lock lets only one
+    of them purge a room at a time; the lock is extended after every batch.
+
+    Returns:
+        The deletion progress, or None if another worker is purging the room
+    """
+    lock_key = f"room:{room_id}:purge-lock"
+    lock = redis_manager.acquire_lock(lock_key, settings.ROOM_DELETE_LOCK_TTL)
+    if lock is None:
+        return None
+
+    def on_progress(progress: dict):
+        redis_manager.set(f"room:{room_id}:deletion", progress, expire=3600)
+        redis_manager.extend_lock(lock_key, lock, settings.ROOM_DELETE_LOCK_TTL)
+
+    db = SessionLocal()
+    try:
+        progress = Room.purge(
+            db,
+            room_id,
+            batch_size=settings.ROOM_DELETE_BATCH_SIZE,
+            batch_pause=settings.ROOM_DELETE_BATCH_PAUSE,
+            on_progress=on_progress,
+        )
+    finally:
+        db.close()
+        redis_manager.release_lock(lock_key, lock)
+    
+    # The room's tasks are gone; drop their cached fragments
+    if progress["tasks_deleted"]:
+        task_cache.invalidate()
+    return progress
+
+
+def purge_deleting_rooms() -> int:
+    """Finish deletions that were interrupted, e.g. by a restart."""
+    db = SessionLocal()
+    try:
+        room_ids = Room.deleting_ids(db)
+    finally:
+        db.close()
+    for room_id in room_ids:
+        purge_room(room_id)
+    return len(room_ids)
+
+
+async def purge_deleting_rooms_periodically():
+    """Background job that resumes pending room deletions."""
+    while True:
+        try:
+            await run_in_threadpool(purge_deleting_rooms)
+        except Exception as e:
+            logger.error(f"Room purge failed: {e}")
+        await asyncio.sleep(settings.ROOM_DELETE_SCAN_INTERVAL)
+
+
+def rebuild_task_bloom():
+    """Rebuild the Bloom filter of task IDs so deleted IDs drop out of it."""
+    db = SessionLocal()
+    try:
+        return task_bloom.rebuild(
+            lambda: db.execute(select(Task.id).execution_options(yield_per=10000)).scalars(),
+            lock_for=settings.TASK_BLOOM_REBUILD_INTERVAL,
+        )
+    finally:
+        db.close()
+
+
+async def rebuild_task_bloom_periodically():
+    """Background job that keeps the Bloom filter of task IDs current."""
+    while True:
+        try:
+            await run_in_threadpool(rebuild_task_bloom)
+        except Exception as e:
+            logger.error(f"Task bloom filter rebuild failed: {e}")
+        await asyncio.sleep(settings.TASK_BLOOM_REBUILD_INTERVAL)
+
+
+async def flush_task_writes_periodically():
+    """Background job that writes buffered task updates within the durability bound."""
+    while True:
+        await asyncio.sleep(settings.TASK_WRITE_BEHIND_INTERVAL)
+        try:
+            await run_in_threadpool(task_write_behind.flush)
+        except Exception as e:
+            logger.error(f"Task write-behind flush failed: {e}")
+
+
+# Keep references so running jobs are not garbage collected
+background_jobs: List[asyncio.Task] = []
+outbox_worker = OutboxWorker()
+room_cache_policy = StaleWhileRevalidate(
+    redis_manager,
+    soft_ttl=settings.ROOM_CACHE_SOFT_TTL,
+    hard_ttl=settings.ROOM_CACHE_TTL,
+    beta=settings.CACHE_XFETCH_BETA,
+    jitter=settings.CACHE_TTL_JITTER,
+    lock_ttl=settings.CACHE_REFRESH_LOCK_TTL,
+)
+
+
+@app.on_event("startup")
+async def start_background_jobs():
+    """Start periodic maintenance jobs and the mail outbox worker."""
+    background_jobs.append(asyncio.create_task(purge_auth_tokens_periodically()))
+    background_jobs.append(asyncio.create_task(purge_deleting_rooms_periodically()))
+    if task_bloom is not None:
+        background_jobs.append(asyncio.create_task(rebuild_task_bloom_periodically()))
+    if settings.TASK_WRITE_BEHIND:
+        # Reads that fall through to the database must see buffered updates
+        task_cache.before_load.append(task_write_behind.flush)
+        task_cache.dirty_key = task_write_behind.DIRTY_KEY
+        background_jobs.append(asyncio.create_task(flush_task_writes_periodically()))
+    if settings.MAIL_OUTBOX_WORKER:
+        app.state.outbox_job = asyncio.create_task(outbox_worker.run())
+    if settings.REDIS_FAILOVER_LISTENER:
+        app.state.failover_listener = redis_manager.watch_failovers()
+
+
+@app.on_event("shutdown")
+async def stop_background_jobs():
+    """Cancel periodic maintenance jobs, write buffered task updates and let the outbox worker finish its batch."""
+    for job in background_jobs:
+        job.cancel()
+    failover_listener = getattr(app.state, "failover_listener", None)
+    if failover_listener is not None:
+        failover_listener.stop()
+    if settings.TASK_WRITE_BEHIND:
+        try:
+            await run_in_threadpool(task_write_behind.flush)
+        except Exception as e:
+            logger.error(f"Task write-behind flush on shutdown failed: {e}")
+    outbox_job = getattr(app.state, "outbox_job", None)
+    if outbox_job is not None:
+        outbox_worker.stop()
+        await outbox_job
+    if tracer.processor is not None:
+        await run_in_threadpool(tracer.processor.flush)
+    slow_query_log.executor.shutdown(wait=False, cancel_futures=True)
+
+
 # @app.get(
 #     "/tasks/",
 #     response_model=List[TaskResponse],
@@ -271,27 +588,42 @@ redis_manager = RedisManager(
     "/tasks/",
     response_model=List[TaskResponse],
     status_code=status.HTTP_200_OK,
-    summary="Get all tasks",
+    summary="Get all tasks, or the tasks with the given IDs",
 )
-async def get_all_tasks(db: Session = Depends(get_db)):
+def get_all_tasks(
+    ids: Optional[str] = Query(None, description="Comma-separated task IDs, e.g. 1,2,3"),
+    db: Session = Depends(get_db),
+):
     """
-    Retrieve all tasks from the database.
+    Retrieve all tasks, or only the tasks with the given IDs.
+    The response is assembled from pre-rendered per-task JSON fragments;
+    selected tasks are fetched with one HMGET and one query for cache misses.
+
+    Args:
+        ids: Comma-separated IDs of the tasks to retrieve
+
+    Raises:
+        HTTPException: If ids is malformed or lists too many IDs
 
     Returns:
-        List[TaskResponse]: List of all tasks
+        List[TaskResponse]: The tasks, in the order requested; unknown IDs are left out
     """
-    # Try to get from cache first
-    redis_key = "tasks"
-    cached_tasks = redis_manager.get(redis_key)
-    if cached_tasks:
-        return cached_tasks
-    
-    # If not in cache, get from database
-    tasks = db.query(Task).all()
-    
-    # Cache the result
-    redis_manager.set(redis_key, tasks, expire=600)  # Cache for 10 minutes
-    return tasks
+    if ids is None:
+        return FastJSONResponse(task_cache.get_list(db))
+
+    try:
+        task_ids = [int(task_id) for task_id in ids.split(",") if task_id.strip()]
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="ids must be a comma-separated list of task IDs",
+        )
+    if len(task_ids) > settings.TASK_BATCH_MAX_IDS:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"At most {settings.TASK_BATCH_MAX_IDS} task IDs can be requested at once",
+        )
+    return FastJSONResponse(task_cache.join(task_cache.get_many(db, task_ids)))
 
 @app.get(
     "/tasks/{task_id}",
@@ -299,12 +631,19 @@ async def get_all_tasks(db: Session = Depends(get_db)):
     status_code=status.HTTP_200_OK,
     summary="Get a specific task",
 )
-async def get_task(task_id: int, db: Session = Depends(get_db)):
+def get_task(
+    task_id: int,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
     """
     Retrieve a specific task by its ID.
+    The response carries the task version as its ETag; a matching
+    If-None-Match gets 304 Not Modified.
 
     Args:
         task_id: The ID of the task to retrieve
+        if_none_match: ETag of the version the client already has
 
     Raises:
         HTTPException: If task is not found
@@ -312,133 +651,423 @@ async def get_task(task_id: int, db: Session = Depends(get_db)):
     Returns:
         TaskResponse: The requested task
     """
-    # Try to get from cache first
-    redis_key = f"task_{task_id}"
-    cached_task = redis_manager.get(redis_key)
-    if cached_task:
-        return cached_task
-    
-    # If not in cache, get from database
-    task = db.query(Task).filter(Task.id == task_id).first()
+    # Served from the fragment cache, loaded from the database on a miss
+    task = task_cache.get(db, task_id)
     if task is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Task with ID {task_id} not found",
         )
     
-    # Cache the result
-    redis_manager.set(redis_key, task, expire=300)
-    return task
+    response = task_response(task)
+    if if_none_match is not None and response.headers["ETag"] in {tag.strip() for tag in if_none_match.split(",")}:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": response.headers["ETag"]})
+    return response
 
 @app.post(
     "/tasks/",
     response_model=TaskResponse,
     status_code=status.HTTP_201_CREATED,
     summary="Create a new task",
+    dependencies=[task_write_limit],
 )
-async def create_task(task: TaskCreate, db: Session = Depends(get_db)):
+def create_task(task: TaskCreate, db: Session = Depends(get_db)):
     """
     Create a new task.
 
     Args:
         task: The task data to create
 
+    Raises:
+        HTTPException: If the room does not exist or is being deleted
+
     Returns:
         TaskResponse: The created task
     """
-    # Create new task
-    new_task = Task(
-        title=task.title,
-        description=task.description,
-        completed=task.completed,
-        due_date=task.due_date
-    )
-    
-    # Add to database
-    db.add(new_task)
-    db.commit()
-    db.refresh(new_task)
+    # Keep the room from being deleted until the task is committed
+    if task.room_id is not None:
+        room_status = Room.lock_for_new_task(db, task.room_id)
+        if room_status is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Room with ID {task.room_id} not found",
+            )
+        if room_status == 'deleting':
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Room with ID {task.room_id} is being deleted",
+            )
+
+    # Insert and read back the new row in one statement
+    row = Task.create(db, task.model_dump())
     
-    # Invalidate cache
-    redis_manager.delete("tasks")
-    
-    return new_task
+    # Write through to cache
+    return task_response(task_cache.add(row), status_code=status.HTTP_201_CREATED)
 
 @app.patch(
     "/tasks/{task_id}",
     response_model=TaskResponse,
     status_code=status.HTTP_200_OK,
     summary="Update a task",
+    dependencies=[task_write_limit],
 )
-async def update_task(
-    task_id: int, task_update: TaskUpdate, db: Session = Depends(get_db)
+def update_task(
+    task_id: int,
+    task_update: TaskUpdate,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
 ):
     """
     Update a specific task.
+    With If-Match, the update only applies if the task is still at that
+    version; concurrent editors get 412 instead of overwriting each other.
 
     Args:
         task_id: The ID of the task to update
         task_update: The update data
+        if_match: ETag of the version the changes are based on
 
     Raises:
-        HTTPException: If task is not found
+        HTTPException: If task is not found, was modified since If-Match, or
+            buffered edits could not be written first
 
     Returns:
         TaskResponse: The updated task
     """
-    # Get task from database
-    db_task = db.query(Task).filter(Task.id == task_id).first()
-    if db_task is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Task with ID {task_id} not found",
-        )
-
-    # Update only provided fields
     update_data = task_update.model_dump(exclude_unset=True)
-    for field, value in update_data.items():
-        setattr(db_task, field, value)
-
-    # Save changes
-    db.commit()
-    db.refresh(db_task)
+    expected_version = if_match_version(if_match, task_id)
+
+    if settings.TASK_WRITE_BEHIND:
+        # Apply to the cache now; the flusher writes coalesced changes to the database
+        try:
+            fragment = task_write_behind.update(db, task_id, update_data, expected_version)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Task write-behind failed, writing task {task_id} directly: {e}")
+        else:
+            if fragment is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Task with ID {task_id} not found",
+                )
+            return task_response(fragment)
+        # Buffered edits hold newer versions than the database
+        flush_task_writes()
+
+    # Conditional update that reads back the row in one statement
+    row = Task.update_fields(db, task_id, update_data, expected_version)
+    if row is None:
+        precondition_failed_or_not_found(db, task_id, expected_version)
     
-    # Invalidate cache
-    redis_manager.delete("tasks")
-    redis_manager.delete(f"task_{task_id}")
+    if settings.TASK_WRITE_BEHIND:
+        # Older buffered edits must not overwrite this write when flushed
+        task_write_behind.discard(task_id)
     
-    return db_task
+    # Write through to cache
+    return task_response(task_cache.refresh(row))
 
 @app.delete(
     "/tasks/{task_id}", 
     status_code=status.HTTP_204_NO_CONTENT, 
-    summary="Delete a task"
+    summary="Delete a task",
+    dependencies=[task_write_limit],
 )
-async def delete_task(task_id: int, db: Session = Depends(get_db)):
+def delete_task(
+    task_id: int,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
     """
     Delete a specific task.
 
     Args:
         task_id: The ID of the task to delete
+        if_match: ETag of the version the client expects to delete
 
     Raises:
-        HTTPException: If task is not found
+        HTTPException: If task is not found, was modified since If-Match, or
+            buffered edits could not be written first
     """
-    # Get task from database
-    task = db.query(Task).filter(Task.id == task_id).first()
-    if task is None:
+    expected_version = if_match_version(if_match, task_id)
+    if expected_version is not None and settings.TASK_WRITE_BEHIND:
+        # Buffered edits hold newer versions than the database
+        flush_task_writes()
+
+    # Delete in one statement; no affected row means no such task (at that version)
+    if not Task.delete_by_id(db, task_id, expected_version):
+        precondition_failed_or_not_found(db, task_id, expected_version)
+    
+    # Invalidate cache
+    task_cache.discard(task_id)
+    if settings.TASK_WRITE_BEHIND:
+        task_write_behind.discard(task_id)
+
+@app.get(
+    "/me/rooms",
+    response_model=List[RoomResponse],
+    status_code=status.HTTP_200_OK,
+    summary="List my rooms",
+)
+def get_my_rooms(
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    List the rooms the current user created or participates in.
+
+    Returns:
+        List[RoomResponse]: One page of rooms, newest first
+    """
+    return Room.list_for_user(db, current_user.id, limit=limit, offset=offset)
+
+def load_room_detail(db: Session, room_id: int, participants_limit: int, participants_offset: int) -> Optional[dict]:
+    """
+    Load a page of a room's detail from the database and cache it with a fresh soft expiry.
+
+    Returns:
+        The room detail, or None if the room does not exist
+    """
+    start = time.perf_counter()
+    room = Room.get_detail(db, room_id, participants_limit, participants_offset)
+    if room is not None:
+        # All pages of a room live in one hash so membership changes drop them together
+        redis_manager.set_field(
+            f"room:{room_id}",
+            f"detail:v2:{participants_limit}:{participants_offset}",
+            {"room": room, "freshness": room_cache_policy.freshness(time.perf_counter() - start).encode()},
+            expire=room_cache_policy.expire(),
+        )
+    return room
+
+def is_room_member(db: Session, room_id: int, user_id: int) -> bool:
+    """
+    Check whether a user participates in a room, caching the answer in the room's hash.
+    Participant changes delete the hash, so a cached answer never outlives them.
+    """
+    field = f"member:{user_id}"
+    member = redis_manager.get_field(f"room:{room_id}", field)
+    if member is None:
+        member = Room.is_member(db, room_id, user_id)
+        redis_manager.set_field(f"room:{room_id}", field, member, expire=room_cache_policy.expire())
+    return member
+
+def refresh_room_detail(room_id: int, participants_limit: int, participants_offset: int):
+    """Reload a stale room detail page in the background."""
+    db = SessionLocal()
+    try:
+        load_room_detail(db, room_id, participants_limit, participants_offset)
+    finally:
+        db.close()
+
+@app.get(
+    "/rooms/{room_id}",
+    response_model=RoomDetailResponse,
+    status_code=status.HTTP_200_OK,
+    summary="Get a room with its participants",
+)
+def get_room_detail(
+    room_id: int,
+    participants_limit: int = Query(50, ge=1, le=500),
+    participants_offset: int = Query(0, ge=0),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Retrieve a room and one page of its participants.
+
+    Args:
+        room_id: The ID of the room to retrieve
+        participants_limit: Maximum number of participants to return
+        participants_offset: Number of participants to skip
+
+    Raises:
+        HTTPException: If the room is not found or the user is not a member
+
+    Returns:
+        RoomDetailResponse: The room with a page of participants
+    """
+    cache_field = f"detail:v2:{participants_limit}:{participants_offset}"
+    cached = redis_manager.get_field(f"room:{room_id}", cache_field)
+
+    if cached is None:
+        room = load_room_detail(db, room_id, participants_limit, participants_offset)
+        if room is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Room with ID {room_id} not found",
+            )
+    else:
+        # Serve the cached page even if stale; one worker reloads it in the background
+        room = cached["room"]
+        if room_cache_policy.is_stale(Freshness.decode(cached["freshness"])):
+            room_cache_policy.revalidate(
+                f"room:{room_id}:{cache_field}:refresh",
+                lambda: refresh_room_detail(room_id, participants_limit, participants_offset),
+            )
+
+    if room["creator_id"] != current_user.id and not is_room_member(db, room_id, current_user.id):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are not a participant of this room",
+        )
+
+    return room
+
+def get_owned_room(room_id: int, current_user: User, db: Session) -> Room:
+    """
+    Load a room and check that the current user created it.
+
+    Raises:
+        HTTPException: If the room does not exist or belongs to someone else
+    """
+    room = db.query(Room).filter(Room.id == room_id).first()
+    if room is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Task with ID {task_id} not found",
+            detail=f"Room with ID {room_id} not found",
+        )
+    if room.creator_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only the room creator can manage participants",
+        )
+    return room
+
+@app.post(
+    "/rooms/{room_id}/participants",
+    response_model=RoomParticipantsResponse,
+    status_code=status.HTTP_200_OK,
+    summary="Add participants to a room",
+)
+def add_room_participants(
+    room_id: int,
+    request: RoomParticipantsRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Add many users to a room in a single statement.
+
+    Args:
+        room_id: The ID of the room
+        request: IDs of the users to add and their role
+
+    Returns:
+        RoomParticipantsResponse: Users actually added and the new participant count
+    """
+    get_owned_room(room_id, current_user, db)
+    try:
+        added, participant_count = Room.add_participants(db, room_id, request.user_ids, role=request.role)
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error(f"Failed to add participants to room {room_id}: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Failed to add participants",
         )
 
-    # Delete task
-    db.delete(task)
-    db.commit()
-    
     # Invalidate cache
-    redis_manager.delete("tasks")
-    redis_manager.delete(f"task_{task_id}")
+    redis_manager.delete(f"room:{room_id}")
+
+    return {"room_id": room_id, "user_ids": added, "participant_count": participant_count}
+
+@app.delete(
+    "/rooms/{room_id}/participants",
+    response_model=RoomParticipantsResponse,
+    status_code=status.HTTP_200_OK,
+    summary="Remove participants from a room",
+)
+def remove_room_participants(
+    room_id: int,
+    request: RoomParticipantsRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Remove many users from a room in a single statement.
+
+    Args:
+        room_id: The ID of the room
+        request: IDs of the users to remove
+
+    Returns:
+        RoomParticipantsResponse: Users actually removed and the new participant count
+    """
+    get_owned_room(room_id, current_user, db)
+    removed, participant_count = Room.remove_participants(db, room_id, request.user_ids)
+
+    # Invalidate cache
+    redis_manager.delete(f"room:{room_id}")
+
+    return {"room_id": room_id, "user_ids": removed, "participant_count": participant_count}
+
+@app.delete(
+    "/rooms/{room_id}",
+    response_model=RoomDeletionResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Delete a room in the background",
+)
+def delete_room(
+    room_id: int,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Mark a room as deleting and remove its tasks and participants in the background.
+
+    Args:
+        room_id: The ID of the room to delete
+
+    Raises:
+        HTTPException: If the room is not found or is already being deleted
+
+    Returns:
+        RoomDeletionResponse: Initial deletion progress
+    """
+    get_owned_room(room_id, current_user, db)
+    if not Room.mark_deleting(db, room_id):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Room with ID {room_id} is already being deleted",
+        )
+
+    progress = {"room_id": room_id, "status": "deleting", "tasks_deleted": 0, "participants_deleted": 0}
+    redis_manager.set(f"room:{room_id}:deletion", progress, expire=3600)
+    redis_manager.delete(f"room:{room_id}")
+    background_tasks.add_task(purge_room, room_id)
+
+    return progress
+
+@app.get(
+    "/rooms/{room_id}/deletion",
+    response_model=RoomDeletionResponse,
+    status_code=status.HTTP_200_OK,
+    summary="Get room deletion progress",
+)
+def get_room_deletion(room_id: int, current_user: User = Depends(get_current_user)):
+    """
+    Report the progress of a background room deletion.
+
+    Args:
+        room_id: The ID of the room being deleted
+
+    Raises:
+        HTTPException: If no deletion is known for the room
+
+    Returns:
+        RoomDeletionResponse: Current deletion progress
+    """
+    progress = redis_manager.get(f"room:{room_id}:deletion")
+    if progress is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No deletion in progress for room {room_id}",
+        )
+    return progress
 
 @app.get("/health", response_model=dict, status_code=status.HTTP_200_OK)
 async def health():
@@ -450,28 +1079,72 @@ async def health():
     """
     health_status = defaultdict(dict)
     
-    # Check database connection
+    # Check database connection through the existing pool, without waiting long
+    # for a connection: a busy node must still answer its health checks
     try:
-        from sqlalchemy import create_engine
-        engine = create_engine(setting.DATABASE_URL)
-        with engine.connect() as connection:
-            result = connection.execute(text("SELECT 1"))
-            result.fetchone()  # Actually execute the query
+        await run_in_threadpool(db_manager.ping, settings.HEALTH_DB_TIMEOUT)
         health_status["database"]["status"] = "Connected"
-    except SQLAlchemyError as e:
+    except (PoolTimeout, PoolExhausted):
+        health_status["database"]["status"] = "Busy"
+    except Exception as e:
         health_status["database"]["status"] = "Unhealthy"
         health_status["database"]["msg"] = f"Database connection error: {str(e)}"
 
     # Check Redis connection
     try:
-        redis_manager.ping()
+        await run_in_threadpool(redis_manager.ping)
         health_status["redis"]["status"] = "Connected"
     except Exception as e:
         health_status["redis"]["status"] = "Unhealthy"
         health_status["redis"]["msg"] = f"Redis connection error: {str(e)}"
+    health_status["redis"]["pools"] = redis_manager.pool_stats()
+    health_status["database"]["pool"] = db_manager.pool_stats()
+    health_status["breakers"] = breaker_states()
+    if admission is not None:
+        health_status["admission"] = admission.stats()
+    health_status["tracing"] = tracer.stats()
+    health_status["slow_queries"] = slow_query_log.stats()
 
     return health_status
 
+
+if settings.SLOW_QUERY_REPORT_ENABLED:
+    if not settings.OPERATOR_TOKEN:
+        logger.warning("SLOW_QUERY_REPORT_ENABLED without an OPERATOR_TOKEN; /debug/slow-queries refuses every caller")
+
+    @app.get(
+        "/debug/slow-queries",
+        response_model=dict,
+        status_code=status.HTTP_200_OK,
+        dependencies=[Depends(require_operator)],
+    )
+    async def slow_queries(
+        limit: int = Query(20, ge=1, le=500, description="Number of queries to report"),
+        order: str = Query("total", description="Sort by total, max, mean or count"),
+    ):
+        """
+        Report the slowest SQL statements seen by this worker, grouped by fingerprint.
+        Statements and plans reveal the schema and parameter shapes, so only
+        operators sending the OPERATOR_TOKEN may read it.
+
+        Args:
+            limit: Number of queries to report
+            order: Sort by total, max or mean time, or by count
+
+        Raises:
+            HTTPException: If the caller is not an operator, or the order is unknown
+
+        Returns:
+            dict: Threshold, totals and the top queries with their routes, the
+                slowest execution's redacted parameters and a captured plan
+        """
+        if order not in REPORT_ORDERS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"order must be one of {', '.join(REPORT_ORDERS)}",
+            )
+        return slow_query_log.report(limit, order)
+
 # @app.post("/rooms/", response_model=RoomResponse, status_code=status.HTTP_201_CREATED)
 # async def create_room(room: RoomCreate, db: Session = Depends(get_db)):
 #     """
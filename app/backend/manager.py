@@ -1,22 +1,37 @@
 from typing import Dict, Any, List, Optional, Union
 from redis import Redis
-from redis.sentinel import Sentinel
+from redis.exceptions import WatchError
 import json
 from datetime import datetime
 import logging
 import os
 import logging
+import socket
 import time
 from typing import Dict, Any, List, Optional, Tuple, Iterator
 import psycopg2
-from psycopg2.pool import ThreadedConnectionPool
 from psycopg2.extras import RealDictCursor
 from contextlib import contextmanager
+from fastapi import HTTPException, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+import inspect
+import math
+import secrets
+from typing import Callable, NamedTuple
+from config import settings
+from failover import BlockingSentinelConnectionPool, CachingSentinel, SentinelFailoverListener
+from breaker import create_breaker
+from database import database_breaker
+from dbpool import BlockingThreadedConnectionPool
+from deadline import DeadlineExceeded, current_scope
+from tracing import trace_methods, tracer
+from slow_queries import slow_query_log
 
 
 logger = logging.getLogger(__name__)
 
 
+@trace_methods("redis")
 class RedisManager:
     """
     Manages Redis connections using Sentinel for high availability.
@@ -32,6 +47,10 @@ class RedisManager:
         socket_timeout: float = 0.5,
         socket_connect_timeout: float = 1.0,
         retry_on_timeout: bool = True,
+        max_connections: int = 50,
+        pool_timeout: float = 5.0,
+        address_ttl: float = 60.0,
+        circuit_breaker: Optional[Dict[str, Any]] = None,
         *args, 
         **kwargs
     ):
@@ -46,6 +65,12 @@ class RedisManager:
             socket_timeout: Socket timeout for Redis operations
             socket_connect_timeout: Socket connection timeout
             retry_on_timeout: Whether to retry on timeout
+            max_connections: Size of the master and replica connection pools
+            pool_timeout: Seconds to wait for a free pooled connection before failing
+            address_ttl: Seconds discovered master and replica addresses are cached
+            circuit_breaker: Options of the circuit breakers guarding the master and
+                the replicas, or None for no breakers. While one is open, commands
+                fail at once and the cache is bypassed instead of timing out
             *args, **kwargs: Additional arguments passed to Sentinel
         """
         # Get configuration from environment variables with fallbacks
@@ -66,8 +91,9 @@ class RedisManager:
         
         for attempt in range(1, max_retries + 1):
             try:
-                sentinel = Sentinel(
+                sentinel = CachingSentinel(
                     [(host, sentinel_port) for host in sentinel_hosts], 
+                    address_ttl=address_ttl,
                     socket_timeout=socket_connect_timeout,
                     password=password,
                     decode_responses=True,
@@ -75,22 +101,36 @@ class RedisManager:
                     **kwargs
                 )
                 
+                # Bursts queue for a pooled connection instead of opening more sockets
                 self.master = sentinel.master_for(
                     service_name, 
+                    connection_pool_class=BlockingSentinelConnectionPool,
                     socket_timeout=socket_timeout,
+                    socket_connect_timeout=socket_connect_timeout,
                     password=password,
                     decode_responses=True,
-                    retry_on_timeout=retry_on_timeout
+                    retry_on_timeout=retry_on_timeout,
+                    max_connections=max_connections,
+                    timeout=pool_timeout,
+                    breaker=create_breaker("redis_master", circuit_breaker)
                 )
                 
                 self.slave = sentinel.slave_for(
                     service_name, 
+                    connection_pool_class=BlockingSentinelConnectionPool,
                     socket_timeout=socket_timeout,
+                    socket_connect_timeout=socket_connect_timeout,
                     password=password,
                     decode_responses=True,
-                    retry_on_timeout=retry_on_timeout
+                    retry_on_timeout=retry_on_timeout,
+                    max_connections=max_connections,
+                    timeout=pool_timeout,
+                    breaker=create_breaker("redis_replica", circuit_breaker)
                 )
                 
+                self.sentinel = sentinel
+                self.service_name = service_name
+                
                 # Test connection
                 self.ping()
                 logger.info(f"Successfully connected to Redis via Sentinel on attempt {attempt}")
@@ -183,6 +223,315 @@ class RedisManager:
             logger.error(f"Redis DELETE error for key {key}: {e}")
             return False
     
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """
+        Get several values in one round trip with MGET.
+        Tries slave first, falls back to master if needed.
+        
+        Args:
+            keys: Redis keys
+            
+        Returns:
+            dict: Key to deserialized value for the keys that exist, empty on error
+        """
+        if not keys:
+            return {}
+        for client in (self.slave, self.master):
+            try:
+                values = client.mget(keys)
+                break
+            except Exception as e:
+                logger.warning(f"Redis MGET error for {len(keys)} keys: {e}")
+        else:
+            return {}
+        
+        found = {}
+        for key, value in zip(keys, values):
+            if value is None:
+                continue
+            try:
+                found[key] = json.loads(value)
+            except json.JSONDecodeError:
+                found[key] = value
+        return found
+    
+    def set_many(self, mapping: Dict[str, Any], expire: Optional[int] = None) -> bool:
+        """
+        Set several key-value pairs in one round trip.
+        
+        Args:
+            mapping: Key to value (will be JSON serialized)
+            expire: Optional expiration time in seconds for every key
+            
+        Returns:
+            bool: Success status
+        """
+        if not mapping:
+            return True
+        try:
+            pipe = self.master.pipeline(transaction=False)
+            for key, value in mapping.items():
+                pipe.set(key, json.dumps(value), ex=expire)
+            pipe.execute()
+            return True
+        except Exception as e:
+            logger.error(f"Redis SET error for {len(mapping)} keys: {e}")
+            return False
+    
+    def delete_many(self, keys: List[str]) -> bool:
+        """
+        Delete several keys in one round trip.
+        
+        Args:
+            keys: Redis keys to delete
+            
+        Returns:
+            bool: Success status
+        """
+        if not keys:
+            return True
+        try:
+            self.master.delete(*keys)
+            return True
+        except Exception as e:
+            logger.error(f"Redis DELETE error for {len(keys)} keys: {e}")
+            return False
+    
+    def set_raw(self, key: str, value: Union[str, bytes], expire: Optional[int] = None) -> bool:
+        """
+        Set a pre-serialized value without JSON encoding it again.
+        
+        Args:
+            key: Redis key
+            value: Serialized value
+            expire: Optional expiration time in seconds
+            
+        Returns:
+            bool: Success status
+        """
+        try:
+            self.master.set(key, value, ex=expire)
+            return True
+        except Exception as e:
+            logger.error(f"Redis SET error for key {key}: {e}")
+            return False
+    
+    def get_raw(self, key: str) -> Optional[str]:
+        """
+        Get a value without JSON decoding it.
+        Tries slave first, falls back to master if needed.
+        
+        Args:
+            key: Redis key
+            
+        Returns:
+            The stored string or None if not found/error
+        """
+        for client in (self.slave, self.master):
+            try:
+                return client.get(key)
+            except Exception as e:
+                logger.warning(f"Redis GET error for key {key}: {e}")
+        return None
+    
+    def get_all_fields_raw(self, key: str) -> Dict[str, str]:
+        """
+        Get every field of a Redis hash without JSON decoding.
+        Tries slave first, falls back to master if needed.
+        
+        Args:
+            key: Redis hash key
+            
+        Returns:
+            dict: Field to stored string, empty if not found/error
+        """
+        for client in (self.slave, self.master):
+            try:
+                return client.hgetall(key)
+            except Exception as e:
+                logger.warning(f"Redis HGETALL error for key {key}: {e}")
+        return {}
+    
+    def get_fields_raw(self, key: str, fields: List[str]) -> Dict[str, str]:
+        """
+        Get several fields of a Redis hash with HMGET, without JSON decoding.
+        Tries slave first, falls back to master if needed.
+        
+        Args:
+            key: Redis hash key
+            fields: Hash fields
+            
+        Returns:
+            dict: Field to stored string for the fields that exist, empty on error
+        """
+        if not fields:
+            return {}
+        for client in (self.slave, self.master):
+            try:
+                values = client.hmget(key, fields)
+                return {field: value for field, value in zip(fields, values) if value is not None}
+            except Exception as e:
+                logger.warning(f"Redis HMGET error for key {key}: {e}")
+        return {}
+    
+    def get_field_raw(self, key: str, field: str) -> Optional[str]:
+        """
+        Get a field of a Redis hash without JSON decoding.
+        Tries slave first, falls back to master if needed.
+        
+        Args:
+            key: Redis hash key
+            field: Hash field
+            
+        Returns:
+            The stored string or None if not found/error
+        """
+        for client in (self.slave, self.master):
+            try:
+                return client.hget(key, field)
+            except Exception as e:
+                logger.warning(f"Redis HGET error for key {key}: {e}")
+        return None
+    
+    def set_fields_raw(self, key: str, mapping: Dict[str, Union[str, bytes]], expire: Optional[int] = None, replace: bool = False) -> bool:
+        """
+        Set pre-serialized fields of a Redis hash in one transaction.
+        
+        Args:
+            key: Redis hash key
+            mapping: Field to serialized value
+            expire: Optional expiration time in seconds for the whole hash
+            replace: Whether to drop existing fields first
+            
+        Returns:
+            bool: Success status
+        """
+        try:
+            pipe = self.master.pipeline(transaction=True)
+            if replace:
+                pipe.delete(key)
+            if mapping:
+                pipe.hset(key, mapping=mapping)
+            if expire:
+                pipe.expire(key, expire)
+            pipe.execute()
+            return True
+        except Exception as e:
+            logger.error(f"Redis HSET error for key {key}: {e}")
+            return False
+    
+    def replace_fields_raw(self, key: str, load: Callable[[], Dict[str, Union[str, bytes]]], expire: Optional[int] = None) -> Tuple[Dict[str, Union[str, bytes]], bool]:
+        """
+        Replace a Redis hash with pre-serialized fields computed by load(),
+        unless the hash is modified while load() runs: the computed fields may
+        then be older than what concurrent writers stored, so they are dropped.
+        
+        Args:
+            key: Redis hash key
+            load: Computes the new fields, e.g. from the database
+            expire: Optional expiration time in seconds for the whole hash
+            
+        Returns:
+            The loaded fields, and whether they were stored
+        """
+        pipe = self.master.pipeline(transaction=True)
+        try:
+            try:
+                pipe.watch(key)
+                watching = True
+            except Exception as e:
+                logger.error(f"Redis WATCH error for key {key}: {e}")
+                watching = False
+            
+            mapping = load()
+            if not watching:
+                return mapping, False
+            
+            try:
+                pipe.multi()
+                pipe.delete(key)
+                if mapping:
+                    pipe.hset(key, mapping=mapping)
+                if expire:
+                    pipe.expire(key, expire)
+                pipe.execute()
+                return mapping, True
+            except WatchError:
+                logger.info(f"Redis hash {key} changed while it was rebuilt; keeping it")
+                return mapping, False
+            except Exception as e:
+                logger.error(f"Redis HSET error for key {key}: {e}")
+                return mapping, False
+        finally:
+            pipe.reset()
+    
+    def delete_fields(self, key: str, *fields: str) -> bool:
+        """
+        Delete fields of a Redis hash.
+        
+        Args:
+            key: Redis hash key
+            *fields: Fields to delete
+            
+        Returns:
+            bool: Success status
+        """
+        try:
+            self.master.hdel(key, *fields)
+            return True
+        except Exception as e:
+            logger.error(f"Redis HDEL error for key {key}: {e}")
+            return False
+    
+    def get_field(self, key: str, field: str) -> Optional[Any]:
+        """
+        Get a field of a Redis hash.
+        Tries slave first, falls back to master if needed.
+        
+        Args:
+            key: Redis hash key
+            field: Hash field
+            
+        Returns:
+            The deserialized value or None if not found/error
+        """
+        for client in (self.slave, self.master):
+            try:
+                value = client.hget(key, field)
+                return json.loads(value) if value is not None else None
+            except json.JSONDecodeError:
+                return value
+            except Exception as e:
+                logger.warning(f"Redis HGET error for key {key}: {e}")
+        return None
+    
+    def set_field(self, key: str, field: str, value: Any, expire: Optional[int] = None) -> bool:
+        """
+        Set a field of a Redis hash. Deleting the hash invalidates every field at once.
+        The expiry is only set when the hash has none, i.e. when it is created,
+        so frequent writes cannot keep a hash alive past its hard TTL.
+        
+        Args:
+            key: Redis hash key
+            field: Hash field
+            value: Value to store (will be JSON serialized)
+            expire: Optional expiration time in seconds for a new hash
+            
+        Returns:
+            bool: Success status
+        """
+        try:
+            pipe = self.master.pipeline()
+            pipe.hset(key, field, json.dumps(value, default=str))
+            if expire:
+                # EXPIRE NX needs Redis 7
+                pipe.expire(key, expire, nx=True)
+            pipe.execute()
+            return True
+        except Exception as e:
+            logger.error(f"Redis HSET error for key {key}: {e}")
+            return False
+    
     def store_socket_session(self, sid: str, user_data: dict, expire: int = 3600) -> bool:
         """
         Store Socket.IO session data.
@@ -263,16 +612,243 @@ class RedisManager:
     def get_room_members(self, room_id: str) -> Dict[str, Any]:
         """
         Get all members in a room.
-        
+
         Args:
             room_id: Room identifier
-            
+
         Returns:
             dict: Room members data indexed by socket ID
         """
         key = f"room:members:{room_id}"
         return self.get(key) or {}
-    
+
+    def store_auth_token(self, token: str, user_id: int, expire: int = 900) -> bool:
+        """
+        Store a magic link token that expires on its own.
+
+        Args:
+            token: Magic link token
+            user_id: ID of the user the token belongs to
+            expire: Token lifetime in seconds
+
+        Returns:
+            bool: Success status
+        """
+        key = f"auth:token:{token}"
+        try:
+            # NX guards against overwriting a colliding token
+            return bool(self.master.set(key, user_id, ex=expire, nx=True))
+        except Exception as e:
+            logger.error(f"Redis auth token SET error: {e}")
+            return False
+
+    def consume_auth_token(self, token: str) -> Optional[int]:
+        """
+        Atomically read and delete a magic link token.
+        GETDEL guarantees that only one caller can ever consume a token.
+
+        Args:
+            token: Magic link token
+
+        Returns:
+            int: User ID if the token existed, None otherwise
+        """
+        key = f"auth:token:{token}"
+        try:
+            # Always on master: a replica could still hold an already consumed token
+            value = self.master.getdel(key)
+            return int(value) if value is not None else None
+        except Exception as e:
+            logger.error(f"Redis auth token GETDEL error: {e}")
+            return None
+
+    def stream_add(self, stream: str, fields: Dict[str, Any], maxlen: Optional[int] = None) -> Optional[str]:
+        """
+        Append an entry to a Redis Stream.
+
+        Args:
+            stream: Stream key
+            fields: Entry fields
+            maxlen: Optional approximate cap on the stream length
+
+        Returns:
+            str: ID of the new entry, or None on error
+        """
+        try:
+            return self.master.xadd(stream, fields, maxlen=maxlen, approximate=True)
+        except Exception as e:
+            logger.error(f"Redis XADD error for stream {stream}: {e}")
+            return None
+
+    def stream_ensure_group(self, stream: str, group: str) -> bool:
+        """
+        Create a consumer group (and the stream) if it does not exist yet.
+
+        Args:
+            stream: Stream key
+            group: Consumer group name
+
+        Returns:
+            bool: True if the group exists after the call
+        """
+        try:
+            self.master.xgroup_create(stream, group, id="0", mkstream=True)
+            return True
+        except Exception as e:
+            if "BUSYGROUP" in str(e):
+                return True
+            logger.error(f"Redis XGROUP CREATE error for stream {stream}: {e}")
+            return False
+
+    def stream_read_group(self, stream: str, group: str, consumer: str, count: int = 50) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Read new entries for a consumer without blocking.
+
+        Args:
+            stream: Stream key
+            group: Consumer group name
+            consumer: Consumer name
+            count: Maximum number of entries to read
+
+        Returns:
+            list: (entry_id, fields) tuples
+        """
+        try:
+            response = self.master.xreadgroup(group, consumer, {stream: ">"}, count=count)
+            return response[0][1] if response else []
+        except Exception as e:
+            logger.error(f"Redis XREADGROUP error for stream {stream}: {e}")
+            return []
+
+    def stream_claim_stale(self, stream: str, group: str, consumer: str, min_idle_ms: int, count: int = 50) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Take over entries that another consumer read but never acknowledged.
+
+        Args:
+            stream: Stream key
+            group: Consumer group name
+            consumer: Consumer name taking ownership
+            min_idle_ms: Minimum idle time before an entry can be claimed
+            count: Maximum number of entries to claim
+
+        Returns:
+            list: (entry_id, fields) tuples
+        """
+        try:
+            response = self.master.xautoclaim(stream, group, consumer, min_idle_ms, start_id="0-0", count=count)
+            # Deleted entries come back as None fields
+            return [(entry_id, fields) for entry_id, fields in response[1] if fields]
+        except Exception as e:
+            logger.error(f"Redis XAUTOCLAIM error for stream {stream}: {e}")
+            return []
+
+    def stream_ack(self, stream: str, group: str, entry_ids: List[str]) -> int:
+        """
+        Acknowledge and remove processed stream entries.
+
+        Args:
+            stream: Stream key
+            group: Consumer group name
+            entry_ids: IDs of the processed entries
+
+        Returns:
+            int: Number of acknowledged entries
+        """
+        if not entry_ids:
+            return 0
+        try:
+            pipe = self.master.pipeline()
+            pipe.xack(stream, group, *entry_ids)
+            pipe.xdel(stream, *entry_ids)
+            acked, _ = pipe.execute()
+            return acked
+        except Exception as e:
+            logger.error(f"Redis XACK error for stream {stream}: {e}")
+            return 0
+
+    def schedule(self, key: str, member: str, due: float) -> bool:
+        """
+        Add a member to a sorted set scored by the time it becomes due.
+
+        Args:
+            key: Sorted set key
+            member: Member to schedule
+            due: Unix timestamp at which the member becomes due
+
+        Returns:
+            bool: Success status
+        """
+        try:
+            self.master.zadd(key, {member: due})
+            return True
+        except Exception as e:
+            logger.error(f"Redis ZADD error for key {key}: {e}")
+            return False
+
+    def pop_due(self, key: str, now: float, count: int = 50) -> List[str]:
+        """
+        Remove and return members of a sorted set that are due.
+        ZREM decides ownership, so concurrent callers never get the same member.
+
+        Args:
+            key: Sorted set key
+            now: Current Unix timestamp
+            count: Maximum number of members to return
+
+        Returns:
+            list: Members that were due and are now owned by the caller
+        """
+        try:
+            members = self.master.zrangebyscore(key, "-inf", now, start=0, num=count)
+            return [member for member in members if self.master.zrem(key, member)]
+        except Exception as e:
+            logger.error(f"Redis schedule pop error for key {key}: {e}")
+            return []
+
+    def acquire_lock(self, key: str, ttl: int) -> Optional[str]:
+        """
+        Take a lock that expires after ttl seconds unless it is extended.
+
+        Args:
+            key: Lock key
+            ttl: Seconds until the lock frees itself
+
+        Returns:
+            A token proving ownership, or None if the lock is held or Redis failed
+        """
+        token = secrets.token_hex(16)
+        try:
+            return token if self.master.set(key, token, nx=True, ex=ttl) else None
+        except Exception as e:
+            logger.error(f"Redis lock error for key {key}: {e}")
+            return None
+
+    def extend_lock(self, key: str, token: str, ttl: int) -> bool:
+        """
+        Reset a lock's expiry, if it is still ours.
+
+        Returns:
+            bool: Whether the lock is still held with this token
+        """
+        try:
+            return bool(self.master.eval(EXTEND_LOCK_SCRIPT, 1, key, token, ttl))
+        except Exception as e:
+            logger.error(f"Redis lock extend error for key {key}: {e}")
+            return False
+
+    def release_lock(self, key: str, token: str) -> bool:
+        """
+        Release a lock, unless it expired and another holder took it meanwhile.
+
+        Returns:
+            bool: Whether the lock was still ours and is now released
+        """
+        try:
+            return bool(self.master.eval(RELEASE_LOCK_SCRIPT, 1, key, token))
+        except Exception as e:
+            logger.error(f"Redis lock release error for key {key}: {e}")
+            return False
+
     def ping(self) -> bool:
         """
         Check if Redis server is responding.
@@ -293,6 +869,290 @@ class RedisManager:
                 logger.error(f"Redis ping failed: {e}")
                 raise Exception(f"Redis ping failed: {str(e)}")
 
+    def watch_failovers(self) -> SentinelFailoverListener:
+        """
+        Start following Sentinel events so failovers reset the connection pools
+        immediately. Called in each worker process, since threads do not survive a fork.
+        
+        Returns:
+            SentinelFailoverListener: The running listener, to stop on shutdown
+        """
+        listener = SentinelFailoverListener(
+            self.sentinel,
+            self.service_name,
+            self.master.connection_pool,
+            self.slave.connection_pool,
+        )
+        listener.start()
+        return listener
+
+    def pool_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Usage statistics of the master and replica connection pools of this worker.
+        
+        Returns:
+            dict: Pool role to its statistics
+        """
+        stats = {}
+        for role, client in (("master", self.master), ("replica", self.slave)):
+            pool = client.connection_pool
+            if isinstance(pool, BlockingSentinelConnectionPool):
+                stats[role] = pool.stats()
+        return stats
+
+    def disconnect(self):
+        """
+        Close the sockets of both connection pools.
+        Called in the server's master process before forking workers; the pools
+        reconnect lazily on next use.
+        """
+        for client in (self.master, self.slave):
+            try:
+                client.connection_pool.disconnect()
+            except Exception as e:
+                logger.warning(f"Redis disconnect error: {e}")
+
+# Compare-and-delete / compare-and-expire for locks holding a random token
+# KEYS: lock key
+# ARGV: token[, ttl (s)]
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+EXTEND_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Sliding window counter: weights the previous fixed window by how much of it
+# still overlaps the sliding window, so memory per key is two integers.
+# The window keys are derived from Redis TIME in the script, so workers with
+# skewed clocks still count into the same buckets; safe without Cluster.
+# KEYS: base key; the window keys are "<base>:<window index>"
+# ARGV: window (ms), limit, cost
+SLIDING_WINDOW_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local window = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+
+local index = math.floor(now / window)
+local current_key = KEYS[1] .. ':' .. index
+local elapsed = now % window
+local current = tonumber(redis.call('GET', current_key) or '0')
+local previous = tonumber(redis.call('GET', KEYS[1] .. ':' .. (index - 1)) or '0')
+local estimated = previous * ((window - elapsed) / window) + current
+local reset = window - elapsed
+
+if estimated + cost > limit then
+    return {0, math.max(0, math.floor(limit - estimated)), reset, reset}
+end
+
+redis.call('INCRBY', current_key, cost)
+redis.call('PEXPIRE', current_key, window * 2)
+return {1, math.floor(limit - estimated - cost), reset, 0}
+"""
+
+# Token bucket: refills continuously at capacity / window and allows bursts up to capacity.
+# KEYS: bucket key
+# ARGV: window (ms), capacity, cost
+TOKEN_BUCKET_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local window = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local rate = capacity / window
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local allowed = 0
+local retry = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry = math.ceil((cost - tokens) / rate)
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], window)
+return {allowed, math.floor(tokens), math.ceil((capacity - tokens) / rate), retry}
+"""
+
+
+class RateLimitResult(NamedTuple):
+    """Outcome of a rate limit check."""
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_ms: int
+    retry_after_ms: int
+
+
+def client_ip(request: Request) -> str:
+    """
+    Rate limit key: the client IP as seen by the nginx proxy in front of the backend.
+    nginx overwrites X-Real-IP with the peer address, whereas X-Forwarded-For
+    keeps whatever the client sent, so it could be forged to dodge the limits.
+    """
+    if settings.TRUST_PROXY_HEADERS:
+        real_ip = request.headers.get("x-real-ip", "").strip()
+        if real_ip:
+            return real_ip
+    return request.client.host if request.client else "unknown"
+
+
+async def request_email(request: Request) -> str:
+    """Rate limit key: the email field of a JSON request body."""
+    try:
+        body = await request.json()
+        return str(body.get("email", "")).strip().lower() or client_ip(request)
+    except Exception:
+        return client_ip(request)
+
+
+def global_key(request: Request) -> str:
+    """Rate limit key shared by every caller of a route."""
+    return "all"
+
+
+class RateLimiter:
+    """
+    Redis-backed rate limiting with sliding window and token bucket algorithms.
+    Both algorithms run as Lua scripts so each check is a single atomic round trip;
+    scripts are registered once and invoked with EVALSHA.
+    """
+
+    ALGORITHMS = ("sliding_window", "token_bucket")
+
+    def __init__(self, redis_manager: RedisManager, enabled: bool = True, overrides: Optional[str] = None):
+        """
+        Initialize the rate limiter.
+
+        Args:
+            redis_manager: Redis manager whose master holds the counters
+            enabled: Whether limits are enforced at all
+            overrides: Comma separated "name=limit/window_seconds" rules that
+                replace the limits declared in code, e.g. "login_ip=50/60"
+        """
+        self.redis_manager = redis_manager
+        self.enabled = enabled
+        self.overrides = self._parse_overrides(overrides or "")
+        self._scripts = {
+            "sliding_window": redis_manager.master.register_script(SLIDING_WINDOW_SCRIPT),
+            "token_bucket": redis_manager.master.register_script(TOKEN_BUCKET_SCRIPT),
+        }
+
+    @staticmethod
+    def _parse_overrides(overrides: str) -> Dict[str, Tuple[int, int]]:
+        rules = {}
+        for rule in overrides.split(","):
+            if not rule.strip():
+                continue
+            try:
+                name, spec = rule.split("=")
+                limit, window = spec.split("/")
+                rules[name.strip()] = (int(limit), int(window))
+            except ValueError:
+                logger.warning(f"Ignoring malformed rate limit override: {rule}")
+        return rules
+
+    @tracer.traced("redis.rate_limit", "client")
+    def hit(self, name: str, key: str, limit: int, window: int, algorithm: str = "sliding_window", cost: int = 1) -> RateLimitResult:
+        """
+        Record a hit against a rate limit and report whether it is allowed.
+        Fails open if Redis is unavailable.
+
+        Args:
+            name: Rule name, e.g. "login_ip"
+            key: Identity being limited (IP, email, user ID...)
+            limit: Maximum hits per window (bucket capacity for token_bucket)
+            window: Window length in seconds
+            algorithm: "sliding_window" or "token_bucket"
+            cost: Number of hits this request counts as
+
+        Returns:
+            RateLimitResult describing the decision
+        """
+        limit, window = self.overrides.get(name, (limit, window))
+        window_ms = window * 1000
+        base_key = f"ratelimit:{name}:{key}"
+
+        try:
+            allowed, remaining, reset_ms, retry_ms = self._scripts[algorithm](keys=[base_key], args=[window_ms, limit, cost])
+            return RateLimitResult(bool(allowed), limit, int(remaining), int(reset_ms), int(retry_ms))
+        except Exception as e:
+            logger.warning(f"Rate limit check {name} failed, allowing request: {e}")
+            return RateLimitResult(True, limit, limit, window_ms, 0)
+
+    def limit(
+        self,
+        name: str,
+        limit: int,
+        window: int,
+        key_func: Callable[[Request], Any] = client_ip,
+        algorithm: str = "sliding_window",
+        cost: int = 1,
+    ) -> Callable:
+        """
+        Build a FastAPI dependency that enforces a rate limit.
+
+        Args:
+            name: Rule name, also used for overrides
+            limit: Maximum hits per window (bucket capacity for token_bucket)
+            window: Window length in seconds
+            key_func: Callable (sync or async) deriving the identity from the request
+            algorithm: "sliding_window" or "token_bucket"
+            cost: Number of hits each request counts as
+
+        Returns:
+            Dependency that sets RateLimit-* headers and raises 429 when exceeded
+        """
+        if algorithm not in self.ALGORITHMS:
+            raise ValueError(f"Unknown rate limit algorithm: {algorithm}")
+
+        async def dependency(request: Request, response: Response):
+            if not self.enabled:
+                return
+
+            key = key_func(request)
+            if inspect.isawaitable(key):
+                key = await key
+
+            result = await run_in_threadpool(self.hit, name, key, limit, window, algorithm, cost)
+            headers = {
+                "RateLimit-Limit": str(result.limit),
+                "RateLimit-Remaining": str(result.remaining),
+                "RateLimit-Reset": str(math.ceil(result.reset_ms / 1000)),
+            }
+
+            if not result.allowed:
+                headers["Retry-After"] = str(max(1, math.ceil(result.retry_after_ms / 1000)))
+                logger.warning(f"Rate limit {name} exceeded for {key}")
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Too many requests",
+                    headers=headers,
+                )
+
+            # When several limits apply, report the one closest to being exhausted
+            current = response.headers.get("RateLimit-Remaining")
+            if current is None or result.remaining < int(current):
+                response.headers.update(headers)
+
+        return dependency
+
+
 class DatabaseManager:
     """
     Manages database connections with master-replica setup via pgpool.
@@ -316,9 +1176,12 @@ class DatabaseManager:
         # Optional replica configuration
         self.replica_hosts = [host.strip() for host in os.environ.get('DB_REPLICA_HOSTS', '').split(',') if host.strip()]
         
-        # Connection pool settings
-        self.min_conn = int(os.environ.get('DB_MIN_CONNECTIONS', '1'))
-        self.max_conn = int(os.environ.get('DB_MAX_CONNECTIONS', '10'))
+        # Fail fast instead of queueing on the pool while the database is unavailable
+        self.breaker = database_breaker
+        
+        # Connection pool settings; this worker's share of the DB_MAX_CONNECTIONS budget
+        self.max_conn = settings.DB_MANAGER_CONNECTIONS
+        self.min_conn = min(int(os.environ.get('DB_MIN_CONNECTIONS', '1')), self.max_conn)
         
         # Retry settings
         self.max_retries = int(os.environ.get('DB_CONNECT_RETRIES', '30'))
@@ -395,11 +1258,14 @@ class DatabaseManager:
                     # Try without application_name as fallback
                     self.master_pool = self._create_connection_pool(self.db_host)
                 
-                # Test the connection with a simple query
-                with self.master_pool.getconn() as conn:
+                # Test the connection with a simple query; `with conn` only ends
+                # the transaction, so the connection is returned explicitly
+                conn = self.master_pool.getconn()
+                try:
                     with conn.cursor() as cursor:
                         cursor.execute("SELECT 1")
                         cursor.fetchone()
+                finally:
                     self.master_pool.putconn(conn)
                 
                 logger.info(f"Successfully connected to database at {self.db_host}")
@@ -425,16 +1291,18 @@ class DatabaseManager:
         
         logger.info(f"Database manager initialized with connection to pgpool at {self.db_host}")
     
-    def _create_connection_pool(self, host: str, **extra_params) -> ThreadedConnectionPool:
+    def _create_connection_pool(self, host: str, **extra_params) -> BlockingThreadedConnectionPool:
         """
         Create a connection pool for a specific database host.
+        Callers wait up to DB_POOL_TIMEOUT seconds for a connection when all
+        are in use, instead of failing at once.
         
         Args:
             host: Database host address
             **extra_params: Additional connection parameters
             
         Returns:
-            ThreadedConnectionPool: Connection pool for the specified host
+            BlockingThreadedConnectionPool: Connection pool for the specified host
         """
         try:
             # Connection parameters optimized for pgpool
@@ -453,13 +1321,18 @@ class DatabaseManager:
                 "keepalives_idle": 30,
                 "keepalives_interval": 10,
                 "keepalives_count": 5,
+                "timeout": settings.DB_POOL_TIMEOUT,
+                "max_waiting": settings.DB_POOL_MAX_WAITING,
+                "max_lifetime": settings.DB_POOL_MAX_LIFETIME,
+                "max_idle": settings.DB_POOL_MAX_IDLE,
+                "leak_threshold": settings.DB_POOL_LEAK_SECONDS,
             }
             
             # Add any extra parameters
             conn_params.update(extra_params)
             
             # Create the connection pool
-            pool = ThreadedConnectionPool(**conn_params)
+            pool = BlockingThreadedConnectionPool(**conn_params)
             logger.info(f"Created connection pool for {host}")
             return pool
         except Exception as e:
@@ -478,13 +1351,27 @@ class DatabaseManager:
             
         Yields:
             Tuple[connection, is_master]: Database connection and whether it's from the master
+            
+        Raises:
+            CircuitOpenError: If the database circuit breaker is open
+            PoolTimeout: If no connection was released within DB_POOL_TIMEOUT seconds
+            PoolExhausted: If DB_POOL_MAX_WAITING callers are already waiting
+            DeadlineExceeded: If the request's deadline passed or its client went away
         """
         conn = None
         is_master = True
         
+        probe = self.breaker.check() if self.breaker is not None else 0
+        # Wait for a pooled connection no longer than the request has left
+        scope = current_scope.get()
+        timeout = None
+        if scope is not None and scope.deadline is not None:
+            timeout = min(self.master_pool.timeout, scope.check())
+        start = time.perf_counter()
+        
         try:
             # Get connection from the pool
-            conn = self.master_pool.getconn()
+            conn = self.master_pool.getconn(timeout=timeout)
             
             # For read-only operations, set the session to use replicas via pgpool
             if read_only:
@@ -495,14 +1382,37 @@ class DatabaseManager:
                     # cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
                 is_master = False
             
+            # Bound the transaction's statements by the request's deadline, and
+            # let the request cancel them if its client goes away
+            if scope is not None:
+                timeout_ms = scope.statement_timeout_ms()
+                if timeout_ms is not None:
+                    with conn.cursor() as cursor:
+                        cursor.execute("SET LOCAL statement_timeout = %s", (timeout_ms,))
+                scope.attach(conn)
+            
             yield (conn, is_master)
             
+        except DeadlineExceeded:
+            raise
+        
         except Exception as e:
+            if scope is not None and scope.caused(e):
+                raise scope.exceeded() from e
             logger.error(f"Error while using database connection: {e}")
+            # Only unavailability counts; constraint violations and bad SQL are the caller's
+            if self.breaker is not None and isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+                self.breaker.record(False, time.perf_counter() - start, probe)
             raise
+        
+        else:
+            if self.breaker is not None:
+                self.breaker.record(True, time.perf_counter() - start, probe)
             
         finally:
             if conn is not None:
+                if scope is not None:
+                    scope.detach(conn)
                 try:
                     # Reset any session variables before returning to pool
                     if read_only:
@@ -552,11 +1462,13 @@ class DatabaseManager:
         Returns:
             List of dictionaries representing the query results
         """
-        with self.get_cursor(read_only) as (cursor, _):
-            cursor.execute(query, params or {})
-            if cursor.description:  # If the query returns rows
-                return cursor.fetchall()
-            return []
+        with tracer.span("db_manager.execute_query", "client", {"db.system": "postgresql", "db.statement": query}):
+            with self.get_cursor(read_only) as (cursor, _):
+                with slow_query_log.measure(query, params):
+                    cursor.execute(query, params or {})
+                if cursor.description:  # If the query returns rows
+                    return cursor.fetchall()
+                return []
     
     def execute_write(self, query: str, params: Optional[Dict[str, Any]] = None) -> int:
         """
@@ -569,9 +1481,11 @@ class DatabaseManager:
         Returns:
             Number of affected rows
         """
-        with self.get_cursor(read_only=False) as (cursor, _):
-            cursor.execute(query, params or {})
-            return cursor.rowcount
+        with tracer.span("db_manager.execute_write", "client", {"db.system": "postgresql", "db.statement": query}):
+            with self.get_cursor(read_only=False) as (cursor, _):
+                with slow_query_log.measure(query, params):
+                    cursor.execute(query, params or {})
+                return cursor.rowcount
     
     def health_check(self) -> Dict[str, bool]:
         """
@@ -601,6 +1515,85 @@ class DatabaseManager:
             logger.error(f"Database health check failed: {e}")
             
         return health
+    
+    def ping(self, timeout: Optional[float] = None):
+        """
+        Run a trivial query, waiting at most `timeout` seconds for a pooled connection.
+        
+        Args:
+            timeout: Seconds to wait for a connection instead of DB_POOL_TIMEOUT
+            
+        Raises:
+            CircuitOpenError: If the database circuit breaker is open
+            PoolTimeout: If every connection stayed in use
+            psycopg2.Error: If the query failed
+        """
+        probe = self.breaker.check() if self.breaker is not None else 0
+        conn = self.master_pool.getconn(timeout=timeout)
+        start = time.perf_counter()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+            conn.rollback()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # The ping may be the half-open probe, which must report back
+            if self.breaker is not None:
+                self.breaker.record(False, time.perf_counter() - start, probe)
+            raise
+        else:
+            if self.breaker is not None:
+                self.breaker.record(True, time.perf_counter() - start, probe)
+        finally:
+            self.master_pool.putconn(conn)
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        """
+        Usage of the connection pool, including a histogram of checkout waits.
+        
+        Returns:
+            Pool statistics, or an empty dict without a pool
+        """
+        if self.master_pool is None:
+            return {}
+        return self.master_pool.stats()
+    
+    def close(self):
+        """
+        Close every pooled connection.
+        Called in the server's master process after the app is preloaded, so
+        forked workers never share the master's sockets.
+        """
+        if self.master_pool is not None and not self.master_pool.closed:
+            self.master_pool.closeall()
+            logger.info("Closed database connection pool")
+    
+    def reopen(self):
+        """
+        Replace the connection pool with a fresh one, e.g. in a forked worker.
+        """
+        self.close()
+        self.master_pool = self._create_connection_pool(self.db_host, application_name="backend_master")
 
-# Singleton instance
+# Singleton instances
 db_manager = DatabaseManager()
+
+redis_manager = RedisManager(
+    sentinel_hosts=settings.REDIS_SENTINEL_HOSTS.split(","),
+    sentinel_port=settings.REDIS_SENTINEL_PORT,
+    service_name=settings.REDIS_SERVICE_NAME,
+    password=settings.REDIS_PASSWORD,
+    socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+    retry_on_timeout=settings.REDIS_RETRY_ON_TIMEOUT,
+    max_connections=settings.REDIS_WORKER_CONNECTIONS,
+    pool_timeout=settings.REDIS_CONNECTION_POOL_TIMEOUT,
+    address_ttl=settings.REDIS_SENTINEL_ADDRESS_TTL,
+    circuit_breaker=settings.circuit_breaker_options(settings.REDIS_SLOW_CALL_SECONDS),
+)
+
+rate_limiter = RateLimiter(
+    redis_manager,
+    enabled=settings.RATE_LIMIT_ENABLED,
+    overrides=settings.RATE_LIMITS,
+)
@@ -32,6 +32,7 @@ class TaskResponse(TaskModel):
     user_id: Optional[int] = None
     created_at: Union[str, datetime]
     updated_at: Union[str, datetime]
+    version: int = 1
 
     @field_validator('created_at', 'updated_at', mode='before')
     def parse_datetime(cls, value):
@@ -54,6 +55,19 @@ class RoomInviteRequest(BaseModel):
     email: EmailStr
 
 
+class RoomParticipantsRequest(BaseModel):
+    """Model for adding or removing many participants at once."""
+    user_ids: List[int]
+    role: str = "member"
+
+
+class RoomParticipantsResponse(BaseModel):
+    """Model for the result of a bulk membership change."""
+    room_id: int
+    user_ids: List[int]
+    participant_count: int
+
+
 class RoomCreate(BaseModel):
     """Model for creating a new room."""
     name: str
@@ -64,14 +78,23 @@ class RoomResponse(BaseModel):
     """Model for room response data including database fields."""
     id: int
     name: str
-    invite_code: str
-    creator_email: str
+    description: Optional[str] = None
+    invite_code: Optional[str] = None
+    creator_email: Optional[str] = None
     participant_count: int
     created_at: datetime
 
     model_config = {"from_attributes": True}
 
 
+class RoomDeletionResponse(BaseModel):
+    """Model for the progress of a background room deletion."""
+    room_id: int
+    status: str
+    tasks_deleted: int = 0
+    participants_deleted: int = 0
+
+
 class RoomDetailResponse(RoomResponse):
     """Model for detailed room response including participants."""
     participants: List["UserResponse"] = []
@@ -116,3 +139,7 @@ class SessionResponse(BaseModel):
     access_token: str
     token_type: str = "bearer"
     user: CurrentUserResponse
+
+
+# Resolve the forward reference to UserResponse
+RoomDetailResponse.model_rebuild()
@@ -0,0 +1,151 @@
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, NamedTuple, Optional, Set
+import logging
+import math
+import random
+import threading
+import time
+
+from config import settings
+from manager import RedisManager
+
+logger = logging.getLogger(__name__)
+
+# Shared by every cache of a worker so background refreshes cannot take more
+# than CACHE_REFRESH_WORKERS database connections at once
+refresh_executor = ThreadPoolExecutor(
+    max_workers=settings.CACHE_REFRESH_WORKERS, thread_name_prefix="cache-refresh"
+)
+
+
+class Freshness(NamedTuple):
+    """Soft expiry of a cache entry, stored next to it."""
+    fresh_until: float  # Unix time after which the entry is stale
+    delta: float  # Seconds the entry took to compute
+
+    def encode(self) -> str:
+        return f"{self.fresh_until:.3f}:{self.delta:.4f}"
+
+    @classmethod
+    def decode(cls, value: Optional[str]) -> "Freshness":
+        """Parse an encoded freshness; anything unreadable counts as stale."""
+        try:
+            fresh_until, delta = value.split(":")
+            return cls(float(fresh_until), float(delta))
+        except (AttributeError, ValueError):
+            return cls(0.0, 0.0)
+
+
+class StaleWhileRevalidate:
+    """
+    Expiry policy for Redis-backed caches that keeps serving an entry while
+    a single background refresh recomputes it.
+    Every entry has a soft expiry, stored with it, after which reads trigger a
+    refresh, and a hard expiry, the Redis TTL, after which it is gone and the
+    next read recomputes it inline. Both are jittered so entries written
+    together do not expire together. Reads may also refresh an entry before
+    its soft expiry, with a probability that grows as the expiry nears and
+    with the time the entry took to compute (XFetch), so hot entries are
+    usually refreshed before any reader sees them stale.
+    """
+
+    def __init__(
+        self,
+        redis_manager: RedisManager,
+        soft_ttl: int,
+        hard_ttl: int,
+        beta: float = 1.0,
+        jitter: float = 0.1,
+        lock_ttl: int = 30,
+        executor: Executor = refresh_executor,
+    ):
+        """
+        Args:
+            redis_manager: Redis manager holding the refresh locks
+            soft_ttl: Seconds an entry is served without being refreshed
+            hard_ttl: Seconds an entry lives; stale entries are served until then
+            beta: Eagerness of early refreshes; 0 refreshes only after soft_ttl
+            jitter: Fraction by which both TTLs are randomly spread
+            lock_ttl: Seconds a refresh may run before another may start
+            executor: Runs the background refreshes
+        """
+        self.redis_manager = redis_manager
+        self.soft_ttl = soft_ttl
+        self.hard_ttl = max(hard_ttl, soft_ttl)
+        self.beta = beta
+        self.jitter = jitter
+        self.lock_ttl = lock_ttl
+        self.executor = executor
+        # Refreshes running in this process, so a hot key does not even ask Redis for the lock
+        self.running: Set[str] = set()
+        self.running_lock = threading.Lock()
+
+    def jittered(self, ttl: float) -> float:
+        return ttl * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def expire(self) -> int:
+        """Jittered hard TTL in seconds, for the Redis key holding the entry."""
+        return max(1, round(self.jittered(self.hard_ttl)))
+
+    def freshness(self, delta: float) -> Freshness:
+        """
+        Soft expiry of an entry computed just now.
+
+        Args:
+            delta: Seconds the entry took to compute
+        """
+        return Freshness(time.time() + self.jittered(self.soft_ttl), delta)
+
+    def is_stale(self, freshness: Freshness) -> bool:
+        """
+        Decide whether a read should refresh the entry, using XFetch:
+        now - delta * beta * ln(rand) >= fresh_until.
+        """
+        # 1 - random() lies in (0, 1], so the logarithm is defined
+        early = -freshness.delta * self.beta * math.log(1.0 - random.random())
+        return time.time() + early >= freshness.fresh_until
+
+    def revalidate(self, lock_key: str, refresh: Callable[[], Any]) -> bool:
+        """
+        Start a background refresh unless one is already running in any worker.
+
+        Args:
+            lock_key: Redis key identifying the entry's refresh
+            refresh: Recomputes and stores the entry
+
+        Returns:
+            bool: Whether a refresh was started
+        """
+        with self.running_lock:
+            if lock_key in self.running:
+                return False
+            self.running.add(lock_key)
+
+        lock = self.redis_manager.acquire_lock(lock_key, self.lock_ttl)
+        if lock is None:
+            self.release(lock_key, None)
+            return False
+
+        try:
+            self.executor.submit(self.run, lock_key, lock, refresh)
+        except RuntimeError as e:
+            # The executor is shutting down; the stale entry stays until its hard expiry
+            logger.warning(f"Cache refresh for key {lock_key} not started: {e}")
+            self.release(lock_key, lock)
+            return False
+        return True
+
+    def run(self, lock_key: str, lock: str, refresh: Callable[[], Any]):
+        try:
+            refresh()
+        except Exception as e:
+            logger.error(f"Background cache refresh failed for key {lock_key}: {e}")
+        finally:
+            self.release(lock_key, lock)
+
+    def release(self, lock_key: str, lock: Optional[str]):
+        with self.running_lock:
+            self.running.discard(lock_key)
+        # A refresh that outlived lock_ttl leaves the lock of whoever took it over alone
+        if lock is not None:
+            self.redis_manager.release_lock(lock_key, lock)
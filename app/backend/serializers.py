@@ -0,0 +1,60 @@
+from typing import Any, Iterable, List, Sequence, Union
+from fastapi.responses import Response
+import orjson
+
+# Field order of TaskResponse; rows passed to the helpers below must follow it
+TASK_FIELDS = (
+    "id",
+    "title",
+    "description",
+    "completed",
+    "due_date",
+    "room_id",
+    "user_id",
+    "created_at",
+    "updated_at",
+    "version",
+)
+
+
+def task_rows_to_dicts(rows: Iterable[Sequence[Any]]) -> List[dict]:
+    """
+    Turn plain row tuples into task dictionaries without model validation.
+    The rows come straight from typed columns, so they already match TaskResponse.
+
+    Args:
+        rows: Rows whose values are ordered like TASK_FIELDS
+
+    Returns:
+        List of task dictionaries
+    """
+    return [dict(zip(TASK_FIELDS, row)) for row in rows]
+
+
+def render_json(content: Any) -> bytes:
+    """
+    Serialize content to JSON bytes with orjson.
+    Datetimes are rendered in ISO 8601 format, matching TaskResponse.
+
+    Args:
+        content: JSON-compatible content
+
+    Returns:
+        JSON bytes
+    """
+    return orjson.dumps(content)
+
+
+class FastJSONResponse(Response):
+    """
+    JSON response rendered with orjson that also accepts pre-rendered JSON.
+    Returning it from an endpoint bypasses FastAPI's response_model serialization.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Union[bytes, str, Any]) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        if isinstance(content, str):
+            return content.encode("utf-8")
+        return render_json(content)
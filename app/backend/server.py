@@ -0,0 +1,123 @@
+from dotenv import load_dotenv
+from gunicorn.app.base import BaseApplication
+from uvicorn_worker import UvicornWorker
+import logging
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+def default_workers() -> int:
+    """One worker per CPU this process may run on (respects container CPU sets)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+WORKERS = int(os.getenv("WEB_CONCURRENCY") or 0) or default_workers()
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "20"))
+BIND = os.getenv("SERVER_BIND", "0.0.0.0:8000")
+GRACEFUL_TIMEOUT = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30"))  # seconds to drain on reload/stop
+WORKER_TIMEOUT = int(os.getenv("SERVER_WORKER_TIMEOUT", "60"))  # seconds before a hung worker is killed
+KEEPALIVE = int(os.getenv("SERVER_KEEPALIVE", "5"))  # seconds
+MAX_REQUESTS = int(os.getenv("SERVER_MAX_REQUESTS", "0"))  # recycle workers after N requests, 0 disables
+
+# Every worker needs at least one engine and one psycopg2 connection
+if WORKERS * 2 > DB_MAX_CONNECTIONS:
+    logger.warning(f"DB_MAX_CONNECTIONS={DB_MAX_CONNECTIONS} cannot serve {WORKERS} workers; starting {max(1, DB_MAX_CONNECTIONS // 2)}")
+    WORKERS = max(1, DB_MAX_CONNECTIONS // 2)
+
+# Workers size their connection pools from WEB_CONCURRENCY (see Setting.worker_share),
+# so it has to be exported before the app, and with it config.py, is imported
+os.environ["WEB_CONCURRENCY"] = str(WORKERS)
+
+
+class UvloopWorker(UvicornWorker):
+    """Uvicorn worker pinned to uvloop and httptools instead of auto-detection."""
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools"}
+
+
+def when_ready(server):
+    """
+    Runs in the master after the app is preloaded and before workers are forked.
+    Connections opened while importing the app are closed so that no worker
+    inherits a socket shared with its siblings.
+    """
+    from database import engine
+    from manager import db_manager, redis_manager
+
+    engine.dispose()
+    db_manager.close()
+    redis_manager.disconnect()
+    server.log.info(f"App preloaded; forking {WORKERS} workers")
+
+
+def post_fork(server, worker):
+    """
+    Runs in each worker right after it is forked.
+    The SQLAlchemy engine and the Redis pools reconnect lazily; the psycopg2
+    pool is recreated within this worker's share of DB_MAX_CONNECTIONS.
+    """
+    from manager import db_manager
+
+    db_manager.reopen()
+
+
+def nworkers_changed(server, new_value, old_value):
+    """
+    Runs in the master whenever the worker count changes, e.g. on SIGTTIN.
+    Every worker sized its connection pools for WORKERS workers sharing
+    DB_MAX_CONNECTIONS, so more workers than that would exhaust pgpool.
+    """
+    if new_value > WORKERS:
+        server.log.warning(f"Keeping {WORKERS} workers; more would exceed DB_MAX_CONNECTIONS={DB_MAX_CONNECTIONS}")
+        server.num_workers = WORKERS
+
+
+class Server(BaseApplication):
+    """
+    Production entry point: a gunicorn master that imports the app once and
+    forks uvicorn workers from it, so the loaded code is shared copy-on-write.
+
+    Signals are handled by the master:
+        SIGHUP: fork a fresh set of workers and gracefully stop the old ones.
+            The preloaded code is kept; deploy new code with a restart.
+        SIGTERM: graceful shutdown, draining requests for SERVER_GRACEFUL_TIMEOUT.
+        SIGTTIN / SIGTTOU: add / remove a worker. Workers removed with SIGTTOU
+            can be added back, but never more than were started, since the
+            connection budget was split between that many.
+    """
+
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from main import app
+
+        return app
+
+
+if __name__ == "__main__":
+    Server({
+        "bind": BIND,
+        "workers": WORKERS,
+        "worker_class": UvloopWorker,
+        "preload_app": True,
+        "graceful_timeout": GRACEFUL_TIMEOUT,
+        "timeout": WORKER_TIMEOUT,
+        "keepalive": KEEPALIVE,
+        "max_requests": MAX_REQUESTS,
+        "max_requests_jitter": MAX_REQUESTS // 10,
+        "accesslog": "-",
+        "when_ready": when_ready,
+        "post_fork": post_fork,
+        "nworkers_changed": nworkers_changed,
+    }).run()
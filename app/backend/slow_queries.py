@@ -0,0 +1,360 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Set
+import functools
+import logging
+import psycopg2
+import random
+import re
+import threading
+import time
+
+from config import settings
+from deadline import current_scope
+
+logger = logging.getLogger(__name__)
+
+COMMENT = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+LITERAL = re.compile(r"'(?:[^']|'')*'|%\(\w+\)s|%s|\$\d+|\b\d+(?:\.\d+)?\b")
+LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)|\[\s*\?(?:\s*,\s*\?)+\s*\]")
+ROWS = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+WHITESPACE = re.compile(r"\s+")
+EXPLAINABLE = re.compile(r"\s*(SELECT|WITH)\b", re.IGNORECASE)
+
+# Orders the report may be sorted by
+REPORT_ORDERS = ("total", "max", "mean", "count")
+
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(statement: str) -> str:
+    """
+    Normalize a statement so every execution of the same query shares one entry.
+    Comments are removed, literals and placeholders become "?", lists of them
+    "(...)" and whitespace is collapsed.
+
+    Args:
+        statement: SQL as sent to the database
+
+    Returns:
+        The statement's fingerprint, e.g. "SELECT * FROM tasks WHERE room_id = ? AND id IN (...)"
+    """
+    normalized = LITERAL.sub("?", COMMENT.sub(" ", statement))
+    normalized = ROWS.sub("(...)", LIST.sub(lambda match: match.group(0)[0] + "..." + match.group(0)[-1], normalized))
+    return WHITESPACE.sub(" ", normalized).strip()
+
+
+def redact_value(value: Any) -> Any:
+    # NULLs and flags change plans but give nothing away; sizes of lists do too
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, (str, bytes, list, tuple, set, dict)):
+        return f"<{type(value).__name__}:{len(value)}>"
+    return f"<{type(value).__name__}>"
+
+
+def redact(parameters: Any, executemany: bool = False) -> Any:
+    """
+    Replace parameter values by their type, so the report holds no user data.
+
+    Args:
+        parameters: Parameters of a statement, a mapping or a sequence
+        executemany: Whether parameters holds one set per row
+
+    Returns:
+        The parameters' shape, e.g. {"room_id": "<int>", "title": "<str:12>"}
+    """
+    if executemany and isinstance(parameters, (list, tuple)):
+        return {"rows": len(parameters), "first": redact(parameters[0]) if parameters else None}
+    if isinstance(parameters, dict):
+        return {key: redact_value(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact_value(value) for value in parameters]
+    return redact_value(parameters)
+
+
+class SlowQuery:
+    """Executions of one query fingerprint that took longer than the threshold."""
+
+    def __init__(self, fingerprint: str, first_seen: float):
+        self.fingerprint = fingerprint
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.first_seen = first_seen
+        self.last_seen = first_seen
+        self.routes: Dict[str, int] = {}
+        self.sample: Optional[Dict[str, Any]] = None  # the slowest execution
+        self.plan: Optional[Dict[str, Any]] = None
+        self.explained_at = 0.0  # time.monotonic() of the last EXPLAIN attempt
+
+    @property
+    def mean_ms(self) -> float:
+        return self.total_ms / self.count if self.count else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "fingerprint": self.fingerprint,
+            "count": self.count,
+            "errors": self.errors,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.mean_ms, 3),
+            "max_ms": round(self.max_ms, 3),
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+            "routes": dict(sorted(self.routes.items(), key=lambda item: -item[1])),
+            "slowest": self.sample,
+            "plan": self.plan,
+        }
+
+
+class SlowQueryLog:
+    """
+    In-memory log of statements slower than a threshold, grouped by fingerprint.
+    Each entry keeps counts and timings, the routes that ran the query and the
+    slowest execution with redacted parameters. A sampled share of slow
+    SELECTs is run again with EXPLAIN (ANALYZE, BUFFERS) in a read-only
+    transaction on a separate connection, normally to a replica, on one
+    background thread, so the report shows where an index is missing.
+    Entries are kept per worker process.
+    """
+
+    def __init__(
+        self,
+        threshold_ms: float = 200.0,
+        max_entries: int = 500,
+        explain_sample_rate: float = 0.0,
+        explain_connect: Optional[Callable[[], Any]] = None,
+        explain_timeout: float = 5.0,
+        explain_interval: float = 300.0,
+        explain_queue_size: int = 8,
+    ):
+        """
+        Args:
+            threshold_ms: Statements taking at least this long are recorded, 0 to turn the log off
+            max_entries: Fingerprints kept; the one with the least total time makes room for a new one
+            explain_sample_rate: Share of slow SELECTs explained, 0 to never run EXPLAIN
+            explain_connect: Opens the DBAPI connection EXPLAIN runs on
+            explain_timeout: Seconds an EXPLAIN ANALYZE may run
+            explain_interval: Seconds before the same fingerprint is explained again
+            explain_queue_size: EXPLAINs waiting at once; further ones are skipped
+        """
+        self.threshold = threshold_ms / 1000
+        self.enabled = threshold_ms > 0
+        self.max_entries = max_entries
+        self.explain_sample_rate = explain_sample_rate if explain_connect is not None else 0.0
+        self.explain_connect = explain_connect
+        self.explain_timeout = explain_timeout
+        self.explain_interval = explain_interval
+        self.explain_queue_size = explain_queue_size
+
+        self.lock = threading.Lock()
+        self.entries: Dict[str, SlowQuery] = {}
+        self.since = time.time()
+        self.recorded = 0
+        self.evicted = 0
+        self.explained = 0
+        self.explain_failures = 0
+        self.pending: Set[str] = set()  # fingerprints waiting for EXPLAIN
+        # One thread, so EXPLAIN ANALYZE never adds more than one query of load
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query-explain")
+        self.connection = None  # used by the executor's thread only
+
+    def record(
+        self,
+        statement: str,
+        parameters: Any,
+        duration: float,
+        executemany: bool = False,
+        error: Optional[BaseException] = None,
+    ):
+        """
+        Record a statement if it was slow.
+
+        Args:
+            statement: SQL as sent to the database
+            parameters: Parameters the statement ran with; only their shape is kept
+            duration: Seconds the statement took
+            executemany: Whether parameters holds one set per row
+            error: The error the statement failed with, if any
+        """
+        if not self.enabled or duration < self.threshold:
+            return
+        key = fingerprint(statement)
+        scope = current_scope.get()
+        route = scope.route if scope is not None and scope.route else "background"
+        duration_ms = duration * 1000
+        now = time.time()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                if len(self.entries) >= self.max_entries:
+                    evicted = min(self.entries.values(), key=lambda candidate: candidate.total_ms)
+                    del self.entries[evicted.fingerprint]
+                    self.evicted += 1
+                entry = self.entries[key] = SlowQuery(key, now)
+                first = True
+            else:
+                first = False
+            entry.count += 1
+            entry.total_ms += duration_ms
+            entry.last_seen = now
+            entry.routes[route] = entry.routes.get(route, 0) + 1
+            if error is not None:
+                entry.errors += 1
+            if duration_ms >= entry.max_ms:
+                entry.max_ms = duration_ms
+                entry.sample = {
+                    "duration_ms": round(duration_ms, 3),
+                    "route": route,
+                    "at": now,
+                    "parameters": redact(parameters, executemany),
+                    "error": type(error).__name__ if error is not None else None,
+                }
+            self.recorded += 1
+            explain = self.should_explain(entry, statement, executemany)
+
+        if first:
+            logger.warning(f"Slow query ({duration_ms:.0f}ms, {route}): {key}")
+        if explain:
+            self.executor.submit(self.explain, entry, statement, parameters)
+
+    def should_explain(self, entry: SlowQuery, statement: str, executemany: bool) -> bool:
+        """Whether to queue an EXPLAIN for an entry; called with the lock held."""
+        if not self.explain_sample_rate or executemany or not EXPLAINABLE.match(statement):
+            return False
+        if entry.fingerprint in self.pending or len(self.pending) >= self.explain_queue_size:
+            return False
+        now = time.monotonic()
+        if entry.explained_at and now - entry.explained_at < self.explain_interval:
+            return False
+        if random.random() >= self.explain_sample_rate:
+            return False
+        entry.explained_at = now
+        self.pending.add(entry.fingerprint)
+        return True
+
+    @contextmanager
+    def measure(self, statement: str, parameters: Any = None) -> Iterator[None]:
+        """Time the statement run in the block and record it if it was slow."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.record(statement, parameters, time.perf_counter() - start, error=e)
+            raise
+        self.record(statement, parameters, time.perf_counter() - start)
+
+    def explain(self, entry: SlowQuery, statement: str, parameters: Any):
+        """Run EXPLAIN (ANALYZE, BUFFERS) for a slow statement; runs on the executor's thread."""
+        try:
+            if self.connection is None or self.connection.closed:
+                self.connection = self.explain_connect()
+            try:
+                with self.connection.cursor() as cursor:
+                    # ANALYZE executes the statement; a read-only transaction keeps it from writing
+                    cursor.execute("SET TRANSACTION READ ONLY")
+                    cursor.execute("SET LOCAL statement_timeout = %s", (int(self.explain_timeout * 1000),))
+                    cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement, parameters)
+                    plan = cursor.fetchone()[0]
+            finally:
+                self.connection.rollback()
+            plan = plan[0] if isinstance(plan, list) else plan
+            with self.lock:
+                entry.plan = {
+                    "captured_at": time.time(),
+                    "execution_ms": plan.get("Execution Time"),
+                    "planning_ms": plan.get("Planning Time"),
+                    "plan": plan.get("Plan"),
+                }
+                self.explained += 1
+        except Exception as e:
+            with self.lock:
+                self.explain_failures += 1
+            logger.warning(f"Could not EXPLAIN slow query {entry.fingerprint}: {e}")
+            if isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)) and self.connection is not None:
+                try:
+                    self.connection.close()
+                except Exception:
+                    pass
+                self.connection = None
+        finally:
+            with self.lock:
+                self.pending.discard(entry.fingerprint)
+
+    def report(self, limit: int = 20, order: str = "total") -> Dict[str, Any]:
+        """
+        The slowest queries seen by this worker.
+
+        Args:
+            limit: Entries returned
+            order: "total", "max", "mean" or "count"
+
+        Returns:
+            The threshold, totals, and the top entries by the chosen order
+        """
+        key = {
+            "total": lambda entry: entry.total_ms,
+            "max": lambda entry: entry.max_ms,
+            "mean": lambda entry: entry.mean_ms,
+            "count": lambda entry: entry.count,
+        }[order]
+        with self.lock:
+            top = sorted(self.entries.values(), key=key, reverse=True)[:limit]
+            queries = [entry.to_dict() for entry in top]
+            stats = self.stats_locked()
+        return {**stats, "order": order, "queries": queries}
+
+    def stats(self) -> Dict[str, Any]:
+        """Counts of recorded and explained slow queries, for monitoring."""
+        with self.lock:
+            return self.stats_locked()
+
+    def stats_locked(self) -> Dict[str, Any]:
+        return {
+            "threshold_ms": round(self.threshold * 1000, 3),
+            "since": self.since,
+            "recorded": self.recorded,
+            "fingerprints": len(self.entries),
+            "evicted": self.evicted,
+            "explained": self.explained,
+            "explain_failures": self.explain_failures,
+            "explain_pending": len(self.pending),
+        }
+
+    def reset(self):
+        """Forget every entry, e.g. after adding an index."""
+        with self.lock:
+            self.entries.clear()
+            self.since = time.time()
+            self.recorded = 0
+            self.evicted = 0
+
+
+def create_slow_query_log() -> SlowQueryLog:
+    """Build the slow query log configured by the SLOW_QUERY_* settings."""
+    explain_connect = None
+    if settings.SLOW_QUERY_EXPLAIN_SAMPLE_RATE > 0:
+        explain_connect = functools.partial(
+            psycopg2.connect,
+            host=settings.SLOW_QUERY_EXPLAIN_HOST,
+            port=settings.DB_PORT,
+            user=settings.DB_USER,
+            password=settings.DB_PASSWORD,
+            dbname=settings.DB_NAME,
+            application_name="backend_explain",
+            connect_timeout=5,
+        )
+    return SlowQueryLog(
+        threshold_ms=settings.SLOW_QUERY_THRESHOLD_MS,
+        max_entries=settings.SLOW_QUERY_MAX_ENTRIES,
+        explain_sample_rate=settings.SLOW_QUERY_EXPLAIN_SAMPLE_RATE,
+        explain_connect=explain_connect,
+        explain_timeout=settings.SLOW_QUERY_EXPLAIN_TIMEOUT,
+        explain_interval=settings.SLOW_QUERY_EXPLAIN_INTERVAL,
+    )
+
+
+# Singleton instance
+slow_query_log = create_slow_query_log()
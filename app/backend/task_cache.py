@@ -0,0 +1,423 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+import logging
+import time
+
+from bloom import RedisBloomFilter
+from config import settings
+from database import SessionLocal, Task
+from manager import RedisManager, redis_manager
+from revalidate import Freshness, StaleWhileRevalidate
+from serializers import TASK_FIELDS, render_json
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Look a task up on the master after a replica miss, answering from Redis
+# whether it is known not to exist: absent from a complete fragment hash,
+# recently found missing, or rejected by the Bloom filter of existing IDs.
+# KEYS: fragments hash, missing marker[, bloom filter]
+# ARGV: task ID, complete marker field, bloom bit offsets...
+# Returns the fragment, 0 if the task does not exist, or 1 if unknown
+LOOKUP_SCRIPT = """
+local fragment = redis.call('HGET', KEYS[1], ARGV[1])
+if fragment then
+    return fragment
+end
+if redis.call('HEXISTS', KEYS[1], ARGV[2]) == 1 then
+    return 0
+end
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return 0
+end
+if #KEYS > 2 and redis.call('EXISTS', KEYS[3]) == 1 then
+    for i = 3, #ARGV do
+        if redis.call('GETBIT', KEYS[3], ARGV[i]) == 0 then
+            return 0
+        end
+    end
+end
+return 1
+"""
+
+# Store fragments unless the cached one is at least as new, so a row read
+# before a concurrent write never replaces the fragment that write stored.
+# Reads may also skip tasks with buffered edits, whose fragment is the newest.
+# KEYS: fragments hash[, dirty set]
+# ARGV: fragments TTL, then task ID, version and fragment of every task
+# Returns the number of fragments stored
+STORE_SCRIPT = """
+local stored = 0
+for i = 2, #ARGV, 3 do
+    local skip = #KEYS > 1 and redis.call('ZSCORE', KEYS[2], ARGV[i])
+    if not skip then
+        local current = redis.call('HGET', KEYS[1], ARGV[i])
+        skip = current and cjson.decode(current)['version'] >= tonumber(ARGV[i + 1])
+    end
+    if not skip then
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 2])
+        stored = stored + 1
+    end
+end
+if stored > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return stored
+"""
+
+VERSION_INDEX = TASK_FIELDS.index("version")
+
+
+class TaskFragmentCache:
+    """
+    Cache of pre-rendered task JSON, one hash field per task.
+    List responses are assembled by joining the fragments, so serving a cached
+    list never decodes or re-encodes individual tasks. Fragments are refreshed
+    whenever a task is written; a marker field records that the hash holds
+    every task, so a partially filled hash is never served as the full list.
+    The marker also holds the list's soft expiry: a stale list is still served
+    while one worker rebuilds it in the background.
+    Lookups of tasks that do not exist are answered from Redis too, so stale
+    clients and scanners probing deleted IDs do not reach the database.
+    """
+
+    # Bump the suffix whenever TASK_FIELDS changes so stale fragments are never served
+    KEY = "tasks:fragments:v2"
+    COMPLETE_MARKER = "_complete"
+    MISSING_PREFIX = "tasks:missing:"
+
+    def __init__(self, redis_manager: RedisManager, policy: StaleWhileRevalidate, missing_expire: int = 30, bloom: Optional[RedisBloomFilter] = None):
+        """
+        Args:
+            redis_manager: Redis manager holding the fragments
+            policy: Soft and hard expiry of the list; the hard TTL is how long
+                the fragment hash lives without writes
+            missing_expire: Seconds a task ID found missing is remembered
+            bloom: Optional filter of existing task IDs
+        """
+        self.redis_manager = redis_manager
+        self.policy = policy
+        self.expire = policy.hard_ttl
+        self.missing_expire = missing_expire
+        self.bloom = bloom
+        self.lookup = redis_manager.master.register_script(LOOKUP_SCRIPT)
+        self.store_fragments = redis_manager.master.register_script(STORE_SCRIPT)
+        # Run before tasks are read from the database, e.g. to flush buffered writes
+        self.before_load: List[Callable[[], Any]] = []
+        # Sorted set of tasks with buffered edits, which reads must not overwrite
+        self.dirty_key: Optional[str] = None
+
+    @staticmethod
+    def render_row(row: Sequence[Any]) -> bytes:
+        """Render a row ordered like TASK_FIELDS as a JSON object."""
+        return render_json(dict(zip(TASK_FIELDS, row)))
+
+    @staticmethod
+    def join(fragments: Iterable[str]) -> str:
+        """Assemble fragments into a JSON array without parsing them."""
+        return "[" + ",".join(fragments) + "]"
+
+    def get_list(self, db: Session) -> str:
+        """
+        Get the JSON array of all tasks, rebuilding the fragments on a miss.
+        A stale list is served as-is and rebuilt in the background.
+
+        Args:
+            db: Database session
+
+        Returns:
+            JSON array of tasks ordered by ID
+        """
+        fragments = self.redis_manager.get_all_fields_raw(self.KEY)
+        marker = fragments.pop(self.COMPLETE_MARKER, None)
+        if marker is None:
+            return self.rebuild(db)
+
+        if self.policy.is_stale(Freshness.decode(marker)):
+            self.policy.revalidate(f"{self.KEY}:refresh", self.revalidate)
+        return self.join(fragments[task_id] for task_id in sorted(fragments, key=int))
+
+    def load(self, db: Session) -> Dict[str, str]:
+        """
+        Render every task from the database.
+
+        Args:
+            db: Database session
+
+        Returns:
+            Fragments by task ID in ID order, plus the complete marker holding
+            the list's soft expiry
+        """
+        start = time.perf_counter()
+        self.load_hooks()
+        rows = db.execute(select(*Task.response_columns()).order_by(Task.id)).all()
+        mapping = {str(row[0]): self.render_row(row).decode("utf-8") for row in rows}
+        mapping[self.COMPLETE_MARKER] = self.policy.freshness(time.perf_counter() - start).encode()
+        return mapping
+
+    def rebuild(self, db: Session) -> str:
+        """
+        Render every task from the database and replace the cached fragments.
+        Like revalidate, the write is dropped if a task is written meanwhile;
+        the caller is still answered with the list it loaded.
+
+        Args:
+            db: Database session
+
+        Returns:
+            JSON array of tasks ordered by ID
+        """
+        mapping, _ = self.redis_manager.replace_fields_raw(self.KEY, lambda: self.load(db), expire=self.policy.expire())
+
+        del mapping[self.COMPLETE_MARKER]
+        return self.join(mapping.values())
+
+    def revalidate(self):
+        """
+        Rebuild a stale list in the background.
+        The cached list stays complete through write-through, so the rebuild
+        is dropped if a task is written meanwhile rather than overwrite the
+        newer fragment with the row it read before.
+        """
+        db = SessionLocal()
+        try:
+            self.redis_manager.replace_fields_raw(self.KEY, lambda: self.load(db), expire=self.policy.expire())
+        finally:
+            db.close()
+
+    def missing_key(self, task_id: int) -> str:
+        return f"{self.MISSING_PREFIX}{task_id}"
+
+    def lookup_master(self, task_id: int) -> Union[str, int]:
+        """
+        Look a task up on the master, which never lags behind a fresh write.
+
+        Args:
+            task_id: The ID of the task
+
+        Returns:
+            The fragment, 0 if the task is known not to exist, or 1 if unknown
+        """
+        return self.lookup_master_many([task_id])[task_id]
+
+    @tracer.traced("redis.task_lookup", "client")
+    def lookup_master_many(self, task_ids: List[int]) -> Dict[int, Union[str, int]]:
+        """
+        Look several tasks up on the master in one round trip.
+
+        Args:
+            task_ids: IDs of the tasks
+
+        Returns:
+            For every ID the fragment, 0 if the task is known not to exist, or 1 if unknown
+        """
+        try:
+            pipe = self.redis_manager.master.pipeline(transaction=False)
+            for task_id in task_ids:
+                keys = [self.KEY, self.missing_key(task_id)]
+                args = [task_id, self.COMPLETE_MARKER]
+                if self.bloom is not None:
+                    keys.append(self.bloom.key)
+                    args += self.bloom.offsets(task_id)
+                self.lookup(keys=keys, args=args, client=pipe)
+            return dict(zip(task_ids, pipe.execute()))
+        except Exception as e:
+            logger.warning(f"Task cache lookup error for tasks {task_ids[:10]}: {e}")
+            return {task_id: 1 for task_id in task_ids}
+
+    def get(self, db: Session, task_id: int) -> Optional[str]:
+        """
+        Get the JSON of a single task, loading it on a miss.
+        Replica misses are confirmed on the master, which also knows whether
+        the task does not exist; only unknown IDs are queried, and IDs found
+        missing are remembered for missing_expire seconds.
+
+        Args:
+            db: Database session
+            task_id: The ID of the task
+
+        Returns:
+            JSON object of the task, or None if it does not exist
+        """
+        fragment = self.redis_manager.get_field_raw(self.KEY, str(task_id))
+        if fragment is not None:
+            return fragment
+
+        found = self.lookup_master(task_id)
+        if isinstance(found, str):
+            return found
+        if found == 0:
+            return None
+
+        self.load_hooks()
+        row = db.execute(select(*Task.response_columns()).where(Task.id == task_id)).first()
+        if row is None:
+            self.redis_manager.set_raw(self.missing_key(task_id), "1", expire=self.missing_expire)
+            return None
+
+        fragments, _ = self.store([row], read=True)
+        return fragments[str(task_id)]
+
+    def get_many(self, db: Session, task_ids: List[int]) -> List[str]:
+        """
+        Get the JSON of several tasks: one HMGET for the cached fragments and
+        one query for the rest. Like get(), replica misses are confirmed on
+        the master in one round trip, so neither replica lag nor IDs known not
+        to exist reach the database. IDs found missing now are remembered for
+        missing_expire seconds.
+
+        Args:
+            db: Database session
+            task_ids: IDs of the tasks, duplicates allowed
+
+        Returns:
+            JSON objects of the tasks that exist, in the order requested
+        """
+        task_ids = list(dict.fromkeys(task_ids))
+        fragments = self.redis_manager.get_fields_raw(self.KEY, [str(task_id) for task_id in task_ids])
+        misses = [task_id for task_id in task_ids if str(task_id) not in fragments]
+
+        if misses:
+            found = self.lookup_master_many(misses)
+            unknown = []
+            for task_id in misses:
+                if isinstance(found[task_id], str):
+                    fragments[str(task_id)] = found[task_id]
+                elif found[task_id] == 1:
+                    unknown.append(task_id)
+            misses = unknown
+
+        if misses:
+            self.load_hooks()
+            loaded, _ = self.store(Task.get_many(db, misses), read=True)
+            self.redis_manager.set_many(
+                {self.missing_key(task_id): 1 for task_id in misses if str(task_id) not in loaded},
+                expire=self.missing_expire,
+            )
+            fragments.update(loaded)
+
+        return [fragments[str(task_id)] for task_id in task_ids if str(task_id) in fragments]
+
+    def load_hooks(self):
+        """Run the before_load hooks; a failing hook must not fail the read."""
+        for hook in self.before_load:
+            try:
+                hook()
+            except Exception as e:
+                logger.error(f"Task cache load hook failed: {e}")
+
+    @tracer.traced("redis.task_store", "client")
+    def store(self, rows: Iterable[Sequence[Any]], read: bool = False) -> Tuple[Dict[str, str], bool]:
+        """
+        Render rows and cache their fragments, keeping any cached fragment of
+        the same or a newer version: writes that commit in one order may
+        store their fragments in the other, and a read may load a row just
+        before a concurrent write replaces it.
+
+        Args:
+            rows: Rows ordered like TASK_FIELDS
+            read: Whether the rows were read rather than written; tasks with
+                buffered edits are then skipped
+
+        Returns:
+            Fragments by task ID, and whether Redis was reached
+        """
+        fragments = {}
+        args: List[Any] = [self.expire]
+        for row in rows:
+            fragment = self.render_row(row).decode("utf-8")
+            fragments[str(row[0])] = fragment
+            args += [row[0], row[VERSION_INDEX], fragment]
+        if not fragments:
+            return fragments, True
+
+        keys = [self.KEY]
+        if read and self.dirty_key is not None:
+            keys.append(self.dirty_key)
+        try:
+            self.store_fragments(keys=keys, args=args)
+            return fragments, True
+        except Exception as e:
+            logger.error(f"Task cache store error for tasks {list(fragments)[:10]}: {e}")
+            return fragments, False
+
+    def refresh(self, row: Sequence[Any]) -> str:
+        """
+        Write through the fragment of a task that was just created or updated.
+        A newer fragment stored by a concurrent write is kept.
+
+        Args:
+            row: The row returned by the write, ordered like TASK_FIELDS
+
+        Returns:
+            JSON object of the task
+        """
+        fragments, stored = self.store([row])
+        if not stored:
+            # A stale fragment is worse than none; drop the whole list if the write failed
+            self.invalidate()
+        return fragments[str(row[0])]
+
+    def add(self, row: Sequence[Any]) -> str:
+        """
+        Write through the fragment of a newly created task and forget that
+        its ID was ever missing.
+
+        Args:
+            row: The row returned by the insert, ordered like TASK_FIELDS
+
+        Returns:
+            JSON object of the task
+        """
+        fragment = self.refresh(row)
+        self.redis_manager.delete(self.missing_key(row[0]))
+        if self.bloom is not None:
+            self.bloom.add(row[0])
+        return fragment
+
+    def discard(self, task_id: int) -> bool:
+        """
+        Remove the fragment of a deleted task.
+
+        Args:
+            task_id: The ID of the deleted task
+
+        Returns:
+            bool: Success status
+        """
+        if self.redis_manager.delete_fields(self.KEY, str(task_id)):
+            return True
+        return self.invalidate()
+
+    def invalidate(self) -> bool:
+        """
+        Drop every fragment, e.g. after tasks were deleted in bulk.
+
+        Returns:
+            bool: Success status
+        """
+        return self.redis_manager.delete(self.KEY)
+
+
+# Singleton instances
+task_bloom = RedisBloomFilter(
+    redis_manager,
+    "tasks:bloom",
+    capacity=settings.TASK_BLOOM_CAPACITY,
+    error_rate=settings.TASK_BLOOM_ERROR_RATE,
+) if settings.TASK_BLOOM_FILTER else None
+
+task_cache = TaskFragmentCache(
+    redis_manager,
+    StaleWhileRevalidate(
+        redis_manager,
+        soft_ttl=settings.TASK_CACHE_SOFT_TTL,
+        hard_ttl=settings.TASK_CACHE_TTL,
+        beta=settings.CACHE_XFETCH_BETA,
+        jitter=settings.CACHE_TTL_JITTER,
+        lock_ttl=settings.CACHE_REFRESH_LOCK_TTL,
+    ),
+    missing_expire=settings.TASK_MISSING_TTL,
+    bloom=task_bloom,
+)
@@ -0,0 +1,95 @@
+import asyncio
+import threading
+import time
+from unittest import mock
+
+from fastapi import FastAPI
+
+from admission import AdaptiveLimit, AdmissionController, AdmissionMiddleware
+from deadline import DeadlineMiddleware
+
+
+def http_scope(path="/slow"):
+    return {"type": "http", "method": "GET", "path": path, "query_string": b"", "headers": []}
+
+
+async def hang(scope, receive, send):
+    await asyncio.sleep(10)
+
+
+async def never_disconnect():
+    await asyncio.sleep(10)
+
+
+def make_middleware(app, **options):
+    limit = AdaptiveLimit(**options.pop("limit", {}))
+    controller = AdmissionController(limit, [], **options)
+    return AdmissionMiddleware(app, controller), controller
+
+
+def test_request_abandoned_at_deadline_updates_limit():
+    middleware, controller = make_middleware(hang)
+    app = DeadlineMiddleware(middleware, [], timeout=0.05, grace=0)
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    with mock.patch.object(controller.limit, "update", wraps=controller.limit.update) as update:
+        asyncio.run(app(http_scope(), never_disconnect, send))
+
+    assert sent[0]["status"] == 504
+    (rtt, inflight), _ = update.call_args
+    assert rtt >= 0.05 and inflight == 1
+    assert controller.inflight == 0
+
+
+def test_request_cancelled_by_disconnect_leaves_limit_alone():
+    middleware, controller = make_middleware(hang)
+
+    async def run():
+        task = asyncio.ensure_future(middleware(http_scope(), never_disconnect, None))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    with mock.patch.object(controller.limit, "update") as update:
+        asyncio.run(run())
+
+    update.assert_not_called()
+    assert controller.inflight == 0
+
+
+def test_blocking_endpoints_run_concurrently_and_excess_is_shed():
+    app = FastAPI()
+    lock = threading.Lock()
+    running = {"now": 0, "peak": 0}
+
+    @app.get("/slow")
+    def slow():
+        with lock:
+            running["now"] += 1
+            running["peak"] = max(running["peak"], running["now"])
+        time.sleep(0.1)
+        with lock:
+            running["now"] -= 1
+
+    middleware, controller = make_middleware(app, limit={"initial": 2, "min_limit": 2}, queue_size=0)
+
+    async def request():
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        await middleware(http_scope(), never_disconnect, send)
+        return sent[0]["status"]
+
+    async def run():
+        return await asyncio.gather(*(request() for _ in range(4)))
+
+    statuses = asyncio.run(run())
+
+    assert sorted(statuses) == [200, 200, 503, 503]
+    assert running["peak"] == 2
+    assert controller.shed == {"read": 2} and controller.inflight == 0
@@ -0,0 +1,75 @@
+from unittest import mock
+
+import pytest
+
+from breaker import CircuitBreaker, CircuitOpenError
+
+
+def open_breaker():
+    breaker = CircuitBreaker("test", min_calls=2, open_duration=5.0)
+    breaker.record(False)
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+    return breaker
+
+
+def probe(breaker):
+    with mock.patch("breaker.time.monotonic", return_value=breaker.opened_at + breaker.open_duration):
+        return breaker.check()
+
+
+def test_closed_breaker_allows_ordinary_calls():
+    breaker = CircuitBreaker("test")
+
+    assert breaker.check() == 0
+
+
+def test_open_breaker_refuses_calls():
+    breaker = open_breaker()
+
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_probe_outcome_decides_half_open_state():
+    breaker = open_breaker()
+    token = probe(breaker)
+    assert token and breaker.state == CircuitBreaker.HALF_OPEN
+
+    breaker.record(True, 0.01, token)
+
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failed_probe_opens_breaker_again():
+    breaker = open_breaker()
+    token = probe(breaker)
+
+    breaker.record(False, 0.01, token)
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.times_opened == 2
+
+
+def test_outcomes_of_other_calls_are_ignored_while_half_open():
+    breaker = open_breaker()
+    token = probe(breaker)
+
+    # A call admitted before the breaker opened, then a probe that was replaced
+    breaker.record(True, 0.01)
+    breaker.record(True, 0.01, token - 1)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    breaker.record(False, 0.01, token)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_replaced_probe_gets_a_new_token():
+    breaker = open_breaker()
+    first = probe(breaker)
+
+    with mock.patch("breaker.time.monotonic", return_value=breaker.probe_started_at + breaker.open_duration):
+        second = breaker.check()
+
+    breaker.record(True, 0.01, first)
+    assert second != first and breaker.state == CircuitBreaker.HALF_OPEN
@@ -0,0 +1,141 @@
+import threading
+import time
+from unittest import mock
+
+import pytest
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+from dbpool import BlockingThreadedConnectionPool, PoolExhausted, PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.info = mock.Mock(transaction_status=extensions.TRANSACTION_STATUS_IDLE)
+        self.rollback = mock.Mock()
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def connect():
+    with mock.patch("dbpool.psycopg2.connect", side_effect=lambda *args, **kwargs: FakeConnection()) as connect:
+        yield connect
+
+
+def make_pool(maxconn=1, **kwargs):
+    kwargs.setdefault("timeout", 1.0)
+    kwargs.setdefault("leak_threshold", 0)
+    return BlockingThreadedConnectionPool(0, maxconn, **kwargs)
+
+
+def checkout_in_thread(pool, **kwargs):
+    result = {}
+
+    def run():
+        try:
+            result["connection"] = pool.getconn(**kwargs)
+        except Exception as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    # Wait until the caller is queued
+    deadline = time.monotonic() + 1.0
+    while not pool.waiters and thread.is_alive() and time.monotonic() < deadline:
+        time.sleep(0.001)
+    return thread, result
+
+
+def test_released_connection_is_handed_to_waiter(connect):
+    pool = make_pool()
+    held = pool.getconn()
+
+    thread, result = checkout_in_thread(pool)
+    assert pool.stats()["waiting"] == 1
+    pool.putconn(held)
+    thread.join(1.0)
+
+    assert result["connection"] is held
+    assert connect.call_count == 1
+
+
+def test_checkout_times_out(connect):
+    pool = make_pool()
+    pool.getconn()
+
+    with pytest.raises(PoolTimeout):
+        pool.getconn(timeout=0.01)
+
+    stats = pool.stats()
+    assert stats["timeouts"] == 1
+    assert stats["waiting"] == 0
+
+
+def test_full_wait_queue_rejects_checkout(connect):
+    pool = make_pool(max_waiting=1)
+    pool.getconn()
+    thread, _ = checkout_in_thread(pool, timeout=0.2)
+
+    with pytest.raises(PoolExhausted):
+        pool.getconn()
+
+    thread.join(1.0)
+    assert pool.stats()["rejected"] == 1
+
+
+def test_closeall_wakes_waiters_and_closes_returned_connections(connect):
+    pool = make_pool()
+    held = pool.getconn()
+    thread, result = checkout_in_thread(pool)
+
+    pool.closeall()
+    thread.join(1.0)
+
+    assert isinstance(result["error"], PoolError)
+    pool.putconn(held)
+    assert held.closed
+    with pytest.raises(PoolError):
+        pool.getconn()
+
+
+@pytest.mark.parametrize("break_connection", [
+    lambda connection: setattr(connection, "closed", 2),
+    lambda connection: setattr(connection.info, "transaction_status", extensions.TRANSACTION_STATUS_UNKNOWN),
+])
+def test_broken_connection_hands_its_slot_to_waiter(connect, break_connection):
+    pool = make_pool()
+    held = pool.getconn()
+    thread, result = checkout_in_thread(pool)
+
+    break_connection(held)
+    pool.putconn(held)
+    thread.join(1.0)
+
+    # The waiter opens a new connection in the freed slot
+    assert result["connection"] is not held
+    assert connect.call_count == 2
+    assert pool.stats()["open"] == 1
+
+
+def test_open_transaction_is_rolled_back_on_release(connect):
+    pool = make_pool()
+    connection = pool.getconn()
+    connection.info.transaction_status = extensions.TRANSACTION_STATUS_INTRANS
+
+    pool.putconn(connection)
+
+    connection.rollback.assert_called_once()
+    assert pool.getconn() is connection
+
+
+def test_failed_connect_frees_its_slot(connect):
+    pool = make_pool()
+    connect.side_effect = OSError("refused")
+
+    with pytest.raises(OSError):
+        pool.getconn()
+
+    assert pool.stats()["open"] == 0
@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import time
+
+from fastapi import FastAPI
+
+from deadline import DeadlineMiddleware, current_scope
+
+
+def http_scope(headers=()):
+    return {"type": "http", "method": "GET", "path": "/work", "query_string": b"", "headers": list(headers)}
+
+
+async def never_disconnect():
+    await asyncio.sleep(10)
+
+
+def run(app, receive=never_disconnect, headers=()):
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(http_scope(headers), receive, send))
+    return sent
+
+
+async def respond(send, status=200):
+    await send({"type": "http.response.start", "status": status, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def test_response_passes_through_with_scope_set():
+    seen = {}
+
+    async def handler(scope, receive, send):
+        seen["remaining"] = current_scope.get().remaining()
+        await respond(send)
+
+    sent = run(DeadlineMiddleware(handler, [], timeout=5))
+
+    assert [message["type"] for message in sent] == ["http.response.start", "http.response.body"]
+    assert 0 < seen["remaining"] <= 5
+
+
+def test_client_header_shortens_budget():
+    seen = {}
+
+    async def handler(scope, receive, send):
+        seen["remaining"] = current_scope.get().remaining()
+        await respond(send)
+
+    run(DeadlineMiddleware(handler, [], timeout=5), headers=[(b"x-request-timeout", b"0.5")])
+
+    assert seen["remaining"] <= 0.5
+
+
+def test_handler_past_deadline_is_abandoned_with_504():
+    seen = {}
+
+    async def handler(scope, receive, send):
+        seen["scope"] = current_scope.get()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            seen["cancelled"] = True
+            raise
+
+    sent = run(DeadlineMiddleware(handler, [], timeout=0.05, grace=0))
+
+    assert sent[0]["status"] == 504
+    assert seen["cancelled"] and seen["scope"].cancelled
+
+
+def test_blocking_endpoint_runs_off_the_loop_and_gets_504():
+    seen = {}
+    finished = threading.Event()
+    app = FastAPI()
+
+    @app.get("/work")
+    def work():
+        request_scope = current_scope.get()
+        time.sleep(0.3)
+        seen["cancelled"] = request_scope.cancelled
+        finished.set()
+
+    sent = []
+    started = time.monotonic()
+
+    async def send(message):
+        sent.append((message, time.monotonic() - started))
+
+    asyncio.run(DeadlineMiddleware(app, [], timeout=0.05, grace=0)(http_scope(), never_disconnect, send))
+
+    message, at = sent[0]
+    assert message["status"] == 504 and at < 0.3
+    # The worker thread sees the request's scope and learns it was abandoned
+    assert finished.wait(1) and seen["cancelled"]
+
+
+def test_disconnect_cancels_handler_without_response():
+    seen = {}
+
+    async def handler(scope, receive, send):
+        seen["scope"] = current_scope.get()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            seen["cancelled"] = True
+            raise
+
+    async def disconnect():
+        await asyncio.sleep(0.01)
+        return {"type": "http.disconnect"}
+
+    sent = run(DeadlineMiddleware(handler, [], timeout=5), receive=disconnect)
+
+    assert sent == []
+    assert seen["cancelled"] and seen["scope"].cancelled
+
+
+def test_work_after_response_is_not_bounded():
+    seen = {}
+
+    async def handler(scope, receive, send):
+        await respond(send)
+        # A background task, running past the request's budget
+        await asyncio.sleep(0.1)
+        request_scope = current_scope.get()
+        seen["remaining"] = request_scope.remaining()
+        seen["cancelled"] = request_scope.cancelled
+
+    sent = run(DeadlineMiddleware(handler, [], timeout=0.05, grace=0))
+
+    assert sent[0]["status"] == 200
+    assert seen == {"remaining": None, "cancelled": False}
@@ -0,0 +1,67 @@
+from unittest import mock
+
+import pytest
+from redis.connection import Connection
+from redis.exceptions import ConnectionError, ReadOnlyError
+
+from failover import BlockingSentinelConnectionPool, CachingSentinel, GuardedConnection
+
+
+def make_pool(*addresses):
+    sentinel = mock.MagicMock()
+    sentinel.discover_master.side_effect = list(addresses)
+    return BlockingSentinelConnectionPool("mymaster", sentinel, max_connections=2, timeout=0.1)
+
+
+def test_master_change_closes_idle_connections_only():
+    pool = make_pool(("10.0.0.1", 6379), ("10.0.0.2", 6379))
+    idle, in_use = mock.MagicMock(), mock.MagicMock()
+    pool.pool.queue[-1] = idle
+    pool._connections += [idle, in_use]
+
+    assert pool.get_master_address() == ("10.0.0.1", 6379)
+    # Sentinel's proxy calls disconnect(inuse_connections=False) on a new address
+    assert pool.get_master_address() == ("10.0.0.2", 6379)
+
+    assert idle.disconnect.called
+    in_use.disconnect.assert_not_called()
+
+
+def test_disconnect_closes_connections_in_use_by_default():
+    pool = make_pool()
+    idle, in_use = mock.MagicMock(), mock.MagicMock()
+    pool.pool.queue[-1] = idle
+    pool._connections += [idle, in_use]
+
+    pool.disconnect()
+
+    idle.disconnect.assert_called_once()
+    in_use.disconnect.assert_called_once()
+
+
+def make_caching_pool():
+    sentinel = CachingSentinel([])
+    sentinel.set_master("mymaster", ("10.0.0.1", 6379))
+    pool = BlockingSentinelConnectionPool("mymaster", sentinel, max_connections=2, timeout=0.1)
+    return sentinel, GuardedConnection(connection_pool=pool)
+
+
+def test_demoted_master_is_forgotten():
+    sentinel, connection = make_caching_pool()
+
+    with mock.patch.object(Connection, "read_response", side_effect=ReadOnlyError("READONLY")):
+        with mock.patch.object(connection, "disconnect"):
+            with pytest.raises(ConnectionError):
+                connection.read_response()
+
+    assert "mymaster" not in sentinel.masters
+
+
+def test_unreachable_master_is_forgotten():
+    sentinel, connection = make_caching_pool()
+
+    with mock.patch.object(Connection, "connect", side_effect=ConnectionError("refused")):
+        with pytest.raises(ConnectionError):
+            connection.connect()
+
+    assert "mymaster" not in sentinel.masters
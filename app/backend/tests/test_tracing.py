@@ -0,0 +1,37 @@
+from unittest import mock
+
+from tracing import NOOP_SPAN, Tracer
+
+SAMPLED = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+UNSAMPLED = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-00"
+
+
+def test_sampled_parent_is_continued():
+    tracer = Tracer(mock.Mock(), sample_rate=0)
+
+    span = tracer.start_trace("GET /tasks/", SAMPLED)
+
+    assert span.trace_id == "4bf92f3577b34da6a3ce929d0e0e4736"
+    assert span.parent_id == "00f067aa0ba902b7"
+
+
+def test_unsampled_parent_is_not_recorded():
+    tracer = Tracer(mock.Mock(), sample_rate=1)
+
+    assert tracer.start_trace("GET /tasks/", UNSAMPLED) is NOOP_SPAN
+
+
+def test_sampled_parents_are_capped():
+    tracer = Tracer(mock.Mock(), sample_rate=0, parent_sample_limit=2)
+
+    with mock.patch("tracing.time.monotonic", return_value=tracer.parent_refilled):
+        spans = [tracer.start_trace("GET /tasks/", SAMPLED) for _ in range(5)]
+
+    assert sum(span is not NOOP_SPAN for span in spans) == 2
+    assert tracer.stats()["parent_sampled_refused"] == 3
+
+
+def test_parent_flag_can_be_ignored():
+    tracer = Tracer(mock.Mock(), sample_rate=0, parent_sample_limit=0)
+
+    assert tracer.start_trace("GET /tasks/", SAMPLED) is NOOP_SPAN
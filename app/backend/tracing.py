@@ -0,0 +1,498 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+
+from admission import route_key
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """A timed operation within a trace; ended spans go to the tracer's processor."""
+
+    __slots__ = ("tracer", "trace_id", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, tracer: "Tracer", trace_id: str, parent_id: Optional[str], name: str, kind: str, attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def record_exception(self, exc: BaseException):
+        self.error = f"{type(exc).__name__}: {exc}"
+
+    def end(self):
+        if not self.end_ns:
+            self.end_ns = time.time_ns()
+            self.tracer.processor.on_end(self)
+
+    @property
+    def traceparent(self) -> str:
+        """W3C traceparent header value naming this span as the parent."""
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_unix_nano": self.start_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class NoopSpan:
+    """Stands in for spans of unsampled traces, so callers never check."""
+
+    traceparent = None
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def record_exception(self, exc: BaseException):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+# Span of the current request or job; None outside sampled traces
+current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """
+    Parse a W3C traceparent header.
+
+    Args:
+        header: e.g. "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+
+    Returns:
+        Trace ID, parent span ID and the sampled flag, or None if malformed
+    """
+    if not header:
+        return None
+    parts = header.strip().lower().split("-")
+    if len(parts) < 4 or len(parts[0]) != 2 or parts[0] == "ff":
+        return None
+    _, trace_id, parent_id, flags = parts[:4]
+    if len(trace_id) != 32 or len(parent_id) != 16 or len(flags) != 2:
+        return None
+    try:
+        int(trace_id, 16), int(parent_id, 16)
+        sampled = bool(int(flags, 16) & 1)
+    except ValueError:
+        return None
+    if trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None
+    return trace_id, parent_id, sampled
+
+
+class JsonLinesExporter:
+    """Append spans to a local file, one JSON object per line, for offline analysis."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: List[Span]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(span.to_dict(), default=str) + "\n" for span in spans))
+
+
+# OTLP SpanKind values
+SPAN_KINDS = {"internal": 1, "server": 2, "client": 3, "producer": 4, "consumer": 5}
+
+
+class OTLPHttpExporter:
+    """Post spans to an OpenTelemetry collector as OTLP/HTTP JSON."""
+
+    def __init__(self, endpoint: str, service_name: str, timeout: float = 5.0):
+        """
+        Args:
+            endpoint: Traces URL, e.g. "http://otel-collector:4318/v1/traces"
+            service_name: Reported as the service.name resource attribute
+            timeout: Seconds to wait for the collector
+        """
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+
+    @staticmethod
+    def attribute(key: str, value: Any) -> Dict[str, Any]:
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    def encode(self, span: Span) -> Dict[str, Any]:
+        encoded = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": SPAN_KINDS.get(span.kind, 1),
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": [self.attribute(key, value) for key, value in span.attributes.items()],
+            # STATUS_CODE_OK or STATUS_CODE_ERROR
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id:
+            encoded["parentSpanId"] = span.parent_id
+        return encoded
+
+    def export(self, spans: List[Span]):
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": [self.attribute("service.name", self.service_name)]},
+                "scopeSpans": [{"scope": {"name": "todo-backend"}, "spans": [self.encode(span) for span in spans]}],
+            }]
+        }
+        request = urllib.request.Request(
+            self.endpoint, data=json.dumps(body).encode("utf-8"), headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class BatchSpanProcessor:
+    """
+    Hands ended spans to an exporter in batches from a background thread, so
+    requests never wait on the exporter. Spans are dropped, and counted, when
+    the queue is full. The thread is started on first use in every process,
+    since forked server workers do not inherit it.
+    """
+
+    def __init__(self, exporter, max_queue_size: int = 2048, batch_size: int = 256, interval: float = 2.0):
+        """
+        Args:
+            exporter: Object with an export(spans) method
+            max_queue_size: Spans buffered before new ones are dropped
+            batch_size: Most spans per export call
+            interval: Seconds between exports while spans trickle in
+        """
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue: queue.Queue = queue.Queue(max_queue_size)
+        self.dropped = 0
+        self.exported = 0
+        self.pid = None
+        self.start_lock = threading.Lock()
+
+    def on_end(self, span: Span):
+        if self.pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            threading.Thread(target=self.run, name="span-exporter", daemon=True).start()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            self.export(batch)
+
+    def export(self, batch: List[Span]):
+        try:
+            self.exporter.export(batch)
+            self.exported += len(batch)
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.warning(f"Exporting {len(batch)} spans failed: {e}")
+
+    def flush(self):
+        """Export whatever is queued, e.g. on shutdown."""
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self.export(batch)
+
+
+class Tracer:
+    """
+    Creates spans for sampled traces.
+    Whether a trace is sampled is decided once at its root: an incoming
+    traceparent's flag is honoured up to parent_sample_limit traces per
+    second, since any client can set it; other traces, and those over the
+    limit, are kept at sample_rate. Child spans of unsampled traces cost a
+    contextvar lookup.
+    """
+
+    def __init__(self, processor: Optional[BatchSpanProcessor], sample_rate: float = 0.01, parent_sample_limit: float = 10.0):
+        """
+        Args:
+            processor: Receives ended spans; None turns tracing off
+            sample_rate: Share of traces without a sampled parent that are recorded
+            parent_sample_limit: Traces per second recorded because their parent
+                was sampled, 0 to ignore the parent's flag
+        """
+        self.processor = processor
+        self.sample_rate = sample_rate
+        self.parent_sample_limit = parent_sample_limit
+        # Token bucket holding up to a second's worth of parent-sampled traces
+        self.parent_burst = max(1.0, parent_sample_limit) if parent_sample_limit > 0 else 0.0
+        self.parent_tokens = self.parent_burst
+        self.parent_refilled = time.monotonic()
+        self.parent_lock = threading.Lock()
+        self.parent_refused = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.processor is not None
+
+    def start_trace(self, name: str, traceparent: Optional[str] = None, kind: str = "server", attributes: Optional[Dict[str, Any]] = None) -> Any:
+        """
+        Start the root span of a request or job, continuing a remote trace if given.
+        The span is not made current; see `trace`.
+
+        Args:
+            name: Span name
+            traceparent: W3C traceparent of a remote parent, if any
+            kind: One of SPAN_KINDS
+            attributes: Initial span attributes
+
+        Returns:
+            The span, or NOOP_SPAN if the trace is not sampled
+        """
+        if self.processor is None:
+            return NOOP_SPAN
+        parent = parse_traceparent(traceparent)
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+            if sampled and not self.admit_parent():
+                sampled = random.random() < self.sample_rate
+        else:
+            trace_id, parent_id, sampled = None, None, random.random() < self.sample_rate
+        if not sampled:
+            return NOOP_SPAN
+        return Span(self, trace_id or f"{random.getrandbits(128):032x}", parent_id, name, kind, attributes or {})
+
+    def admit_parent(self) -> bool:
+        """Take a token for a trace sampled because of its parent, if one is left."""
+        with self.parent_lock:
+            now = time.monotonic()
+            self.parent_tokens = min(
+                self.parent_burst,
+                self.parent_tokens + (now - self.parent_refilled) * self.parent_sample_limit,
+            )
+            self.parent_refilled = now
+            if self.parent_tokens >= 1:
+                self.parent_tokens -= 1
+                return True
+            self.parent_refused += 1
+            return False
+
+    def start_span(self, name: str, kind: str = "internal", attributes: Optional[Dict[str, Any]] = None) -> Any:
+        """
+        Start a child of the current span without making it current, e.g. in
+        paired event hooks.
+
+        Args:
+            name: Span name
+            kind: One of SPAN_KINDS
+            attributes: Initial span attributes
+
+        Returns:
+            The span, or NOOP_SPAN outside sampled traces
+        """
+        parent = current_span.get()
+        if parent is None:
+            return NOOP_SPAN
+        return Span(self, parent.trace_id, parent.span_id, name, kind, attributes or {})
+
+    @contextmanager
+    def activate(self, span: Any) -> Iterator[Any]:
+        """Make a span current, and end it, for the duration of the block."""
+        if span is NOOP_SPAN:
+            yield span
+            return
+        token = current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            current_span.reset(token)
+            span.end()
+
+    def span(self, name: str, kind: str = "internal", attributes: Optional[Dict[str, Any]] = None):
+        """Context manager timing a child of the current span."""
+        return self.activate(self.start_span(name, kind, attributes))
+
+    def trace(self, name: str, traceparent: Optional[str] = None, kind: str = "server", attributes: Optional[Dict[str, Any]] = None):
+        """Context manager timing the root span of a request or job."""
+        return self.activate(self.start_trace(name, traceparent, kind, attributes))
+
+    def traced(self, name: str, kind: str = "internal") -> Callable:
+        """Decorator timing every call of a function, sync or async, as a child span."""
+        def decorator(func: Callable) -> Callable:
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    if current_span.get() is None:
+                        return await func(*args, **kwargs)
+                    with self.span(name, kind):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if current_span.get() is None:
+                    return func(*args, **kwargs)
+                with self.span(name, kind):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def stats(self) -> Dict[str, Any]:
+        if self.processor is None:
+            return {"enabled": False}
+        return {
+            "enabled": True,
+            "sample_rate": self.sample_rate,
+            "parent_sample_limit": self.parent_sample_limit,
+            "parent_sampled_refused": self.parent_refused,
+            "queued": self.processor.queue.qsize(),
+            "exported": self.processor.exported,
+            "dropped": self.processor.dropped,
+        }
+
+
+def traceparent() -> Optional[str]:
+    """traceparent header value for outgoing work of the current span, if sampled."""
+    span = current_span.get()
+    return span.traceparent if span is not None else None
+
+
+def trace_methods(prefix: str, kind: str = "client") -> Callable:
+    """
+    Class decorator timing every public method as a child span named
+    "<prefix>.<method>".
+    """
+    def decorator(cls):
+        for name, member in list(vars(cls).items()):
+            if name.startswith("_") or not inspect.isfunction(member):
+                continue
+            setattr(cls, name, tracer.traced(f"{prefix}.{name}", kind)(member))
+        return cls
+    return decorator
+
+
+class TracingMiddleware:
+    """
+    Record a server span per request, named after its route, continuing the
+    caller's trace from a traceparent header. Sampled responses carry a
+    traceparent header so clients can look their request up.
+    """
+
+    def __init__(self, app: ASGIApp, tracer: "Tracer", routes):
+        """
+        Args:
+            app: The wrapped ASGI application
+            tracer: Starts the request spans
+            routes: The app's routes, used to name the spans
+        """
+        self.app = app
+        self.tracer = tracer
+        self.routes = routes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        header = None
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                header = value.decode("latin-1")
+                break
+        key = route_key(self.routes, scope)
+        span = self.tracer.start_trace(key, header, attributes={
+            "http.request.method": scope["method"],
+            "http.route": key.split(" ", 1)[1],
+            "url.path": scope["path"],
+        })
+        if span is NOOP_SPAN:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                span.set_attribute("http.response.status_code", message["status"])
+                if message["status"] >= 500:
+                    span.error = f"HTTP {message['status']}"
+                MutableHeaders(scope=message)["traceparent"] = span.traceparent
+            await send(message)
+
+        with self.tracer.activate(span):
+            await self.app(scope, receive, send_wrapper)
+
+
+def create_tracer() -> Tracer:
+    """Build the tracer configured by the TRACING_* settings."""
+    exporter = None
+    if settings.TRACING_EXPORTER == "jsonl":
+        exporter = JsonLinesExporter(settings.TRACING_JSONL_PATH)
+    elif settings.TRACING_EXPORTER == "otlp":
+        exporter = OTLPHttpExporter(settings.TRACING_OTLP_ENDPOINT, settings.TRACING_SERVICE_NAME)
+    elif settings.TRACING_EXPORTER:
+        logger.warning(f"Unknown tracing exporter {settings.TRACING_EXPORTER}, tracing disabled")
+    processor = BatchSpanProcessor(exporter) if exporter is not None else None
+    return Tracer(
+        processor,
+        sample_rate=settings.TRACING_SAMPLE_RATE,
+        parent_sample_limit=settings.TRACING_PARENT_SAMPLE_LIMIT,
+    )
+
+
+# Singleton instance
+tracer = create_tracer()
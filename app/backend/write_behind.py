@@ -0,0 +1,259 @@
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+from sqlalchemy import Integer, cast, column, update, values
+from sqlalchemy.orm import Session
+from fastapi import HTTPException, status
+import logging
+import orjson
+import time
+
+from config import settings
+from database import SessionLocal, Task
+from manager import RedisManager, redis_manager
+from serializers import render_json
+from task_cache import TaskFragmentCache, task_cache
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Record one edit: merge the changed fields into the task's pending hash, mark
+# the task dirty (keeping the time of its oldest unflushed edit) and store the
+# merged fragment, all in one step. The edit is rejected with 0 if the cached
+# task is no longer at the version the fragment was built from.
+# KEYS: pending hash, dirty set, fragments hash
+# ARGV: task ID, now (ms), fragment, fragments TTL, base version, field/value pairs...
+RECORD_EDIT_SCRIPT = """
+local current = redis.call('HGET', KEYS[3], ARGV[1])
+if not current or cjson.decode(current)['version'] ~= tonumber(ARGV[5]) then
+    return 0
+end
+for i = 6, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('ZADD', KEYS[2], 'NX', ARGV[2], ARGV[1])
+redis.call('HSET', KEYS[3], ARGV[1], ARGV[3])
+redis.call('EXPIRE', KEYS[3], ARGV[4])
+return 1
+"""
+
+# Claim the oldest dirty tasks: return and remove their pending changes so that
+# concurrent flushers in other workers never write the same edit twice.
+# KEYS: dirty set
+# ARGV: pending hash key prefix, batch size
+CLAIM_SCRIPT = """
+local ids = redis.call('ZRANGE', KEYS[1], 0, tonumber(ARGV[2]) - 1)
+local claimed = {}
+for _, id in ipairs(ids) do
+    local key = ARGV[1] .. id
+    claimed[#claimed + 1] = id
+    claimed[#claimed + 1] = redis.call('HGETALL', key)
+    redis.call('DEL', key)
+end
+if #ids > 0 then
+    redis.call('ZREM', KEYS[1], unpack(ids))
+end
+return claimed
+"""
+
+
+class TaskWriteBehind:
+    """
+    Write-behind buffer for task updates.
+    An update is applied to the cached task fragment and merged into a per-task
+    pending hash in Redis; the task ID goes into a dirty set. flush() claims the
+    dirty tasks and writes all their coalesced changes with one
+    UPDATE ... FROM (VALUES ...) per combination of changed fields, so a burst
+    of edits to one task costs a single row write.
+    """
+
+    DIRTY_KEY = "tasks:dirty"
+    PENDING_PREFIX = "tasks:pending:"
+
+    def __init__(self, redis_manager: RedisManager, cache: TaskFragmentCache, batch_size: int = 500):
+        """
+        Args:
+            redis_manager: Redis manager whose master holds the buffer
+            cache: Fragment cache that serves the buffered state
+            batch_size: Tasks written per UPDATE round
+        """
+        self.redis_manager = redis_manager
+        self.cache = cache
+        self.batch_size = batch_size
+        self.scripts = {
+            "record": redis_manager.master.register_script(RECORD_EDIT_SCRIPT),
+            "claim": redis_manager.master.register_script(CLAIM_SCRIPT),
+        }
+
+    def update(self, db: Session, task_id: int, changes: Dict[str, Any], expected_version: Optional[int] = None, attempts: int = 3) -> Optional[str]:
+        """
+        Apply an update to the cached task and buffer it for the database.
+        The cached version is checked and incremented atomically, so concurrent
+        edits are merged instead of overwriting each other's fragment.
+
+        Args:
+            db: Database session, used only if the task is not cached
+            task_id: The ID of the task to update
+            changes: Changed fields and their new values
+            expected_version: Version the client based its changes on (If-Match)
+            attempts: Times to rebuild the edit when another edit wins the race
+
+        Returns:
+            JSON object of the updated task, or None if it does not exist
+
+        Raises:
+            HTTPException: If the task is not at expected_version, or stays contended
+            Exception: If the edit could not be buffered
+        """
+        for _ in range(attempts):
+            fragment = self.cache.get(db, task_id)
+            if fragment is None:
+                return None
+
+            task = orjson.loads(fragment)
+            version = task["version"]
+            if expected_version is not None and version != expected_version:
+                raise HTTPException(
+                    status_code=status.HTTP_412_PRECONDITION_FAILED,
+                    detail=f"Task with ID {task_id} was modified; current version is {version}",
+                )
+
+            edit = dict(changes, updated_at=datetime.now(timezone.utc).replace(tzinfo=None), version=version + 1)
+            task.update(edit)
+            fragment = render_json(task).decode("utf-8")
+
+            args = [task_id, int(time.time() * 1000), fragment, self.cache.expire, version]
+            for field, value in edit.items():
+                args += [field, orjson.dumps(value)]
+            with tracer.span("redis.write_behind.record", "client"):
+                recorded = self.scripts["record"](
+                    keys=[f"{self.PENDING_PREFIX}{task_id}", self.DIRTY_KEY, self.cache.KEY], args=args
+                )
+            if recorded:
+                return fragment
+
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Task with ID {task_id} is being modified concurrently; retry",
+        )
+
+    @tracer.traced("redis.write_behind.discard", "client")
+    def discard(self, task_id: int) -> bool:
+        """
+        Drop buffered changes of a deleted task.
+
+        Args:
+            task_id: The ID of the deleted task
+
+        Returns:
+            bool: Success status
+        """
+        try:
+            pipe = self.redis_manager.master.pipeline(transaction=True)
+            pipe.delete(f"{self.PENDING_PREFIX}{task_id}")
+            pipe.zrem(self.DIRTY_KEY, task_id)
+            pipe.execute()
+            return True
+        except Exception as e:
+            logger.error(f"Failed to discard buffered changes of task {task_id}: {e}")
+            return False
+
+    @tracer.traced("redis.write_behind.claim", "client")
+    def claim(self) -> Dict[int, Dict[str, Any]]:
+        """
+        Take a batch of dirty tasks and their coalesced changes out of Redis.
+
+        Returns:
+            Mapping of task ID to changed fields
+        """
+        claimed = self.scripts["claim"](
+            keys=[self.DIRTY_KEY], args=[self.PENDING_PREFIX, self.batch_size]
+        )
+        changes = {}
+        for task_id, fields in zip(claimed[::2], claimed[1::2]):
+            changes[int(task_id)] = {
+                name: orjson.loads(value) for name, value in zip(fields[::2], fields[1::2])
+            }
+        return changes
+
+    @tracer.traced("redis.write_behind.requeue", "client")
+    def requeue(self, changes: Dict[int, Dict[str, Any]]):
+        """
+        Put claimed changes back after a failed write.
+        Fields edited again in the meantime keep their newer values.
+
+        Args:
+            changes: Mapping of task ID to changed fields
+        """
+        now = int(time.time() * 1000)
+        pipe = self.redis_manager.master.pipeline(transaction=True)
+        for task_id, fields in changes.items():
+            for name, value in fields.items():
+                pipe.hsetnx(f"{self.PENDING_PREFIX}{task_id}", name, orjson.dumps(value))
+            pipe.zadd(self.DIRTY_KEY, {task_id: now}, nx=True)
+        pipe.execute()
+
+    @staticmethod
+    def write(db: Session, changes: Dict[int, Dict[str, Any]]) -> int:
+        """
+        Write coalesced changes with one UPDATE ... FROM (VALUES ...) per
+        combination of changed fields.
+
+        Args:
+            db: Database session
+            changes: Mapping of task ID to changed fields
+
+        Returns:
+            int: Number of rows updated
+        """
+        groups = defaultdict(list)
+        for task_id, fields in changes.items():
+            groups[tuple(sorted(fields))].append((task_id, fields))
+
+        updated = 0
+        table = Task.__table__
+        for names, tasks in groups.items():
+            # Values arrive as JSON scalars; cast them to the column types
+            rows = values(column("id", Integer), *(column(name) for name in names), name="changes").data(
+                [(task_id, *(fields[name] for name in names)) for task_id, fields in tasks]
+            )
+            statement = (
+                update(table)
+                .where(table.c.id == rows.c.id)
+                .values({name: cast(rows.c[name], table.c[name].type) for name in names})
+            )
+            updated += db.execute(statement).rowcount
+        db.commit()
+        return updated
+
+    def flush(self) -> int:
+        """
+        Write every buffered change to the database.
+
+        Returns:
+            int: Number of tasks written
+        """
+        flushed = 0
+        while True:
+            changes = self.claim()
+            if not changes:
+                break
+
+            db = SessionLocal()
+            try:
+                self.write(db, changes)
+            except Exception:
+                db.rollback()
+                self.requeue(changes)
+                raise
+            finally:
+                db.close()
+
+            flushed += len(changes)
+            if len(changes) < self.batch_size:
+                break
+        return flushed
+
+
+# Singleton instance
+task_write_behind = TaskWriteBehind(redis_manager, task_cache, batch_size=settings.TASK_WRITE_BEHIND_BATCH_SIZE)
@@ -1,4 +1,5 @@
-import uvicorn
-
-if __name__ == "__main__":
-    uvicorn.run("app.backend.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+import uvicorn
+
+if __name__ == "__main__":
+    # Development server; production uses app/backend/server.py
+    uvicorn.run("main:app", app_dir="app/backend", host="0.0.0.0", port=8000, reload=True, reload_dirs=["app/backend"])
\ No newline at end of file